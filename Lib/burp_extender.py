@@ -18,7 +18,6 @@ import inspect
 import json
 import logging
 import os
-import re
 import signal
 import site
 import sys
@@ -29,11 +28,16 @@ import weakref
 sys.path.append(os.path.dirname(os.path.abspath(
     inspect.getfile(inspect.currentframe()))))
 
-from gds.burp import HttpRequest
+from gds.burp import HttpRecord, HttpRequest
 from gds.burp.config import Configuration, ConfigSection
 from gds.burp.core import Component, ComponentManager
 from gds.burp.decorators import callback
 from gds.burp.dispatchers import NewScanIssueDispatcher, PluginDispatcher
+from gds.burp.export import export
+from gds.burp.index import HistoryIndex, HistoryView
+from gds.burp.query import Query
+from gds.burp.search import FullTextIndexer
+from gds.burp.stats import HandlerStats
 from gds.burp.monitor import PluginMonitorThread
 
 import gds.burp.settings as settings
@@ -53,6 +57,9 @@ class BurpExtender(IBurpExtender, ComponentManager):
         ComponentManager.__init__(self)
         self.log = logging.getLogger(self.__class__.__name__)
         self.monitoring = {}
+        self.history_index = HistoryIndex(self)
+        self.history = HistoryView(self.history_index)
+        self.handler_stats = HandlerStats()
 
     def __repr__(self):
         return '<BurpExtender at %#x>' % (id(self), )
@@ -321,24 +328,118 @@ class BurpExtender(IBurpExtender, ComponentManager):
         return PluginDispatcher(self).processHttpMessage(
             toolName, messageIsRequest, messageInfo)
 
-    def getProxyHistory(self, *args):
+    def getProxyHistory(self, *args, **kwargs):
         '''
         This method returns a generator of all items in the proxy history.
 
-        :params *args: Optional strings to match against url.
-        '''
-        if args:
-            matchers = [re.compile(arg) for arg in args]
-            for request in self._check_and_callback(self.getProxyHistory):
-                for matcher in matchers:
-                    if matcher.search(request.getUrl().toString()):
-                        yield HttpRequest(request, _burp=self)
-                        break
+        Filtered queries are answered from :attr:`history_index`, which
+        is built on first use and kept up to date as proxy responses are
+        received, rather than by fetching and scanning the whole history.
+
+        :params *args: Optional strings (or regular expressions) to match
+        against the url, as Burp's ``getUrl()`` has it, i.e. always with
+        the port (e.g. ``r'example\.com:443/'``).
+        :param compact: if True, yield compact, read-only
+        :class:`~gds.burp.models.HttpRecord` objects rather than
+        :class:`~gds.burp.models.HttpRequest` objects. Use this when
+        holding on to large parts of the history.
+        :params **kwargs: Optional `host`, `path`, `method`, `status_code`
+        or `mime_type` values (or lists of values) to match, e.g.
+        ``Burp.getProxyHistory('api/v2', method='POST')``.
+        '''
+        if kwargs.pop('compact', False):
+            wrap = HttpRecord
+        else:
+            wrap = HttpRequest
+
+        if args or kwargs:
+            items = self.history_index.search(*args, **kwargs)
         else:
-            for request in self._check_and_callback(self.getProxyHistory):
-                yield HttpRequest(request, _burp=self)
+            items = self._check_and_callback(self.getProxyHistory)
+
+        for item in items:
+            yield wrap(item, _burp=self)
+
+    def query(self, query, compact=False):
+        '''
+        This method returns a generator of the items in the proxy history
+        matching query, e.g.
+        ``Burp.query('host=*.corp status>=500 resp.body~"token"')``.
+        See :mod:`gds.burp.query` for the query syntax.
+
+        :param query: a query string or :class:`~gds.burp.query.Query`.
+        :param compact: if True, yield compact, read-only
+        :class:`~gds.burp.models.HttpRecord` objects rather than
+        :class:`~gds.burp.models.HttpRequest` objects.
+        '''
+        if not isinstance(query, Query):
+            query = Query(query)
+
+        wrap = HttpRecord if compact else HttpRequest
 
-    history = property(lambda burp: list(burp.getProxyHistory()))
+        for item in query.search(self.history_index):
+            yield wrap(item, _burp=self)
+
+    def export(self, path, items=None, format=None):
+        '''
+        This method writes items to the file at path as NDJSON or HAR,
+        one item at a time, and returns the number of items written. See
+        :func:`gds.burp.export.export`.
+
+        .. code-block:: python
+            Burp.export('/tmp/history.har.gz')
+            Burp.export('/tmp/api.ndjson',
+                        Burp.getSiteMap('https://a.com/api'))
+
+        :param items: an iterable of items, defaulting to the proxy
+        history.
+        :param format: "ndjson" or "har", by default taken from the file
+        extension. Paths ending in ``.gz`` are compressed.
+        '''
+        if items is None:
+            items = self._check_and_callback(self.getProxyHistory)
+
+        return export(items, path, format)
+
+    def stats(self, reset=False):
+        '''
+        This method returns the call and error counts and latency
+        percentiles of each handler and observer so far, by dispatch
+        point and handler name. ``print Burp.handler_stats`` shows them
+        as a table, slowest first, and ``Burp.handler_stats.dumps()`` as
+        JSON. See :mod:`gds.burp.stats`.
+
+        .. code-block:: python
+            Burp.stats()['proxy.response']['FullTextIndexer']['p99_ms']
+
+        :param reset: if True, zero the counters after reading them.
+        '''
+        stats = self.handler_stats.snapshot()
+
+        if reset:
+            self.handler_stats.reset()
+
+        return stats
+
+    def search(self, query, compact=False):
+        '''
+        This method returns a generator of the messages in the full-text
+        index matching query, e.g. ``Burp.search('"api_key" token*')``.
+        The :class:`~gds.burp.search.FullTextIndexer` component must be
+        enabled as a `proxy.response` handler, or an exception is raised.
+
+        :param query: words, "quoted phrases" and prefix* terms, all of
+        which must be found in the request or response body.
+        :param compact: if True, yield compact, read-only
+        :class:`~gds.burp.models.HttpRecord` objects rather than
+        :class:`~gds.burp.models.HttpRequest` objects.
+        '''
+        if 'FullTextIndexer' not in self.config.getlist('handlers',
+                                                       'proxy.response'):
+            raise Exception('Full-text search is not enabled, add '
+                            'FullTextIndexer to proxy.response in [handlers]')
+
+        return FullTextIndexer(self).index.find(query, compact, _burp=self)
 
     @callback
     def addToSiteMap(self, item):
@@ -352,9 +453,11 @@ class BurpExtender(IBurpExtender, ComponentManager):
         a specific subset of the site map. The method performs a simple
         case-sensitive text match, returning all site map items whose URL
         begins with the specified prefix. If this parameter is null,
-        the entire site map is returned.
+        the entire site map is returned. Prefixes covered by another
+        prefix (e.g. ``https://a.com/api`` by ``https://a.com``) are
+        dropped, so that each item is only fetched and yielded once.
         '''
-        for urlPrefix in urlPrefixes or ('http', ):
+        for urlPrefix in _covering_prefixes(urlPrefixes or ('http', )):
             for item in self._check_and_callback(self.getSiteMap, urlPrefix):
                 yield HttpRequest(item, _burp=self)
 
@@ -625,6 +728,19 @@ class ConsoleThread(Thread):
                 pass
 
 
+def _covering_prefixes(prefixes):
+    '''
+    Returns the smallest subset of prefixes matching the same strings.
+    Once sorted, strings starting with a prefix directly follow it, so
+    only the last prefix kept needs checking.
+    '''
+    covering = []
+    for prefix in sorted(set(prefixes)):
+        if not covering or not prefix.startswith(covering[-1]):
+            covering.append(prefix)
+    return covering
+
+
 def _get_menus(menu_module):
     module = menu_module.split('.')
     klass = module.pop()
@@ -6,4 +6,5 @@ gds.burp
 :copyright: (c) 2012 by Marcin Wielgoszewski.
 :license: ISC, see LICENSE for more details.
 '''
-from .models import HttpRequest, HttpResponse
+from .models import HttpRecord, HttpRequest, HttpRequestResponse, \
+    HttpResponse
@@ -8,6 +8,25 @@ This module implements the Jython Burp Plugin API.
 Plugins written in Jython can implement the interfaces in this
 package in order to register for various methods exposed by
 Burp Extender.
+
+Request and response handlers may narrow down the messages they are
+called with through class attributes, which are checked against the
+service and the head of each message before it is parsed. A message is
+only parsed into an :class:`HttpRequest <HttpRequest>` if it matches at
+least one handler::
+
+    class LogApiErrors(Component):
+        implements(IProxyResponseHandler)
+
+        match_hosts = ('*.example.com', )       # host globs
+        match_path = r'^/api/'                  # path regex
+        match_methods = ('GET', 'POST')
+        match_in_scope = True                   # in Burp's target scope
+        match_mime_types = ('application/json', 'text/*')  # responses
+        match_max_size = 1024 * 1024            # body size, in bytes
+        match = 'status>=500'                   # see :mod:`gds.burp.query`
+
+Attributes that are left out match every message.
 '''
 from .core import Interface
 
@@ -20,6 +39,7 @@ __all__ = [
     'IIntruderResponseHandler',
     'IProxyRequestHandler',
     'IProxyResponseHandler',
+    'IProxyResponseObserver',
     'IRepeaterRequestHandler',
     'IRepeaterResponseHandler',
     'IScannerRequestHandler',
@@ -160,6 +180,31 @@ class IProxyResponseHandler(Interface):
         '''
 
 
+class IProxyResponseObserver(Interface):
+    '''
+    Extension point interface for components to observe responses
+    after Burp Proxy receives them off the wire, without modifying them.
+
+    Unlike handlers, observers are called on a pool of worker threads
+    once the proxy has moved on, so they don't slow down browsing. See
+    :class:`~gds.burp.dispatchers.ObserverDispatcher`.
+
+    Classes that implement this interface must implement the
+    :meth:`observeResponse` method.
+    '''
+
+    def observeResponse(record):
+        '''
+        This method is invoked on a worker thread after Burp Proxy
+        receives a response off the wire, and after any
+        :class:`IProxyResponseHandler` has processed it.
+
+        :param record: An :class:`HttpRecord <HttpRecord>` snapshot of
+            the request and response. The same record is handed to every
+            observer, so it must not be modified.
+        '''
+
+
 class IRepeaterRequestHandler(Interface):
     '''
     Extension point interface for components to perform actions on
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+'''
+gds.burp.benchmarks
+~~~~~~~~~~~~~~~~~~~
+
+Micro-benchmarks that can be run from the interactive console to tune
+the models for the machine Burp is running on, e.g.::
+
+    >>> from gds.burp.benchmarks import bench_parsers
+    >>> bench_parsers(Burp, apply=True)
+'''
+from array import array
+from timeit import default_timer
+
+from . import models
+from .models import HttpRecord, HttpRequest, \
+    _analyze_message, _index_message, _parse_message
+
+import logging
+
+
+__all__ = ['bench_history_memory', 'bench_parsers', ]
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SIZES = (1024, 8 * 1024, 64 * 1024, 512 * 1024, 4 * 1024 * 1024, )
+
+
+def _make_request(i, header_count=12):
+    headers = ['GET /app/item/%d?page=%d HTTP/1.1' % (i, i % 50),
+               'Host: example.com', 'Cookie: session=%032x' % (i, )]
+
+    for j in xrange(header_count - 2):
+        headers.append('X-Header-%d: %s' % (j, 'v' * 24))
+
+    return '\r\n'.join(headers) + '\r\n\r\n'
+
+
+def _make_response(body_size, header_count=40):
+    headers = ['HTTP/1.1 200 OK', 'Content-Type: text/html',
+               'Content-Length: %d' % (body_size, )]
+
+    for i in xrange(header_count - 2):
+        headers.append('X-Header-%d: %s' % (i, 'v' * 32))
+
+    return '\r\n'.join(headers) + '\r\n\r\n' + 'A' * body_size
+
+
+def _time(func, repeat):
+    start = default_timer()
+    for _ in xrange(repeat):
+        func()
+    return (default_timer() - start) / repeat
+
+
+def bench_parsers(burp, sizes=DEFAULT_SIZES, repeat=20, apply=False):
+    '''
+    Compares :func:`~gds.burp.models._parse_message`,
+    :func:`~gds.burp.models._index_message` and the
+    IExtensionHelpers backend (:func:`~gds.burp.models._analyze_message`)
+    on synthetic responses of increasing size. Each run starts from a
+    Java byte[], reads one header and the body, as a handler would.
+
+    :param burp: a :class:`BurpExtender` with callbacks registered.
+    :param sizes: body sizes (in bytes) to benchmark.
+    :param repeat: number of runs per backend and size.
+    :param apply: if True, set :data:`~gds.burp.models.HELPERS_MIN_SIZE`
+        to the smallest size at which the helpers backend was fastest.
+    :returns: a list of ``(size, parse, index, analyze)`` tuples, with
+        timings in seconds per message.
+    '''
+    helpers = burp.helpers
+    results = []
+    threshold = None
+
+    for size in sizes:
+        message = helpers.stringToBytes(_make_response(size))
+
+        def parse():
+            _, _, _, headers, body = _parse_message(message.tostring())
+            headers.get('content-type')
+
+        def index():
+            index = _index_message(message.tostring())
+            for i in xrange(len(index)):
+                if index.name(i).lower() == 'content-type':
+                    index.value(i)
+                    break
+            index.body
+
+        def analyze():
+            index = _analyze_message(helpers, message, is_response=True)
+            for i in xrange(len(index)):
+                if index.name(i).lower() == 'content-type':
+                    index.value(i)
+                    break
+            index.body
+
+        row = (size, _time(parse, repeat), _time(index, repeat),
+               _time(analyze, repeat))
+
+        log.info('bench_parsers: %8d bytes parse=%.6fs index=%.6fs '
+                 'analyze=%.6fs', *row)
+
+        if threshold is None and row[3] < min(row[1], row[2]):
+            threshold = size
+
+        results.append(row)
+
+    if apply and threshold is not None:
+        log.info('Setting HELPERS_MIN_SIZE to %d', threshold)
+        models.HELPERS_MIN_SIZE = threshold
+
+    return results
+
+
+class _Message(object):
+    '''
+    Minimal in-memory IHttpRequestResponse, holding byte arrays the way
+    Burp's own history items do.
+    '''
+    def __init__(self, request, response):
+        self._request = array('b', request)
+        self._response = array('b', response)
+
+    def getRequest(self):
+        return self._request
+
+    def getResponse(self):
+        return self._response
+
+    # bean properties, as Jython exposes them on Java objects
+    request = property(getRequest)
+    response = property(getResponse)
+
+    def getHost(self):
+        return u'example.com'
+
+    def getPort(self):
+        return 80
+
+    def getProtocol(self):
+        return u'http'
+
+    def getComment(self):
+        return None
+
+    def getHighlight(self):
+        return None
+
+    def getUrl(self):
+        return None
+
+
+def _used_memory(runtime, System):
+    for _ in xrange(3):
+        System.gc()
+    return runtime.totalMemory() - runtime.freeMemory()
+
+
+def bench_history_memory(count=100000, body_size=2048, touch=True):
+    '''
+    Measures the heap used per history item when wrapping `count`
+    synthetic messages in :class:`~gds.burp.models.HttpRequest` and in
+    :class:`~gds.burp.models.HttpRecord`. The raw messages themselves
+    are allocated up front and not counted.
+
+    Run Jython with enough heap for the messages, e.g. ``-Xmx2g``.
+
+    :param count: number of history items.
+    :param body_size: size of each response body, in bytes.
+    :param touch: if True, read the headers and body of every item, the
+        way an analysis pass over the history would.
+    :returns: a dictionary mapping each class name to bytes per item.
+    '''
+    from java.lang import Runtime, System
+
+    runtime = Runtime.getRuntime()
+    response = _make_response(body_size, header_count=10)
+    messages = [_Message(_make_request(i), response) for i in xrange(count)]
+    results = {}
+
+    for cls in (HttpRequest, HttpRecord):
+        before = _used_memory(runtime, System)
+        items = [cls(message) for message in messages]
+
+        if touch:
+            for item in items:
+                item.headers.get('host')
+                item.body
+
+        after = _used_memory(runtime, System)
+        results[cls.__name__] = (after - before) / float(count)
+
+        log.info('bench_history_memory: %s %.1f bytes/item',
+                 cls.__name__, results[cls.__name__])
+
+        del items
+
+    return results
@@ -20,7 +20,7 @@ import os.path
 from .core import ExtensionPoint
 
 __all__ = ['Configuration', 'ConfigSection', 'Option', 'BoolOption',
-           'IntOption', 'FloatOption', 'ListOption',
+           'IntOption', 'FloatOption', 'ListOption', 'PathOption',
            'OrderedExtensionsOption']
 
 _use_default = object()
@@ -91,6 +91,9 @@ class Configuration(object):
         self.parents = []
         self._lastmtime = 0
         self._sections = {}
+        # bumped whenever the file is reparsed with changes, so that
+        # values derived from the configuration can be cached
+        self.generation = 0
         self.parser.read(filename)
 
     def __contains__(self, name):
@@ -246,6 +249,7 @@ class Configuration(object):
 
         if changed:
             self._cache = {}
+            self.generation += 1
         return changed
 
 
@@ -528,6 +532,15 @@ class FloatOption(Option):
     accessor = Section.getfloat
 
 
+class PathOption(Option):
+    """Descriptor for file system path configuration options.
+
+    Relative paths are resolved relative to the location of the
+    configuration file.
+    """
+    accessor = Section.getpath
+
+
 class ListOption(Option):
     """Descriptor for configuration options that contain multiple values
     separated by a specific character.
@@ -57,6 +57,8 @@ class ComponentMeta(type):
     """
     _components = []
     _registry = {}
+    # bumped whenever a component class is registered
+    _generation = 0
 
     def __new__(mcs, name, bases, d):
         """Create the component class."""
@@ -78,6 +80,7 @@ class ComponentMeta(type):
                 if new_class not in classes:
                     classes.append(new_class)
 
+        ComponentMeta._generation += 1
         return new_class
 
     def __call__(cls, *args, **kwargs):
@@ -143,6 +146,8 @@ class ComponentManager(object):
         """Initialize the component manager."""
         self.components = {}
         self.enabled = {}
+        # bumped whenever a component is disabled
+        self.generation = 0
         if isinstance(self, Component):
             self.components[self.__class__] = self
 
@@ -184,6 +189,7 @@ class ComponentManager(object):
             component = component.__class__
         self.enabled[component] = False
         self.components[component] = None
+        self.generation += 1
 
     def componentActivated(self, component):
         """Can be overridden by sub-classes so that special
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+'''
+gds.burp.dedup
+~~~~~~~~~~~~~~
+
+Exact and near-duplicate detection of response bodies, so that analysis
+passes can work through one representative per cluster of responses
+rather than every copy of the same page::
+
+    >>> for request in Burp.history.unique():
+    ...     analyze(request)
+
+Bodies are first compared by content hash. Those that are not exact
+duplicates are compared by the Hamming distance between their
+:func:`simhash` fingerprints, with volatile tokens (numbers, hex strings
+such as CSRF tokens and timestamps) masked out beforehand. Candidates are
+found through locality-sensitive hashing on bands of the fingerprints,
+so each body is only compared to the few clusters likely to match.
+'''
+from hashlib import md5, sha1
+from itertools import izip
+import re
+import struct
+
+import gds.burp.parallel as parallel
+
+
+__all__ = ['Clusterer', 'content_hash', 'simhash', ]
+
+FINGERPRINT_BITS = 64
+
+# default Hamming distance under which bodies are near-duplicates
+THRESHOLD = 3
+
+_TOKEN = re.compile(r'\w+')
+_VOLATILE = re.compile(r'[0-9a-fA-F]{8,}|\d+')
+_FEATURE = struct.Struct('>Q')
+
+# nibble values with each of their four bits set
+_WITH_BIT = [[value for value in xrange(16) if value >> bit & 1]
+             for bit in xrange(4)]
+
+
+def content_hash(body):
+    '''
+    Returns the SHA-1 digest of body.
+    '''
+    return sha1(body or '').digest()
+
+
+def simhash(text):
+    '''
+    Returns the 64-bit simhash fingerprint of text, where similar texts
+    have fingerprints a small Hamming distance apart. Words are weighted
+    by frequency, and numbers and hex strings are treated as the same
+    word.
+    '''
+    counts = {}
+    for token in _TOKEN.findall(_VOLATILE.sub('0', text or '')):
+        token = token.lower()
+        counts[token] = counts.get(token, 0) + 1
+
+    # tally the features a nibble at a time, rather than a bit at a time
+    nibbles = [[0] * 16 for _ in xrange(FINGERPRINT_BITS // 4)]
+    for token, count in counts.iteritems():
+        feature, = _FEATURE.unpack(md5(token).digest()[:8])
+
+        for tally in nibbles:
+            tally[feature & 15] += count
+            feature >>= 4
+
+    total = sum(counts.itervalues())
+    fingerprint = 0
+
+    for i, tally in enumerate(nibbles):
+        for bit in xrange(4):
+            ones = sum(tally[value] for value in _WITH_BIT[bit])
+            if 2 * ones > total:
+                fingerprint |= 1 << (4 * i + bit)
+
+    return fingerprint
+
+
+def _distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class Clusterer(object):
+    '''
+    Incrementally groups items into clusters of exact and near-duplicate
+    bodies. The first item of each cluster is its representative.
+
+    :param threshold: maximum Hamming distance between the fingerprints
+        of near-duplicates; 0 only groups exact duplicates.
+    :param body: function returning the body of an item, by default the
+        item itself.
+    '''
+    def __init__(self, threshold=THRESHOLD, body=None):
+        self.threshold = threshold
+        self.body = body or (lambda item: item)
+        self.clusters = []
+
+        self._exact = {}
+
+        # any two fingerprints within threshold bits of each other are
+        # equal in at least one of threshold + 1 bands
+        bands = threshold + 1
+        width = FINGERPRINT_BITS // bands
+        self._bands = [(i * width, (1 << width) - 1) for i in xrange(bands)]
+        self._tables = [{} for _ in self._bands]
+        self._fingerprints = []
+
+    def __repr__(self):
+        return '<Clusterer [%d clusters]>' % (len(self.clusters), )
+
+    def __len__(self):
+        return len(self.clusters)
+
+    def _candidates(self, fingerprint):
+        candidates = set()
+        for (shift, mask), table in zip(self._bands, self._tables):
+            candidates.update(table.get(fingerprint >> shift & mask, ()))
+        return candidates
+
+    def fingerprint(self, item):
+        '''
+        Returns the ``(digest, fingerprint)`` of the body of item, as used
+        by :meth:`add`. Safe to call from several threads at once.
+        '''
+        body = self.body(item)
+        return content_hash(body), simhash(body) if self.threshold else None
+
+    def add(self, item, fingerprint=None):
+        '''
+        Adds item to the cluster of its closest duplicate, or to a new
+        cluster.
+
+        :param fingerprint: the result of :meth:`fingerprint` for item,
+            if already computed.
+        :returns: a ``(cluster, new)`` tuple, with the index of the
+            cluster and whether item started it.
+        '''
+        if fingerprint is None:
+            body = self.body(item)
+            digest = content_hash(body)
+        else:
+            body = None
+            digest, fingerprint = fingerprint
+
+        cluster = self._exact.get(digest)
+        if cluster is not None:
+            self.clusters[cluster].append(item)
+            return cluster, False
+
+        if self.threshold:
+            if body is not None:
+                fingerprint = simhash(body)
+
+            best = None
+            for candidate in self._candidates(fingerprint):
+                distance = _distance(fingerprint,
+                                     self._fingerprints[candidate])
+                if distance <= self.threshold and \
+                    (best is None or distance < best[0]):
+                    best = distance, candidate
+
+            if best is not None:
+                cluster = best[1]
+                self._exact[digest] = cluster
+                self.clusters[cluster].append(item)
+                return cluster, False
+
+            for (shift, mask), table in zip(self._bands, self._tables):
+                table.setdefault(fingerprint >> shift & mask, []).append(
+                    len(self.clusters))
+
+            self._fingerprints.append(fingerprint)
+
+        cluster = len(self.clusters)
+        self._exact[digest] = cluster
+        self.clusters.append([item])
+        return cluster, True
+
+    def unique(self, items):
+        '''
+        Lazily yields the items that start a new cluster, i.e. one
+        representative per cluster.
+        '''
+        for item in items:
+            _, new = self.add(item)
+            if new:
+                yield item
+
+    def punique(self, items, workers=None, progress=None):
+        '''
+        As :meth:`unique`, fingerprinting the items on a pool of threads
+        (see :func:`gds.burp.parallel.imap`); items are still clustered
+        in order.
+        '''
+        if not hasattr(items, '__len__'):
+            items = list(items)
+
+        fingerprints = parallel.imap(self.fingerprint, items, workers,
+                                     progress=progress)
+        try:
+            for item, fingerprint in izip(items, fingerprints):
+                _, new = self.add(item, fingerprint)
+                if new:
+                    yield item
+        finally:
+            fingerprints.close()
+
+    def representatives(self):
+        return [cluster[0] for cluster in self.clusters]
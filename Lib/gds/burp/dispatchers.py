@@ -7,37 +7,235 @@ gds.burp.dispatchers
 from .api import INewScanIssueHandler, \
     IExtenderRequestHandler, IExtenderResponseHandler, \
     IIntruderRequestHandler, IIntruderResponseHandler, \
-    IProxyRequestHandler, IProxyResponseHandler, \
+    IProxyRequestHandler, IProxyResponseHandler, IProxyResponseObserver, \
     IRepeaterRequestHandler, IRepeaterResponseHandler, \
     IScannerRequestHandler, IScannerResponseHandler, \
     ISequencerRequestHandler, ISequencerResponseHandler, \
     ISpiderRequestHandler, ISpiderResponseHandler, \
     ITargetRequestHandler, ITargetResponseHandler
 
-from .config import OrderedExtensionsOption
-from .core import Component, ExtensionPoint
-from .models import HttpRequest
+from .config import FloatOption, IntOption, Option, \
+    OrderedExtensionsOption
+from .core import Component, ComponentMeta, ExtensionPoint
+from .models import HttpRecord, HttpRequest
+from .query import Predicate, Query, QuerySyntaxError, _Context, _url
+from .snapshot import _fields
+from .stats import nanotime
+
+from java.util.concurrent.atomic import AtomicLong
+
+from Queue import Empty, Full, Queue
+from threading import Lock, Thread
 
 import logging
+import weakref
+
+
+# tools with request and response handler options on PluginDispatcher
+TOOLS = ('extender', 'intruder', 'proxy', 'repeater', 'scanner',
+         'sequencer', 'spider', 'target', )
+
+# what ObserverDispatcher does with snapshots once its queue is full
+POLICIES = ('block', 'drop-oldest', 'drop', 'sample', )
+
+
+class _Filter(object):
+    '''
+    The ``match_*`` attributes of a handler, compiled into groups of
+    query predicates: a message matches if it matches at least one
+    predicate of every group. Predicates only read the service and the
+    head of each message, so no :class:`HttpRequest` is needed.
+    '''
+    __slots__ = ('groups', 'in_scope', )
+
+    def __init__(self, handler, messageIsRequest):
+        groups = []
+
+        def add(field, op, values):
+            if not isinstance(values, (list, tuple, set, frozenset)):
+                values = (values, )
+            groups.append([Predicate(field, op, str(value))
+                           for value in values])
+
+        if getattr(handler, 'match_hosts', None):
+            add('host', '=', handler.match_hosts)
+
+        if getattr(handler, 'match_methods', None):
+            add('method', '=', handler.match_methods)
+
+        if getattr(handler, 'match_path', None):
+            path = handler.match_path
+            add('path', '~', getattr(path, 'pattern', path))
+
+        if getattr(handler, 'match_max_size', None) is not None:
+            add('body.size' if messageIsRequest else 'resp.body.size',
+                '<=', handler.match_max_size)
+
+        # requests have no response to match against yet
+        if getattr(handler, 'match_mime_types', None) and \
+            not messageIsRequest:
+            add('mime', '=', handler.match_mime_types)
+
+        if getattr(handler, 'match', None):
+            groups.extend([predicate] for predicate in
+                          Query(handler.match).predicates)
+
+        groups.sort(key=lambda group: max(p.cost for p in group))
+
+        self.groups = groups
+        self.in_scope = bool(getattr(handler, 'match_in_scope', False))
+
+    def __nonzero__(self):
+        return bool(self.groups) or self.in_scope
+
+    def __call__(self, context, in_scope):
+        for group in self.groups:
+            for predicate in group:
+                if predicate(context):
+                    break
+            else:
+                return False
+
+        return not self.in_scope or in_scope()
+
+
+class _Breaker(object):
+    '''
+    Circuit breaker of a single handler. After `failures` calls in a row
+    which raised or took longer than `budget` nanoseconds, the handler is
+    bypassed for `backoff` nanoseconds. One call is then let through as a
+    probe: if it fails too, the handler is bypassed again for twice as
+    long (up to `max_backoff`), otherwise it is called as usual again.
+    '''
+    __slots__ = ('budget', 'failures', 'backoff', 'max_backoff', 'strikes',
+                 'delay', 'until', 'probing', '_lock', )
+
+    def __init__(self):
+        self.budget = 0
+        self.failures = 0
+        self.backoff = 0
+        self.max_backoff = 0
+        self.strikes = 0
+        self.delay = 0
+        self.until = 0
+        self.probing = False
+        self._lock = Lock()
+
+    def configure(self, budget, failures, backoff, max_backoff):
+        self.budget = budget
+        self.failures = failures
+        self.backoff = backoff
+        self.max_backoff = max(max_backoff, backoff)
+        self.delay = min(max(self.delay, backoff), self.max_backoff)
+
+    def allow(self, now):
+        '''
+        Returns whether the handler should be called at time now, i.e.
+        the breaker is closed or this call is its probe.
+        '''
+        if not self.until:
+            return True
+
+        if self.probing or now < self.until:
+            return False
+
+        with self._lock:
+            if self.probing or now < self.until:
+                return False
+            self.probing = True
+            return True
+
+    def record(self, elapsed, error, now):
+        '''
+        Records the outcome of a call made at time now, and returns the
+        nanoseconds the handler is now bypassed for if this tripped the
+        breaker, or None.
+        '''
+        failed = error or (self.budget and elapsed > self.budget)
+
+        if not failed and not self.strikes and not self.probing:
+            return None
+
+        with self._lock:
+            if self.probing:
+                self.probing = False
+
+                if failed:
+                    self.delay = min(self.delay * 2, self.max_backoff)
+                    self.until = now + self.delay
+                    return self.delay
+
+                self.until = 0
+                self.delay = self.backoff
+
+            if not failed:
+                self.strikes = 0
+                return None
+
+            self.strikes += 1
+            if self.strikes < self.failures or self.until:
+                return None
+
+            self.strikes = 0
+            self.until = now + self.delay
+            return self.delay
+
+
+def _generations(component):
+    # changes whenever the handlers resolved by an OrderedExtensionsOption
+    # may have changed
+    return (component.config.generation, component.compmgr.generation,
+            ComponentMeta._generation)
 
 
 class NewScanIssueDispatcher(Component):
 
     dispatchers = ExtensionPoint(INewScanIssueHandler)
 
+    _chain = None
+
+    @property
+    def chain(self):
+        '''
+        The ``(name, dispatch, counters)`` of each handler, resolved again
+        only when the configuration or components change.
+        '''
+        generations = _generations(self)
+
+        chain = self._chain
+        if chain is None or chain[0] != generations:
+            stats = self.burp.handler_stats
+            chain = self._chain = (generations, tuple(
+                (dispatch.__class__.__name__, dispatch,
+                 stats.counters('scanner.issue', dispatch.__class__.__name__))
+                for dispatch in self.dispatchers))
+
+        return chain[1]
+
     def newScanIssue(self, issue):
-        for dispatch in self.dispatchers:
+        for name, dispatch, counters in self.chain:
             if self.log.isEnabledFor(logging.DEBUG):
                 self.log.debug('Dispatching new scan issue details via %s',
-                               dispatch.__class__.__name__)
+                               name)
 
-            dispatch.newScanIssue(issue)
+            start = nanotime()
+            try:
+                dispatch.newScanIssue(issue)
+            except Exception:
+                counters.record(nanotime() - start, True)
+                raise
+
+            counters.record(nanotime() - start)
 
         return
 
 
 class PluginDispatcher(Component):
 
+    # (generations, {(tool, messageIsRequest): (handler, ...)}), replaced
+    # as a whole whenever it is rebuilt
+    _table = None
+
     extenderRequest = OrderedExtensionsOption('handlers', 'extender.request',
          IExtenderRequestHandler, None, False,
          '''List of components implementing the `IExtenderRequestHandler`,
@@ -150,30 +348,386 @@ class PluginDispatcher(Component):
          handle processing of HTTP responses directly after Burp Target
          receives if off the wire.''')
 
+    budget = FloatOption('handlers', 'budget', 1000,
+        '''Milliseconds a handler may take per call before the call counts
+        as a failure. Set `budget.<Handler>` to override it for a single
+        handler, and 0 to never time a handler out.''')
+
+    breaker_failures = IntOption('handlers', 'breaker.failures', 5,
+        '''Number of failures in a row (calls over budget or raising)
+        after which a handler is bypassed. 0 never bypasses handlers.''')
+
+    breaker_backoff = FloatOption('handlers', 'breaker.backoff', 30,
+        '''Seconds a handler is bypassed for, after which it is called
+        once more as a probe. Each failed probe doubles the time.''')
+
+    breaker_max_backoff = FloatOption('handlers', 'breaker.max_backoff',
+        900, '''Maximum number of seconds a handler is bypassed for.''')
+
+    def __init__(self):
+        # kept across rebuilds of the table, so that reloading the
+        # configuration doesn't close open breakers
+        self._breakers = {}
+
+    def _breaker(self, point, name):
+        if self.breaker_failures <= 0:
+            return None
+
+        breaker = self._breakers.get((point, name))
+        if breaker is None:
+            breaker = self._breakers.setdefault((point, name), _Breaker())
+
+        budget = self.config.getfloat('handlers', 'budget.' + name,
+                                      self.budget)
+        breaker.configure(int(budget * 1e6), self.breaker_failures,
+                          int(self.breaker_backoff * 1e9),
+                          int(self.breaker_max_backoff * 1e9))
+        return breaker
+
+    def _build_table(self):
+        stats = self.burp.handler_stats
+        table = {}
+
+        for tool in TOOLS:
+            for messageIsRequest, suffix in ((True, 'Request'),
+                                             (False, 'Response')):
+                method = 'process' + suffix
+                point = '%s.%s' % (tool, suffix.lower())
+                chain = []
+
+                for handler in getattr(self, tool + suffix):
+                    name = handler.__class__.__name__
+                    try:
+                        match = _Filter(handler, messageIsRequest) or None
+                    except QuerySyntaxError:
+                        self.log.exception('Invalid match attributes on %s, '
+                                           'not calling it via %s', name,
+                                           tool)
+                        continue
+
+                    chain.append((name, getattr(handler, method), match,
+                                  stats.counters(point, name),
+                                  self._breaker(point, name)))
+
+                table[tool, messageIsRequest] = tuple(chain)
+
+        return table
+
+    @property
+    def table(self):
+        '''
+        The chain of ``(name, method, filter, counters, breaker)`` of the
+        handlers for each (tool, messageIsRequest). Resolving the ordered
+        handler options is costly, so the chains are only resolved again
+        once the configuration is reloaded, or components are registered
+        or disabled.
+        '''
+        generations = _generations(self)
+
+        table = self._table
+        if table is None or table[0] != generations:
+            # concurrent rebuilds are harmless, and the table is swapped
+            # in a single assignment
+            table = self._table = (generations, self._build_table())
+
+            self.log.debug('Resolved handlers: %s', ', '.join(
+                '%s.%s=%d' % (tool, 'request' if isRequest else 'response',
+                              len(chain))
+                for (tool, isRequest), chain in sorted(table[1].items())
+                if chain))
+
+        return table[1]
+
     def processHttpMessage(self, toolName, messageIsRequest, messageInfo):
-        handlers = ''.join([toolName.lower(),
-                            'Request' if messageIsRequest else 'Response'])
+        handlers = self.table.get((toolName.lower(), messageIsRequest))
 
-        method = ''.join(['process',
-                          'Request' if messageIsRequest else 'Response'])
+        if not handlers:
+            return
+
+        if any(handler[2] is not None for handler in handlers):
+            handlers = self._matching(handlers, messageInfo)
+            if not handlers:
+                return
+
+        method = 'processRequest' if messageIsRequest else 'processResponse'
 
         try:
-            request = HttpRequest(messageInfo, _burp=self.burp)
+            request = HttpRequest(messageInfo, _burp=self.burp, _deferred=True)
         except Exception:
             self.log.exception('Could not parse object: %r', messageInfo)
             return
 
-        for handler in getattr(self, handlers):
+        for name, handler, _, counters, breaker in handlers:
+            if breaker is not None and not breaker.allow(nanotime()):
+                counters.skip()
+                continue
+
             if self.log.isEnabledFor(logging.DEBUG):
                 self.log.debug('Dispatching handler via %s: %s.%s(%r)',
-                               toolName, handler.__class__.__name__,
-                               method, request)
+                               toolName, name, method, request)
 
+            error = False
+            start = nanotime()
             try:
-                getattr(handler, method)(request)
+                handler(request)
             except Exception:
+                error = True
                 self.log.exception('Error calling handler via %s: %s.%s(%r)',
-                                   toolName, handler.__class__.__name__,
-                                   method, request)
+                                   toolName, name, method, request)
+
+            end = nanotime()
+            counters.record(end - start, error)
+
+            if breaker is not None:
+                delay = breaker.record(end - start, error, end)
+                if delay is not None:
+                    self._tripped(toolName, name, method, breaker,
+                                  end - start, error, delay)
+
+        # write back to Burp once, after the whole chain, and only if a
+        # handler actually replaced the request or response.
+        try:
+            request.flush()
+        except Exception:
+            self.log.exception('Error writing back message via %s: %r',
+                               toolName, request)
 
         return
+
+    def _tripped(self, toolName, name, method, breaker, elapsed, error,
+                 delay):
+        if error:
+            reason = 'it raised an exception'
+        else:
+            reason = 'it took %d ms, over its %d ms budget' % (
+                elapsed // 1000000, breaker.budget // 1000000, )
+
+        message = 'Bypassing %s.%s via %s for %g seconds, as %s' % (
+            name, method, toolName, delay / 1e9, reason, )
+
+        self.log.warn(message)
+
+        try:
+            self.burp.issueAlert(message)
+        except Exception:
+            self.log.exception('Could not issue alert: %s', message)
+
+    def _matching(self, handlers, messageInfo):
+        '''
+        Returns the handlers whose ``match_*`` attributes match the
+        message as Burp handed it over, before any handler has run.
+        '''
+        context = _Context(messageInfo)
+        scope = []
+
+        def in_scope():
+            if not scope:
+                try:
+                    scope.append(bool(self.burp.isInScope(_url(context))))
+                except Exception:
+                    self.log.exception('Could not check scope of %r',
+                                       messageInfo)
+                    scope.append(False)
+            return scope[0]
+
+        return [handler for handler in handlers
+                if handler[2] is None or handler[2](context, in_scope)]
+
+
+class ObserverDispatcher(Component):
+    '''
+    Hands a snapshot of each proxy response to the
+    :class:`~gds.burp.api.IProxyResponseObserver` components listed in
+    the ``[observers]`` section, on a pool of worker threads.
+
+    The proxy thread only copies the messages and queues the snapshot.
+    Once the queue is full, `policy` decides whether the proxy waits for
+    the workers ("block"), the oldest queued snapshot is dropped
+    ("drop-oldest") or the new one is ("drop"). With "sample", only one
+    in `sample_rate` responses is queued once the queue is half full.
+
+    The workers are only started once a response arrives with at least
+    one observer configured, and stopped by :meth:`close` when the
+    extension is unloaded.
+    '''
+
+    proxyResponse = OrderedExtensionsOption('observers', 'proxy.response',
+        IProxyResponseObserver, None, False,
+        '''List of components implementing the `IProxyResponseObserver`,
+        in the order in which they will be called. These components
+        observe HTTP responses on worker threads after Burp Proxy
+        receives them off the wire.''')
+
+    workers = IntOption('observers', 'workers', 2,
+        '''Number of worker threads calling observers.''')
+
+    queue_size = IntOption('observers', 'queue_size', 1000,
+        '''Number of responses waiting to be observed before `policy`
+        applies.''')
+
+    policy = Option('observers', 'policy', 'block',
+        '''What to do once the queue is full: "block", "drop-oldest",
+        "drop" or "sample".''')
+
+    sample_rate = IntOption('observers', 'sample_rate', 10,
+        '''With the "sample" policy, queue one in this many responses
+        once the queue is half full.''')
+
+    _chain = None
+
+    # the dispatcher running the workers of each component manager, as
+    # racing first messages may each create an instance
+    _owners = weakref.WeakKeyDictionary()
+    _lock = Lock()
+
+    def __init__(self):
+        self.observed = AtomicLong()
+        self.dropped = AtomicLong()
+        self._seen = AtomicLong()
+        self._queue = None
+        self._threads = []
+
+        if self.policy not in POLICIES:
+            self.log.warn('Unknown observer policy %r, blocking instead',
+                          self.policy)
+
+    def _start(self):
+        '''
+        Returns the queue of the workers serving this component manager,
+        starting them if no dispatcher has yet. Counters are shared with
+        that dispatcher.
+        '''
+        with self._lock:
+            owner = self._owners.setdefault(self.compmgr, self)
+
+            if owner._queue is None:
+                owner._queue = Queue(owner.queue_size)
+
+                for i in xrange(max(owner.workers, 1)):
+                    thread = Thread(target=owner._run,
+                                    name='jython-observer-%d' % (i + 1, ))
+                    thread.setDaemon(True)
+                    thread.start()
+                    owner._threads.append(thread)
+
+            self.observed = owner.observed
+            self.dropped = owner.dropped
+            self._seen = owner._seen
+            self._queue = owner._queue
+
+        return self._queue
+
+    def close(self):
+        '''
+        Stops the workers serving this component manager, once they have
+        observed the responses still queued.
+        '''
+        with self._lock:
+            owner = self._owners.pop(self.compmgr, None)
+
+        if owner is None:
+            return
+
+        for thread in owner._threads:
+            owner._queue.put(None)
+
+        for thread in owner._threads:
+            thread.join()
+
+    @property
+    def observers(self):
+        '''
+        The ``(name, method, counters)`` of each observer, resolved again
+        only when the configuration or components change.
+        '''
+        generations = _generations(self)
+
+        chain = self._chain
+        if chain is None or chain[0] != generations:
+            stats = self.burp.handler_stats
+            chain = self._chain = (generations, tuple(
+                (observer.__class__.__name__, observer.observeResponse,
+                 stats.counters('observer.proxy.response',
+                                observer.__class__.__name__))
+                for observer in self.proxyResponse))
+
+        return chain[1]
+
+    def _admit(self, queue):
+        '''
+        Returns whether a new snapshot should be queued, making room for
+        it if the policy says so.
+        '''
+        policy = self.policy
+
+        if policy == 'block' or policy not in POLICIES:
+            return True
+
+        if policy == 'drop-oldest':
+            while queue.full():
+                try:
+                    queue.get_nowait()
+                    self.dropped.incrementAndGet()
+                except Empty:
+                    break
+            return True
+
+        if policy == 'sample' and queue.qsize() * 2 >= queue.maxsize > 0:
+            if self._seen.incrementAndGet() % max(self.sample_rate, 1):
+                return False
+
+        return not queue.full()
+
+    def processHttpMessage(self, toolName, messageIsRequest, messageInfo):
+        if messageIsRequest or toolName.lower() != 'proxy' or \
+            not self.observers:
+            return
+
+        queue = self._queue
+        if queue is None:
+            queue = self._start()
+
+        if not self._admit(queue):
+            self.dropped.incrementAndGet()
+            return
+
+        # copy the messages now, as Burp reuses them once we return
+        try:
+            request, response, host, port, protocol, comment, highlight = \
+                _fields(messageInfo)
+        except Exception:
+            self.log.exception('Could not copy object: %r', messageInfo)
+            return
+
+        record = HttpRecord.from_raw(request, response, host, port, protocol)
+        record.comment = comment
+        record.highlight = highlight
+
+        if self.policy == 'block':
+            queue.put(record)
+            return
+
+        try:
+            queue.put_nowait(record)
+        except Full:
+            # raced with another proxy thread
+            self.dropped.incrementAndGet()
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                return
+
+            for name, observer, counters in self.observers:
+                start = nanotime()
+                try:
+                    observer(record)
+                except Exception:
+                    counters.record(nanotime() - start, True)
+                    self.log.exception('Error calling observer %s(%r)',
+                                       name, record)
+                else:
+                    counters.record(nanotime() - start)
+
+            self.observed.incrementAndGet()
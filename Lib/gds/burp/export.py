@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+'''
+gds.burp.export
+~~~~~~~~~~~~~~~
+
+Streaming export and import of request/response pairs as NDJSON or HAR,
+for use with tooling outside of Burp.
+
+Items are written one at a time as they are read from the source, and
+read back one at a time, so neither side holds more than one item in
+memory however large the history is. Paths ending in ``.gz`` are
+compressed::
+
+    >>> export(Burp._check_and_callback(Burp.getProxyHistory),
+    ...        '/tmp/history.ndjson.gz')
+    >>> for request in load('/tmp/history.ndjson.gz'):
+    ...     print request.url.geturl()
+
+NDJSON files hold one JSON object per line, with the service, comment,
+highlight and the raw request and response decoded as ISO-8859-1, so
+messages survive the round trip byte for byte. HAR files follow HAR 1.2;
+the service and highlight are kept in the ``_host``, ``_port``,
+``_protocol`` and ``_highlight`` fields of each entry, and bodies which
+are not UTF-8 text are base64 encoded.
+
+Loading doesn't need Burp: items are returned as
+:class:`~gds.burp.models.HttpRequest` (or
+:class:`~gds.burp.models.HttpRecord`) objects created from the raw
+messages.
+'''
+from datetime import datetime
+from urlparse import parse_qsl, urlsplit
+import gzip
+import json
+import re
+
+from .models import CRLF, HttpRecord, HttpRequest, _build_url, \
+    _index_message, _parse_start_line
+from .snapshot import _fields
+
+
+__all__ = ['dump_har', 'dump_ndjson', 'export', 'ExportError', 'load',
+           'load_har', 'load_ndjson', ]
+
+# bytes read at a time when looking for the next HAR entry
+READ_SIZE = 64 * 1024
+
+_CREATOR = {'name': 'jython-burp-api', 'version': '1.0'}
+
+_ENTRIES = re.compile(r'"entries"\s*:\s*\[')
+
+
+class ExportError(ValueError):
+    '''Raised when an export file is malformed or of an unknown format.'''
+
+
+def _text(value):
+    return value.decode('latin-1') if value is not None else None
+
+
+def _bytes(value):
+    return value.encode('latin-1') if value is not None else None
+
+
+def _latin1(value):
+    # start lines and headers are exported as ISO-8859-1, as Burp decodes
+    # them; other tools may write characters outside of it
+    if isinstance(value, unicode):
+        try:
+            return value.encode('latin-1')
+        except UnicodeEncodeError:
+            return value.encode('utf-8')
+    return value
+
+
+def _item(request, response, host, port, protocol, comment, highlight,
+          compact, _burp):
+    if compact:
+        item = HttpRecord.from_raw(request, response, host, port, protocol)
+    else:
+        item = HttpRequest.from_raw(request, response, host, port, protocol,
+                                    _burp=_burp)
+
+    item.comment = comment
+    item.highlight = highlight
+    return item
+
+
+def dump_ndjson(items, fp):
+    '''
+    Writes items to the file-like object fp as NDJSON, one line at a
+    time. items may be any iterable of
+    :class:`~gds.burp.models.HttpRequest`,
+    :class:`~gds.burp.models.HttpRecord` or IHttpRequestResponse objects.
+
+    :returns: the number of items written.
+    '''
+    count = 0
+    for item in items:
+        request, response, host, port, protocol, comment, highlight = \
+            _fields(item)
+
+        fp.write(json.dumps({
+            'host': host,
+            'port': port,
+            'protocol': protocol,
+            'comment': comment,
+            'highlight': highlight,
+            'request': _text(request),
+            'response': _text(response),
+            }, sort_keys=True))
+        fp.write('\n')
+        count += 1
+
+    return count
+
+
+def load_ndjson(fp, compact=False, _burp=None):
+    '''
+    Lazily yields the items in the NDJSON read from the file-like object
+    fp, one line at a time.
+
+    :param compact: if True, yield :class:`~gds.burp.models.HttpRecord`
+        rather than :class:`~gds.burp.models.HttpRequest` objects.
+    '''
+    for number, line in enumerate(fp, 1):
+        if not line.strip():
+            continue
+
+        try:
+            record = json.loads(line)
+            yield _item(_bytes(record['request']),
+                        _bytes(record.get('response')), record['host'],
+                        record['port'], record['protocol'],
+                        record.get('comment'), record.get('highlight'),
+                        compact, _burp)
+        except (KeyError, TypeError, ValueError), e:
+            raise ExportError('Malformed record on line %d: %s' % (
+                              number, e, ))
+
+
+def _content(body):
+    '''
+    Returns the HAR text and encoding of body.
+    '''
+    try:
+        return body.decode('utf-8'), None
+    except UnicodeDecodeError:
+        return body.encode('base64').replace('\n', ''), 'base64'
+
+
+def _headers(index):
+    return [{'name': name, 'value': value}
+            for name, value in index.iterheaders()]
+
+
+def _cookies(index, name):
+    cookies = []
+    for header, value in index.iterheaders():
+        if header.lower() != name:
+            continue
+
+        if name == 'set-cookie':
+            value = value.split(';', 1)[0]
+
+        for cookie in value.split(';'):
+            key, _, value = cookie.strip().partition('=')
+            if key:
+                cookies.append({'name': key, 'value': value})
+
+    return cookies
+
+
+def _header(index, name):
+    for header, value in index.iterheaders():
+        if header.lower() == name:
+            return value
+    return ''
+
+
+def _har_request(request, host, port, protocol):
+    if request is None:
+        # an empty method marks a missing request, see _from_har
+        return {
+            'method': '',
+            'url': _build_url(protocol, host, port, '/'),
+            'httpVersion': '',
+            'headers': [],
+            'queryString': [],
+            'cookies': [],
+            'headersSize': -1,
+            'bodySize': -1,
+            }, None
+
+    index = _index_message(request)
+    method, uri, version = _parse_start_line(index.start_line)
+    url = _build_url(protocol, host, port, uri)
+
+    return {
+        'method': method,
+        'url': url,
+        'httpVersion': version,
+        'headers': _headers(index),
+        'queryString': [
+            {'name': name, 'value': value} for name, value in
+            parse_qsl(urlsplit(url).query, keep_blank_values=True)],
+        'cookies': _cookies(index, 'cookie'),
+        'headersSize': index.body_offset,
+        'bodySize': len(index.body),
+        }, index
+
+
+def _har_entry(item, started):
+    request, response, host, port, protocol, comment, highlight = \
+        _fields(item)
+
+    har_request, index = _har_request(request, host, port, protocol)
+    body = index.body if index is not None else ''
+
+    entry = {
+        'startedDateTime': started,
+        'time': 0,
+        'request': har_request,
+        'response': {
+            'status': 0,
+            'statusText': '',
+            'httpVersion': '',
+            'headers': [],
+            'cookies': [],
+            'content': {'size': 0, 'mimeType': ''},
+            'redirectURL': '',
+            'headersSize': -1,
+            'bodySize': -1,
+            },
+        'cache': {},
+        'timings': {'send': 0, 'wait': 0, 'receive': 0},
+        '_host': host,
+        '_port': port,
+        '_protocol': protocol,
+        '_highlight': highlight,
+        }
+
+    if comment:
+        entry['comment'] = comment
+
+    if body:
+        text, encoding = _content(body)
+        entry['request']['postData'] = {
+            'mimeType': _header(index, 'content-type'),
+            'text': text,
+            }
+        if encoding:
+            # not part of HAR 1.2, which only has encoded response bodies
+            entry['request']['postData']['_encoding'] = encoding
+
+    if response is not None:
+        index = _index_message(response)
+        version, status, reason = _parse_start_line(index.start_line)
+        body = index.body
+        text, encoding = _content(body)
+
+        entry['response'].update({
+            'status': status,
+            'statusText': reason,
+            'httpVersion': version,
+            'headers': _headers(index),
+            'cookies': _cookies(index, 'set-cookie'),
+            'content': {
+                'size': len(body),
+                'mimeType': _header(index, 'content-type'),
+                'text': text,
+                },
+            'redirectURL': _header(index, 'location'),
+            'headersSize': index.body_offset,
+            'bodySize': len(body),
+            })
+
+        if encoding:
+            entry['response']['content']['encoding'] = encoding
+
+    return entry
+
+
+def dump_har(items, fp):
+    '''
+    Writes items to the file-like object fp as a HAR 1.2 log, one entry
+    at a time. See :func:`dump_ndjson`.
+
+    Burp doesn't record when messages were sent, so every entry is given
+    the time of the export.
+
+    :returns: the number of items written.
+    '''
+    started = datetime.utcnow().isoformat()[:23] + 'Z'
+
+    fp.write('{"log": {"version": "1.2", "creator": %s, "entries": [' % (
+             json.dumps(_CREATOR), ))
+
+    count = 0
+    for item in items:
+        fp.write(',\n' if count else '\n')
+        fp.write(json.dumps(_har_entry(item, started), encoding='latin-1',
+                            sort_keys=True))
+        count += 1
+
+    fp.write('\n]}}\n')
+    return count
+
+
+def _decoded(text, encoding):
+    if text is None:
+        return ''
+
+    if encoding == 'base64':
+        return text.decode('base64')
+
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+
+def _message(start_line, headers, body):
+    lines = [start_line]
+    lines.extend('%s: %s' % (_latin1(header['name']),
+                             _latin1(header['value']))
+                 for header in headers)
+    return CRLF.join(lines) + CRLF + CRLF + body
+
+
+def _from_har(entry, compact, _burp):
+    request = entry['request']
+    url = urlsplit(_latin1(request['url']))
+
+    uri = url.path or '/'
+    if url.query:
+        uri += '?' + url.query
+
+    post = request.get('postData') or {}
+    raw_request = None
+
+    if request.get('method'):
+        raw_request = _message(
+            '%s %s %s' % (_latin1(request['method']), uri,
+                          _latin1(request.get('httpVersion') or 'HTTP/1.1')),
+            request.get('headers', ()),
+            _decoded(post.get('text'), post.get('_encoding')))
+
+    response = entry.get('response') or {}
+    raw_response = None
+
+    if response.get('status'):
+        content = response.get('content') or {}
+        version = response.get('httpVersion') or 'HTTP/1.1'
+        raw_response = _message(
+            '%s %d %s' % (_latin1(version), response['status'],
+                          _latin1(response.get('statusText', ''))),
+            response.get('headers', ()),
+            _decoded(content.get('text'), content.get('encoding')))
+
+    protocol = entry.get('_protocol') or url.scheme
+    port = entry.get('_port') or url.port or \
+        (443 if protocol == 'https' else 80)
+
+    return _item(raw_request, raw_response,
+                 entry.get('_host') or url.hostname or '',
+                 port, protocol, entry.get('comment'),
+                 entry.get('_highlight'), compact, _burp)
+
+
+def _har_entries(fp):
+    '''
+    Lazily yields the entries of the HAR log read from fp, decoding one
+    entry at a time rather than the whole document.
+    '''
+    decoder = json.JSONDecoder()
+    data = ''
+
+    while True:
+        match = _ENTRIES.search(data)
+        if match is not None:
+            data = data[match.end():]
+            break
+
+        chunk = fp.read(READ_SIZE)
+        if not chunk:
+            raise ExportError('No entries found in HAR log')
+
+        # keep enough of the previous chunk to match a split key
+        data = data[-64:] + chunk
+
+    size = READ_SIZE
+    eof = False
+
+    while True:
+        data = data.lstrip(' \t\r\n,')
+
+        if data.startswith(']'):
+            return
+
+        try:
+            if not data:
+                raise ValueError('No data')
+            entry, end = decoder.raw_decode(data)
+        except ValueError:
+            if eof:
+                raise ExportError('Truncated HAR log')
+
+            # read more than has been buffered so far, so that large
+            # entries aren't decoded over and over
+            size = max(size, len(data))
+            chunk = fp.read(size)
+            eof = not chunk
+            data += chunk
+            continue
+
+        yield entry
+        data = data[end:]
+        size = READ_SIZE
+
+
+def load_har(fp, compact=False, _burp=None):
+    '''
+    Lazily yields the items in the HAR log read from the file-like
+    object fp, one entry at a time. See :func:`load_ndjson`.
+    '''
+    for number, entry in enumerate(_har_entries(fp), 1):
+        try:
+            yield _from_har(entry, compact, _burp)
+        except (AttributeError, KeyError, TypeError, ValueError), e:
+            raise ExportError('Malformed entry %d: %s' % (number, e, ))
+
+
+_FORMATS = {
+    'har': (dump_har, load_har),
+    'ndjson': (dump_ndjson, load_ndjson),
+    }
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def _format(path, format):
+    if format is None:
+        name = path[:-3] if path.endswith('.gz') else path
+        format = 'har' if name.endswith('.har') else 'ndjson'
+
+    if format not in _FORMATS:
+        raise ExportError('Unknown export format %r' % (format, ))
+
+    return _FORMATS[format]
+
+
+def export(items, path, format=None):
+    '''
+    Writes items to the file at path. The format, "ndjson" or "har", is
+    taken from the file extension (e.g. ``.har`` or ``.ndjson.gz``) unless
+    given, and paths ending in ``.gz`` are compressed.
+
+    :returns: the number of items written.
+    '''
+    dump = _format(path, format)[0]
+
+    with _open(path, 'wb') as fp:
+        return dump(items, fp)
+
+
+def load(path, format=None, compact=False, _burp=None):
+    '''
+    Lazily yields the items in the file at path. See :func:`export`.
+    '''
+    reader = _format(path, format)[1]
+
+    with _open(path, 'rb') as fp:
+        for item in reader(fp, compact, _burp):
+            yield item
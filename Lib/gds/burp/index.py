@@ -0,0 +1,607 @@
+# -*- coding: utf-8 -*-
+'''
+gds.burp.index
+~~~~~~~~~~~~~~
+
+In-memory index of the proxy history, so that console queries don't
+have to fetch and rescan the whole history every time.
+
+The history items are fetched from Burp the first time they are needed,
+then kept up to date by :class:`~gds.burp.listeners.PluginListener` as
+proxy responses come in. Items are only read and indexed once a search
+needs it::
+
+    >>> Burp.getProxyHistory('api/v2', method='POST', status_code=500)
+'''
+from array import array
+from itertools import izip
+from threading import RLock
+from urlparse import urlsplit
+import re
+
+from .dedup import THRESHOLD, Clusterer
+from .models import CRLF, HttpRecord, HttpRequest, _parse_start_line, \
+    _tostring
+from .structures import LRUCache
+
+import gds.burp.parallel as parallel
+
+import logging
+
+
+__all__ = ['HistoryIndex', 'HistoryView', ]
+
+log = logging.getLogger(__name__)
+
+# bytes read from the start of each message to find its start line and
+# headers; messages with longer headers are converted in full
+HEAD_SIZE = 8 * 1024
+
+_CONTENT_TYPE = re.compile(r'^content-type:[ \t]*([^;\r\n]*)',
+                           re.IGNORECASE | re.MULTILINE)
+
+# characters that make a pattern a regular expression rather than a
+# plain substring
+_REGEX_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+# how values of each key are normalized, both when indexing and searching
+_NORMALIZE = {
+    'host': lambda value: value.lower(),
+    'method': lambda value: value.upper(),
+    'mime_type': lambda value: value.lower(),
+    }
+
+
+class _Entry(object):
+    __slots__ = ('url', 'host', 'path', 'method', 'status_code',
+                 'mime_type', 'item', )
+
+    def __init__(self, item):
+        # only the start lines and the response Content-Type are needed,
+        # so read those straight out of the head of each message rather
+        # than indexing every header
+        self.method, uri, _ = _parse_start_line(
+            _head(item.getRequest(), CRLF))
+
+        host = item.getHost() or ''
+        self.host = host.lower()
+
+        if uri.startswith(('http://', 'https://')):
+            url = urlsplit(uri)
+            self.path = url.path
+            uri = url.path + ('?' + url.query if url.query else '')
+        else:
+            self.path = uri.partition('?')[0].partition('#')[0]
+
+        self.url = _burp_url(item.getProtocol(), host, item.getPort(), uri)
+
+        self.status_code = self.mime_type = None
+
+        response = item.getResponse()
+        if response is not None:
+            head = _head(response, CRLF + CRLF)
+            self.status_code = _parse_start_line(head.partition(CRLF)[0])[1]
+
+            match = _CONTENT_TYPE.search(head)
+            if match:
+                self.mime_type = match.group(1).strip().lower() or None
+
+        self.item = item
+
+
+def _burp_url(protocol, host, port, uri):
+    # the URL as Burp's getUrl() has it, which patterns were always
+    # matched against: the host as sent, and the port even if it is the
+    # default one
+    return '%s://%s:%d%s' % (protocol, host, port, uri)
+
+
+def _head(message, terminator):
+    # avoid converting whole (possibly large) messages to strings
+    head = _tostring(message[:HEAD_SIZE])
+
+    if terminator not in head and len(message) > HEAD_SIZE:
+        head = _tostring(message)
+
+    return head.partition(terminator)[0]
+
+
+def _same_item(item, other):
+    # whether two history items hold the same messages, comparing the
+    # service, the sizes and the start of each message
+    if (item.getHost(), item.getPort(), item.getProtocol()) != \
+            (other.getHost(), other.getPort(), other.getProtocol()):
+        return False
+
+    for message, other_message in ((item.getRequest(), other.getRequest()),
+                                   (item.getResponse(),
+                                    other.getResponse())):
+        if message is None or other_message is None:
+            if message is not other_message:
+                return False
+        elif len(message) != len(other_message) or \
+                _tostring(message[:HEAD_SIZE]) != \
+                _tostring(other_message[:HEAD_SIZE]):
+            return False
+
+    return True
+
+
+def _response_body(item):
+    response = item.getResponse()
+    if response is None:
+        return ''
+
+    return _tostring(response).partition(CRLF + CRLF)[2]
+
+
+def _matcher(pattern):
+    if _REGEX_CHARS.isdisjoint(pattern):
+        return lambda url: pattern in url
+    return re.compile(pattern).search
+
+
+class HistoryIndex(object):
+    '''
+    Index of proxy history items by host, path, method, status code and
+    MIME type (the media type of the response Content-Type, e.g.
+    "application/json"), along with the URL of each item for pattern
+    searches.
+
+    Fetching the items is cheap, and is all that :meth:`item`,
+    :meth:`items` and ``len()`` need; the head of each item is only read
+    and indexed by the first :meth:`search` that follows.
+
+    Items added after the index was built are copies saved to temp
+    files by :meth:`BurpExtender.saveBuffersToTempFiles`, as Burp
+    does not allow holding on to the messages passed to listeners.
+
+    `generation` is bumped whenever the positions of items may have
+    changed, i.e. on :meth:`rebuild` and :meth:`refresh`, and
+    `changed_from` holds the first position that did.
+    '''
+    keys = ('host', 'path', 'method', 'status_code', 'mime_type', )
+
+    def __init__(self, burp):
+        self.burp = burp
+        self.ready = False
+        self.generation = 0
+        self.changed_from = 0
+        self._lock = RLock()
+        self._reset()
+
+    def __repr__(self):
+        return '<HistoryIndex [%d items]>' % (len(self), )
+
+    def __len__(self):
+        return len(self._items)
+
+    def _reset(self):
+        self._items = []
+        # entries of the first len(_entries) items, None for items that
+        # could not be indexed
+        self._entries = []
+        self._keys = dict((key, {}) for key in self.keys)
+        # number of items taken from Burp's proxy history, in its order;
+        # any items after these were added by the listener
+        self._synced = 0
+
+    def _changed(self, position):
+        self.changed_from = position
+        self.generation += 1
+
+    def _truncate(self, size):
+        # positions are appended in order, so the removed entries are at
+        # the end of each of their keys' arrays
+        for entry in reversed(self._entries[size:]):
+            if entry is None:
+                continue
+
+            for key in self.keys:
+                value = getattr(entry, key)
+                positions = self._keys[key][value]
+                positions.pop()
+                if not positions:
+                    del self._keys[key][value]
+
+        del self._entries[size:]
+        del self._items[size:]
+
+    def _index_pending(self):
+        # index the items added since the last search
+        for item in self._items[len(self._entries):]:
+            try:
+                entry = _Entry(item)
+            except Exception:
+                log.exception('Could not index history item: %r', item)
+                entry = None
+
+            position = len(self._entries)
+            self._entries.append(entry)
+
+            if entry is None:
+                continue
+
+            for key in self.keys:
+                self._keys[key].setdefault(getattr(entry, key),
+                                           array('i')).append(position)
+
+    def add(self, messageInfo):
+        '''
+        Adds a proxy message to the index. Messages are ignored until the
+        index has been built, as they will be part of the history it is
+        built from.
+        '''
+        if not self.ready:
+            return
+
+        item = self.burp.saveBuffersToTempFiles(messageInfo)
+
+        with self._lock:
+            self._items.append(item)
+
+    def rebuild(self, items=None):
+        '''
+        Rebuilds the index from items, or from Burp's proxy history. Use
+        this after deleting items from the proxy history.
+        '''
+        with self._lock:
+            if items is None:
+                items = self.burp._check_and_callback(
+                    self.burp.getProxyHistory)
+
+            self._reset()
+            self._items.extend(items)
+
+            self._synced = len(self._items)
+            self.ready = True
+            self._changed(0)
+            log.debug('Fetched %d proxy history items', len(self._items))
+
+    def refresh(self):
+        '''
+        Brings the index in line with Burp's proxy history, only indexing
+        items that were added since the index was last built or
+        refreshed. Entries added by the listener in the meantime are
+        replaced by the corresponding history items, in history order.
+        If items were deleted from the history, i.e. it is shorter than
+        when last fetched or its last fetched item is not where it was,
+        the index is rebuilt.
+
+        :returns: the position of the first entry that changed.
+        '''
+        with self._lock:
+            items = self.burp._check_and_callback(self.burp.getProxyHistory)
+
+            if not self.ready or len(items) < self._synced or \
+                    (self._synced and not _same_item(
+                        items[self._synced - 1],
+                        self._items[self._synced - 1])):
+                self.rebuild(items)
+                return 0
+
+            start = self._synced
+            self._truncate(start)
+            self._items.extend(items[start:])
+
+            self._synced = len(self._items)
+            self._changed(start)
+            log.debug('Fetched %d new proxy history items',
+                      self._synced - start)
+            return start
+
+    def items(self):
+        '''
+        Returns a list of the history items, in history order.
+        '''
+        if not self.ready:
+            self.rebuild()
+
+        with self._lock:
+            return list(self._items)
+
+    def item(self, position):
+        '''
+        Returns the history item at position.
+        '''
+        if not self.ready:
+            self.rebuild()
+
+        return self._items[position]
+
+    def _values(self, key, values):
+        if not isinstance(values, (list, tuple, set, frozenset)):
+            values = (values, )
+
+        normalize = _NORMALIZE.get(key)
+        if normalize is None:
+            return values
+
+        return [normalize(value) if isinstance(value, basestring) else value
+                for value in values]
+
+    def _candidates(self, criteria):
+        sizes = []
+        for key, values in criteria.iteritems():
+            values = self._values(key, values)
+            index = self._keys[key]
+            sizes.append((sum(len(index.get(value, ())) for value in values),
+                          key, values))
+
+        positions = None
+
+        # intersect starting from the most selective key
+        for _, key, values in sorted(sizes):
+            matches = set()
+            for value in values:
+                matches.update(self._keys[key].get(value, ()))
+
+            positions = matches if positions is None else positions & matches
+            if not positions:
+                break
+
+        return positions
+
+    def search(self, *patterns, **criteria):
+        '''
+        Returns the proxy history items matching any of patterns and all
+        of criteria, in history order.
+
+        :params *patterns: strings (or regular expressions) to search
+        for in the URL, as Burp's ``getUrl()`` has it, i.e. always with
+        the port (``https://example.com:443/``).
+        :params **criteria: values (or lists of values) to match against
+        the `host`, `path`, `method`, `status_code` and `mime_type` of
+        each item, e.g. ``method=('PUT', 'DELETE')``.
+        '''
+        for key in criteria:
+            if key not in self.keys:
+                raise TypeError('Unknown history index key: %r' % (key, ))
+
+        if not self.ready:
+            self.rebuild()
+
+        matchers = [_matcher(pattern) for pattern in patterns]
+
+        with self._lock:
+            self._index_pending()
+
+            if criteria:
+                entries = [self._entries[position] for position in
+                           sorted(self._candidates(criteria))]
+            else:
+                entries = [entry for entry in self._entries
+                           if entry is not None]
+
+            if not matchers:
+                return [entry.item for entry in entries]
+
+            if len(matchers) == 1:
+                match, = matchers
+                return [entry.item for entry in entries if match(entry.url)]
+
+            return [entry.item for entry in entries
+                    if any(match(entry.url) for match in matchers)]
+
+
+class HistoryView(object):
+    '''
+    Read-only sequence over the proxy history, backed by a
+    :class:`HistoryIndex`. ``len()``, indexing (including negative
+    indexes) and slicing don't index the history, nor wrap or parse
+    anything but the items returned, and the most recently used wrapped
+    items are cached::
+
+        >>> len(Burp.history)
+        >>> Burp.history[-1]
+        >>> Burp.history[-50:]
+
+    New proxy items show up as the listener indexes them; call
+    :meth:`refresh` to pick up changes made in Burp itself, e.g. after
+    deleting items from the history.
+    '''
+    def __init__(self, index, compact=False, cache_size=1024):
+        self.index = index
+        self._wrap = HttpRecord if compact else HttpRequest
+        self._cache = LRUCache(cache_size)
+        self._generation = index.generation
+
+    def __repr__(self):
+        return '<HistoryView [%d items]>' % (len(self), )
+
+    def __len__(self):
+        if not self.index.ready:
+            self.index.rebuild()
+
+        return len(self.index)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._get(i) for i in xrange(*key.indices(len(self)))]
+
+        size = len(self)
+        if key < 0:
+            key += size
+        if not 0 <= key < size:
+            raise IndexError('history index out of range')
+
+        return self._get(key)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self._get(i)
+
+    def _invalidate(self):
+        # drop cached items whose position changed since they were cached
+        generation = self.index.generation
+        if generation == self._generation:
+            return
+
+        if generation == self._generation + 1:
+            start = self.index.changed_from
+            for position in self._cache.keys():
+                if position >= start:
+                    del self._cache[position]
+        else:
+            self._cache.clear()
+
+        self._generation = generation
+
+    def _get(self, position):
+        self._invalidate()
+        item = self._cache.get(position)
+
+        if item is None:
+            item = self._wrap(self.index.item(position),
+                              _burp=self.index.burp)
+            self._cache[position] = item
+
+        return item
+
+    def refresh(self):
+        '''
+        Picks up items added to Burp's proxy history since the last
+        refresh. Cached items whose position changed are dropped on the
+        next access, as they are after any rebuild or refresh of the
+        index.
+        '''
+        self.index.refresh()
+        return self
+
+    def _wrapped(self, func):
+        wrap, burp = self._wrap, self.index.burp
+        return lambda item: func(wrap(item, _burp=burp))
+
+    def pmap(self, func, workers=None, first=None, progress=None):
+        '''
+        Returns the list of ``func(request)`` for each item in the
+        history, in order, calling func on a pool of threads. Items are
+        wrapped (and parsed) by the worker threads, and not cached.
+
+        .. code-block:: python
+            Burp.history.pmap(lambda request: request.cookies.keys())
+
+        See :func:`gds.burp.parallel.imap` for the other arguments.
+
+        :param first: if given, stop after this many results.
+        '''
+        return parallel.pmap(self._wrapped(func), self.index.items(),
+                             workers=workers, first=first, progress=progress)
+
+    def pfilter(self, func, workers=None, first=None, progress=None):
+        '''
+        Returns the wrapped items in the history for which
+        ``func(request)`` is true, in order, calling func on a pool of
+        threads.
+
+        :param first: if given, stop after this many matching items.
+        '''
+        wrap, burp = self._wrap, self.index.burp
+
+        # hand back the item the worker wrapped, rather than wrapping
+        # (and parsing) each match a second time
+        def test(item):
+            request = wrap(item, _burp=burp)
+            if func(request):
+                return request
+
+        results = parallel.imap(test, self.index.items(), workers,
+                                progress=progress)
+        matches = []
+
+        try:
+            for request in results:
+                if request is not None:
+                    matches.append(request)
+                    if first is not None and len(matches) >= first:
+                        break
+        finally:
+            results.close()
+
+        return matches
+
+    def grep(self, pattern, groups=0, response=True, workers=None,
+             first=None, progress=None):
+        '''
+        Searches the raw responses (or requests) in the history for a
+        regular expression, on a pool of threads. Messages are searched
+        as they are, without being wrapped or parsed.
+
+        .. code-block:: python
+            for request, keys in Burp.history.grep(r'AKIA[0-9A-Z]{16}'):
+                print request.url.geturl(), keys
+
+        :param pattern: regular expression string or compiled pattern.
+        :param groups: group (or tuple of groups) returned for each
+            match, as passed to :meth:`re.MatchObject.group`.
+        :param response: if False, search requests instead of responses.
+        :param first: if given, stop after this many matching items.
+        :returns: a list of ``(request, values)`` tuples, where values
+            lists the matched group(s) of every match in that item.
+        '''
+        if isinstance(pattern, basestring):
+            pattern = re.compile(pattern)
+
+        if not isinstance(groups, tuple):
+            groups = (groups, )
+
+        def search(item):
+            message = item.getResponse() if response else item.getRequest()
+            if message is not None:
+                return [match.group(*groups)
+                        for match in pattern.finditer(_tostring(message))]
+
+        wrap, burp = self._wrap, self.index.burp
+        items = self.index.items()
+        results = parallel.imap(search, items, workers, progress=progress)
+        hits = []
+
+        try:
+            for item, values in izip(items, results):
+                if values:
+                    hits.append((wrap(item, _burp=burp), values))
+                    if first is not None and len(hits) >= first:
+                        break
+        finally:
+            results.close()
+
+        return hits
+
+    def unique(self, threshold=THRESHOLD, workers=None, progress=None):
+        '''
+        Lazily yields one wrapped item per cluster of exact and
+        near-duplicate response bodies (see :mod:`gds.burp.dedup`): the
+        first item in the history with each distinct body. Bodies are
+        fingerprinted on a pool of threads.
+
+        .. code-block:: python
+            for request in Burp.history.unique():
+                run_passive_checks(request)
+
+        :param threshold: maximum Hamming distance between the simhash
+            fingerprints of near-duplicates; 0 only skips exact
+            duplicates.
+        '''
+        wrap, burp = self._wrap, self.index.burp
+        clusterer = Clusterer(threshold, body=_response_body)
+
+        for item in clusterer.punique(self.index.items(), workers,
+                                      progress=progress):
+            yield wrap(item, _burp=burp)
+
+    def clusters(self, threshold=THRESHOLD, workers=None, progress=None):
+        '''
+        Returns the history grouped into clusters of exact and
+        near-duplicate response bodies, as lists of wrapped items, largest
+        first. The first item of each cluster is its representative.
+        '''
+        wrap, burp = self._wrap, self.index.burp
+        clusterer = Clusterer(threshold, body=_response_body)
+
+        for _ in clusterer.punique(self.index.items(), workers,
+                                   progress=progress):
+            pass
+
+        clusters = sorted(clusterer.clusters, key=len, reverse=True)
+        return [[wrap(item, _burp=burp) for item in cluster]
+                for cluster in clusters]
@@ -7,7 +7,9 @@ Listeners that implement new Burp Extender API's.
 '''
 from burp import IExtensionStateListener, IHttpListener, IScannerListener
 
-from .dispatchers import NewScanIssueDispatcher, PluginDispatcher
+from .dispatchers import NewScanIssueDispatcher, ObserverDispatcher, \
+    PluginDispatcher
+from .search import FullTextIndexer
 
 import gds.burp.settings as settings
 
@@ -51,17 +53,43 @@ class SaveConfigurationOnUnload(IExtensionStateListener):
         return
 
 
-class PluginListener(IHttpListener):
+class PluginListener(IHttpListener, IExtensionStateListener):
     def __init__(self, burp):
         self.burp = burp
         self.burp.registerHttpListener(self)
+        self.burp.registerExtensionStateListener(self)
 
     def processHttpMessage(self, toolFlag, messageIsRequest, messageInfo):
         toolName = self.burp.getToolName(toolFlag)
 
-        return PluginDispatcher(self.burp).processHttpMessage(
+        PluginDispatcher(self.burp).processHttpMessage(
+            toolName, messageIsRequest, messageInfo)
+
+        # observers see the message as the handlers left it
+        ObserverDispatcher(self.burp).processHttpMessage(
             toolName, messageIsRequest, messageInfo)
 
+        if not messageIsRequest and toolName.lower() == 'proxy':
+            try:
+                self.burp.history_index.add(messageInfo)
+            except Exception:
+                self.burp.log.exception('Could not index proxy message')
+
+        return
+
+    def extensionUnloaded(self):
+        # stop the threads of the components that were started by
+        # messages, without activating any that weren't
+        for cls in (ObserverDispatcher, FullTextIndexer):
+            component = self.burp.components.get(cls)
+            if component is None:
+                continue
+
+            try:
+                component.close()
+            except Exception:
+                self.burp.log.exception('Error closing %s', cls.__name__)
+
 
 class ScannerListener(IScannerListener):
     def __init__(self, burp):
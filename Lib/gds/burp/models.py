@@ -8,23 +8,29 @@ Burp's IHttpRequestResponse object's more... Pythonic.
 '''
 from java.net import URL
 try:
-    from burp import IHttpService, IScanIssue
+    from burp import IHttpRequestResponse, IHttpService, IScanIssue
 except ImportError:
+    class IHttpRequestResponse(object):pass
     class IHttpService(object):pass
     class IScanIssue(object):pass
 
-from Cookie import SimpleCookie
-from cStringIO import StringIO
-from cgi import FieldStorage, parse_header, parse_qs
+from array import array
+from cgi import parse_header, parse_qs
 from urlparse import urlparse
 
 from .decorators import reify
-from .structures import CaseInsensitiveDict
-
-import json
+from .parsers import get_body_parser
+from .structures import AnalyzedMessage, CaseInsensitiveDict, HeadersView, \
+    MappedMessage, MessageIndex
 
 CRLF = '\r\n'
 SP = chr(0x20)
+WS = ' \t\r\n\x0b\x0c'
+
+# Messages at least this many bytes long are indexed by Burp's
+# IExtensionHelpers rather than converted and scanned in Jython. See
+# :func:`gds.burp.benchmarks.bench_parsers` to tune for your machine.
+HELPERS_MIN_SIZE = 64 * 1024
 
 
 class HttpRequest(object):
@@ -33,39 +39,60 @@ class HttpRequest(object):
 
     Optional init arguments:
     :param _burp: IBurpExtender implementation
+    :param _deferred: if True, writes to :attr:`raw` are kept in the
+        cached buffer until :meth:`flush` is called.
+
+    The request (and its response) are only converted and parsed the
+    first time an attribute requiring it is accessed.
     '''
-    def __init__(self, messageInfo=None, _burp=None):
+    # reified attributes derived from the raw request, dropped whenever
+    # the raw request is replaced.
+    _parsed_attributes = ('_index', '_start_line', 'method', '_uri',
+                          'version', 'headers', 'body', 'cookies',
+                          'parameters', )
+
+    def __init__(self, messageInfo=None, _burp=None, _deferred=False):
         self._messageInfo = messageInfo
         self._burp = _burp
+        self._deferred = _deferred
+
+        self._raw = None
+        self._revision = 0
+        self._flushed = 0
 
         self._host = None
         self._port = 80
         self._protocol = 'http'
         self._url = ''
+        self._comment = None
+        self._highlight = None
 
-        self.method = None
-        self._uri = None
-        self.version = None
-        self._headers = {}
-        self.body = None
+    @classmethod
+    def from_raw(cls, request, response=None, host=None, port=80,
+                 protocol='http', _burp=None):
+        '''
+        Creates a request from raw request and response contents, e.g.
+        messages loaded from disk, without an IHttpRequestResponse.
+        '''
+        self = cls(None, _burp=_burp)
+        self._host = host
+        self._port = port
+        self._protocol = protocol
+        self._raw = request
 
-        if messageInfo is not None and hasattr(messageInfo, 'request'):
-            if messageInfo.getRequest():
-                self.method, self._uri, self.version, self._headers, self.body = \
-                    _parse_message(messageInfo.getRequest().tostring())
+        self.response = HttpResponse(None, request=self)
+        self.response._raw = response
 
-        if hasattr(messageInfo, 'response'):
-            self.response = HttpResponse(getattr(messageInfo, 'response', None),
-                                         request=self)
-        else:
-            self.response = HttpResponse(None, request=self)
+        return self
 
     def __contains__(self, item):
         return item in self.body if self.body else False
 
-    def __getstate__(self):
-        return {k: v if k not in ('_burp', '_messageInfo') else None
-                for k, v in self.__dict__.iteritems()}
+    def __reduce__(self):
+        # pickle as a compact binary snapshot of the raw messages, rather
+        # than everything that has been parsed out of them
+        from .snapshot import dumps
+        return _from_snapshot, (dumps(self), False, )
 
     def __len__(self):
         return int(self.headers.get('content-length', len(self.body or '')))
@@ -76,6 +103,63 @@ class HttpRequest(object):
     def __repr__(self):
         return '<HttpRequest [%s]>' % (getattr(self.url, 'path', ''), )
 
+    @reify
+    def _index(self):
+        '''
+        The :class:`MessageIndex <MessageIndex>` of the request, converted
+        and indexed on first access.
+        '''
+        if self._raw is not None:
+            return _index_message(self._raw)
+
+        if self._messageInfo is not None and \
+            hasattr(self._messageInfo, 'request'):
+            request = self._messageInfo.getRequest()
+            if request:
+                return _index_bytes(request, _burp=self._burp)
+
+    @reify
+    def _start_line(self):
+        if self._index is not None:
+            return _parse_start_line(self._index.start_line)
+
+        return None, None, None
+
+    @reify
+    def method(self):
+        '''
+        The HTTP method of this request.
+        '''
+        return self._start_line[0]
+
+    @reify
+    def _uri(self):
+        return self._start_line[1]
+
+    @reify
+    def version(self):
+        '''
+        The HTTP version of this request.
+        '''
+        return self._start_line[2]
+
+    @reify
+    def body(self):
+        '''
+        The body of this request.
+        '''
+        if self._index is not None:
+            return self._index.body
+
+    @reify
+    def response(self):
+        '''
+        The :class:`HttpResponse <HttpResponse>` for this request. The
+        response is not parsed until one of its attributes is accessed.
+        '''
+        return HttpResponse(getattr(self._messageInfo, 'response', None),
+                            request=self)
+
     @property
     def host(self):
         '''
@@ -170,10 +254,16 @@ class HttpRequest(object):
 
         :returns: :class:`~urlparse.ParseResult` object.
         '''
+        _url = None
         if self._messageInfo is not None:
             _url = self._messageInfo.getUrl()
-            if _url:
-                self._url = urlparse(_url.toString())
+
+        if _url:
+            self._url = urlparse(_url.toString())
+
+        elif self._uri is not None:
+            self._url = urlparse(_build_url(self.protocol, self.host,
+                                            self.port, self._uri))
 
         return self._url
 
@@ -184,21 +274,26 @@ class HttpRequest(object):
 
         Note: This is a **read-only** attribute.
 
-        :returns: :class:`~Cookie.SimpleCookie` object.
+        :returns: :class:`Cookies <Cookies>` object.
         '''
-        self._cookies = SimpleCookie(self.headers.get('cookie', ''))
+        self._cookies = _parse_cookies(self.headers.getlist('cookie'))
         return self._cookies
 
     @reify
     def headers(self):
         '''
         The HTTP headers sent in this request. Headers are accessible
-        by their header names (case insensitive).
+        by their header names (case insensitive). This is a
+        :class:`~gds.burp.structures.HeadersView` over the message, not
+        a ``dict``; ``headers.copy()`` returns a
+        :class:`~gds.burp.structures.CaseInsensitiveDict`, which is one.
 
         Note: This is a **read-only** attribute.
         '''
-        self._headers = CaseInsensitiveDict(self._headers)
-        return self._headers
+        if self._index is not None:
+            return HeadersView(self._index)
+
+        return CaseInsensitiveDict()
 
     @reify
     def parameters(self):
@@ -208,7 +303,7 @@ class HttpRequest(object):
 
         Note: This is a **read-only** attribute.
         '''
-        self._parameters = _parse_parameters(self)
+        self._parameters = Parameters(self)
         return self._parameters
 
     @property
@@ -242,23 +337,67 @@ class HttpRequest(object):
     @property
     def raw(self):
         '''
-        Returns the full request contents.
+        Returns the full request contents. The request is copied from
+        Burp once and cached for subsequent accesses.
         '''
-        if self._messageInfo:
-            return self._messageInfo.getRequest().tostring()
+        if self._raw is None and self._messageInfo:
+            request = self._messageInfo.getRequest()
+            if request is not None:
+                self._raw = request.tostring()
 
-        return
+        return self._raw
 
     @raw.setter
     def raw(self, message):
         '''
         Sets the request contents which should be sent to the application.
 
+        Unless this request was created with `_deferred=True`, the new
+        contents are written back to Burp straight away. Otherwise they
+        are only written by :meth:`flush`.
+
         :param message: The request contents which should be sent to the
         application.
         '''
-        if self._messageInfo:
-            self._messageInfo.setRequest(message)
+        self._raw = message
+        self._revision += 1
+        _invalidate(self, self._parsed_attributes)
+
+        if not self._deferred:
+            self.flush()
+
+        return
+
+    @property
+    def modified(self):
+        '''
+        True if the request or response contents have been replaced
+        since they were last written back to Burp.
+
+        Note: This is a **read-only** attribute.
+        '''
+        if self._revision != self._flushed:
+            return True
+
+        response = self.__dict__.get('response')
+        return response is not None and response.modified
+
+    def flush(self):
+        '''
+        Writes the cached request and response contents back to Burp,
+        only if they have been replaced since they were last written.
+        '''
+        if self._revision != self._flushed:
+            if self._messageInfo:
+                self._messageInfo.setRequest(self._raw)
+                # Burp derives the URL from the request
+                _invalidate(self, ('url', ))
+
+            self._flushed = self._revision
+
+        response = self.__dict__.get('response')
+        if response is not None:
+            response.flush()
 
         return
 
@@ -270,7 +409,7 @@ class HttpRequest(object):
         if self._messageInfo:
             return self._messageInfo.getComment()
 
-        return
+        return self._comment
 
     @comment.setter
     def comment(self, comment):
@@ -282,6 +421,7 @@ class HttpRequest(object):
         if self._messageInfo:
             return self._messageInfo.setComment(comment)
 
+        self._comment = comment
         return
 
     @property
@@ -292,7 +432,7 @@ class HttpRequest(object):
         if self._messageInfo:
             return self._messageInfo.getHighlight()
 
-        return
+        return self._highlight
 
     @highlight.setter
     def highlight(self, color):
@@ -305,24 +445,26 @@ class HttpRequest(object):
         '''
         if self._messageInfo:
             self._messageInfo.setHighlight(color)
+            return
 
+        self._highlight = color
         return
 
 
 class HttpResponse(object):
+    # reified attributes derived from the raw response, dropped whenever
+    # the raw response is replaced.
+    _parsed_attributes = ('_index', '_start_line', 'version', 'status_code',
+                          'reason', 'headers', 'body', 'cookies', )
+
     def __init__(self, message=None, request=None):
         self.request = request
-
-        self.version = None
-        self.status_code = None
-        self.reason = None
         self.encoding = None
-        self._headers = {}
-        self.body = None
 
-        if message is not None:
-            self.version, self.status_code, self.reason, self._headers, self.body = \
-                _parse_message(message.tostring())
+        self._raw_message = message
+        self._raw = None
+        self._revision = 0
+        self._flushed = 0
 
     def __contains__(self, item):
         return item in self.body if self.body else False
@@ -336,6 +478,55 @@ class HttpResponse(object):
     def __repr__(self):
         return '<HttpResponse [%s]>' % (self.status_code, )
 
+    @reify
+    def _index(self):
+        '''
+        The :class:`MessageIndex <MessageIndex>` of the response, converted
+        and indexed on first access.
+        '''
+        if self._raw is not None:
+            return _index_message(self._raw)
+
+        if self._raw_message is not None:
+            return _index_bytes(self._raw_message, is_response=True,
+                                _burp=getattr(self.request, '_burp', None))
+
+    @reify
+    def _start_line(self):
+        if self._index is not None:
+            return _parse_start_line(self._index.start_line)
+
+        return None, None, None
+
+    @reify
+    def version(self):
+        '''
+        The HTTP version of this response.
+        '''
+        return self._start_line[0]
+
+    @reify
+    def status_code(self):
+        '''
+        The HTTP status code of this response.
+        '''
+        return self._start_line[1]
+
+    @reify
+    def reason(self):
+        '''
+        The HTTP reason phrase of this response.
+        '''
+        return self._start_line[2]
+
+    @reify
+    def body(self):
+        '''
+        The body of this response.
+        '''
+        if self._index is not None:
+            return self._index.body
+
     @reify
     def cookies(self):
         '''
@@ -343,21 +534,26 @@ class HttpResponse(object):
 
         Note: This is a **read-only** attribute.
 
-        :returns: :class:`~Cookie.SimpleCookie` object.
+        :returns: :class:`Cookies <Cookies>` object.
         '''
-        self._cookies = SimpleCookie(self.headers.get('set-cookie', ''))
+        self._cookies = _parse_set_cookies(self.headers.getlist('set-cookie'))
         return self._cookies
 
     @reify
     def headers(self):
         '''
         The HTTP headers received in this response. Headers are accessible
-        by their header names (case insensitive).
+        by their header names (case insensitive). This is a
+        :class:`~gds.burp.structures.HeadersView` over the message, not
+        a ``dict``; ``headers.copy()`` returns a
+        :class:`~gds.burp.structures.CaseInsensitiveDict`, which is one.
 
         Note: This is a **read-only** attribute.
         '''
-        self._headers = CaseInsensitiveDict(self._headers)
-        return self._headers
+        if self._index is not None:
+            return HeadersView(self._index)
+
+        return CaseInsensitiveDict()
 
     @property
     def content_type(self):
@@ -371,12 +567,13 @@ class HttpResponse(object):
     @property
     def raw(self):
         '''
-        Returns the full response contents.
+        Returns the full response contents. The response is copied from
+        Burp once and cached for subsequent accesses.
         '''
-        if self.request._messageInfo:
-            return self.request._messageInfo.getResponse().tostring()
+        if self._raw is None and self._raw_message is not None:
+            self._raw = self._raw_message.tostring()
 
-        return
+        return self._raw
 
     @raw.setter
     def raw(self, message):
@@ -384,15 +581,399 @@ class HttpResponse(object):
         Sets the response contents which should be processed by the
         invoking Burp tool.
 
+        Unless the request was created with `_deferred=True`, the new
+        contents are written back to Burp straight away. Otherwise they
+        are only written by :meth:`HttpRequest.flush`.
+
         :param message: The response contents which should be processed
         by the invoking Burp tool.
         '''
-        if self.request._messageInfo:
-            return self.request._messageInfo.setResponse(message)
+        self._raw = message
+        self._revision += 1
+        _invalidate(self, self._parsed_attributes)
+
+        if not getattr(self.request, '_deferred', False):
+            self.flush()
+
+        return
+
+    @property
+    def modified(self):
+        '''
+        True if the response contents have been replaced since they
+        were last written back to Burp.
+
+        Note: This is a **read-only** attribute.
+        '''
+        return self._revision != self._flushed
+
+    def flush(self):
+        '''
+        Writes the cached response contents back to Burp, only if they
+        have been replaced since they were last written.
+        '''
+        if self._revision != self._flushed:
+            messageInfo = getattr(self.request, '_messageInfo', None)
+            if messageInfo:
+                messageInfo.setResponse(self._raw)
+
+            self._flushed = self._revision
 
         return
 
 
+class Parameters(object):
+    '''
+    Lazy mapping of the parameters of a request by source ("query" and
+    "body"). Each source is only parsed the first time it is looked up,
+    so handlers only checking the query string never decode the body.
+
+    Bodies are parsed by the parser registered for the request's
+    Content-Type in :data:`gds.burp.parsers.BODY_PARSERS`. Once a body
+    has failed to parse, "body" is left out of the sources.
+    '''
+    def __init__(self, request):
+        self._request = request
+        self._parsed = {}
+        self._unparsable = False
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+    def __contains__(self, source):
+        return source in self.keys()
+
+    def __getitem__(self, source):
+        if source not in self._parsed:
+            if source not in self:
+                raise KeyError(source)
+
+            if source == 'query':
+                self._parsed[source] = parse_qs(self._request.url.query,
+                                                keep_blank_values=True)
+            else:
+                parser, params = self._body_parser
+                try:
+                    self._parsed[source] = parser(self._request, params)
+                except (TypeError, ValueError):
+                    self._unparsable = True
+                    raise KeyError(source)
+
+        return self._parsed[source]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    @reify
+    def _body_parser(self):
+        ctype, params = parse_header(
+            self._request.headers.get('content-type', ''))
+        return get_body_parser(ctype), params
+
+    def get(self, source, default=None):
+        try:
+            return self[source]
+        except KeyError:
+            return default
+
+    def keys(self):
+        '''
+        Returns the sources this request has parameters in, without
+        parsing any of them.
+        '''
+        keys = []
+
+        if getattr(self._request.url, 'query', None):
+            keys.append('query')
+
+        # check for a body by its offset, rather than slicing it out
+        index = self._request._index
+        if index is not None and len(index.message) > index.body_offset \
+            and self._body_parser[0] is not None and not self._unparsable:
+            keys.append('body')
+
+        return keys
+
+    def iteritems(self):
+        for source in self.keys():
+            try:
+                value = self[source]
+            except KeyError:
+                # the body failed to parse
+                continue
+            yield source, value
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return [value for _, value in self.iteritems()]
+
+
+class HttpRecord(object):
+    '''
+    Compact, read-only record of a request and its response, for bulk
+    work over large histories. Unlike :class:`HttpRequest <HttpRequest>`
+    it has no instance dictionary and caches no parsed values: only the
+    raw buffers (as returned by Burp, not converted to strings) and the
+    service are kept. Once a message has been parsed, its slot is
+    replaced with a :class:`~gds.burp.structures.MessageIndex`: the same
+    buffer, along with the offsets of its start line, headers and body.
+
+    Use :meth:`expand` to get a full :class:`HttpRequest <HttpRequest>`.
+    '''
+    __slots__ = ('host', 'port', 'protocol', 'comment', 'highlight',
+                 '_request', '_response', )
+
+    def __init__(self, messageInfo=None, _burp=None):
+        self.host = self.port = self.protocol = None
+        self.comment = self.highlight = None
+        self._request = self._response = None
+
+        if messageInfo is not None:
+            self.host = messageInfo.getHost()
+            self.port = messageInfo.getPort()
+            self.protocol = messageInfo.getProtocol()
+            self.comment = messageInfo.getComment()
+            self.highlight = messageInfo.getHighlight()
+            self._request = messageInfo.getRequest()
+            self._response = messageInfo.getResponse()
+
+    @classmethod
+    def from_raw(cls, request, response=None, host=None, port=80,
+                 protocol='http'):
+        self = cls()
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self._request = request
+        self._response = response
+        return self
+
+    def __reduce__(self):
+        from .snapshot import dumps
+        return _from_snapshot, (dumps(self), True, )
+
+    def __repr__(self):
+        return '<HttpRecord [%s]>' % (self.url.path, )
+
+    def _indexed(self, name):
+        message = getattr(self, name)
+        if message is None or isinstance(message, MessageIndex):
+            return message
+
+        if isinstance(message, str):
+            index = _index_message(message)
+        elif isinstance(message, MappedMessage):
+            index = _index_view(message)
+        else:
+            # index a temporary string, then point the offsets back at
+            # the more compact byte array
+            index = _index_message(message.tostring())
+            index.message = message
+
+        setattr(self, name, index)
+        return index
+
+    @property
+    def method(self):
+        index = self._indexed('_request')
+        if index is not None:
+            return _parse_start_line(index.start_line)[0]
+
+    @property
+    def uri(self):
+        index = self._indexed('_request')
+        if index is not None:
+            return _parse_start_line(index.start_line)[1]
+
+    @property
+    def url(self):
+        return urlparse(_build_url(self.protocol, self.host, self.port,
+                                   self.uri or ''))
+
+    @property
+    def headers(self):
+        index = self._indexed('_request')
+        if index is not None:
+            return HeadersView(index)
+        return CaseInsensitiveDict()
+
+    @property
+    def body(self):
+        index = self._indexed('_request')
+        if index is not None:
+            return index.body
+
+    @property
+    def status_code(self):
+        index = self._indexed('_response')
+        if index is not None:
+            return _parse_start_line(index.start_line)[1]
+
+    @property
+    def response_headers(self):
+        index = self._indexed('_response')
+        if index is not None:
+            return HeadersView(index)
+        return CaseInsensitiveDict()
+
+    @property
+    def response_body(self):
+        index = self._indexed('_response')
+        if index is not None:
+            return index.body
+
+    @property
+    def raw(self):
+        return _tostring(self._request)
+
+    @property
+    def response_raw(self):
+        return _tostring(self._response)
+
+    def expand(self, _burp=None):
+        '''
+        Returns a full :class:`HttpRequest <HttpRequest>` for this record.
+        '''
+        request = HttpRequest.from_raw(self.raw, self.response_raw,
+                                       self.host, self.port, self.protocol,
+                                       _burp=_burp)
+        request._comment = self.comment
+        request._highlight = self.highlight
+        return request
+
+
+def _from_snapshot(data, compact):
+    from .snapshot import loads
+    return loads(data, compact)
+
+
+def _tostring(message):
+    if isinstance(message, MessageIndex):
+        message = message.message
+    if message is None or isinstance(message, str):
+        return message
+    return message.tostring()
+
+
+def _build_url(protocol, host, port, uri):
+    if uri.startswith(('http://', 'https://')):
+        return uri
+
+    if (protocol, port) in (('http', 80), ('https', 443)):
+        return '%s://%s%s' % (protocol, host, uri)
+
+    return '%s://%s:%d%s' % (protocol, host, port, uri)
+
+
+class Cookie(object):
+    '''
+    A single HTTP cookie. Mostly compatible with :class:`~Cookie.Morsel`:
+    the name and value are available as :attr:`key` and :attr:`value`,
+    attributes (path, domain, expires, ...) by indexing with their name.
+    Attributes are only parsed the first time one is looked up.
+    '''
+    __slots__ = ('key', 'value', '_raw_attributes', '_attributes', )
+
+    def __init__(self, key, value, attributes=''):
+        self.key = key
+        self.value = value
+        self._raw_attributes = attributes
+        self._attributes = None
+
+    def __repr__(self):
+        return '<Cookie: %s=%r>' % (self.key, self.value, )
+
+    def __str__(self):
+        if self._raw_attributes:
+            return '%s=%s; %s' % (self.key, self.value,
+                                  self._raw_attributes, )
+        return '%s=%s' % (self.key, self.value, )
+
+    def __contains__(self, name):
+        return name.lower() in self.attributes
+
+    def __getitem__(self, name):
+        return self.attributes.get(name.lower(), '')
+
+    @property
+    def attributes(self):
+        if self._attributes is None:
+            attributes = {}
+            for name, value in _iter_pairs(self._raw_attributes):
+                # flags such as Secure and HttpOnly have no value
+                attributes[name.lower()] = value if value is not None else True
+            self._attributes = attributes
+        return self._attributes
+
+
+class Cookies(object):
+    '''
+    Cheap, read-only, dict-like view of the cookies in a request or
+    response. Cookie values are kept as plain strings;
+    :class:`Cookie <Cookie>` objects are only created when a cookie is
+    looked up by name (e.g. ``cookies['JSESSIONID'].value``). Use
+    :meth:`getvalue` to get at a value without creating one.
+    '''
+    __slots__ = ('_values', '_attributes', '_cookies', )
+
+    def __init__(self, values=None, attributes=None):
+        self._values = values if values is not None else {}
+        self._attributes = attributes if attributes is not None else {}
+        self._cookies = {}
+
+    def __reduce__(self):
+        return self.__class__, (self._values, self._attributes, )
+
+    def __repr__(self):
+        return '<Cookies: %s>' % (' '.join(
+            '%s=%r' % item for item in self._values.iteritems()), )
+
+    def __contains__(self, name):
+        return name in self._values
+
+    def __getitem__(self, name):
+        cookie = self._cookies.get(name)
+        if cookie is None:
+            cookie = Cookie(name, self._values[name],
+                            self._attributes.get(name, ''))
+            self._cookies[name] = cookie
+        return cookie
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, name, default=None):
+        if name in self._values:
+            return self[name]
+        return default
+
+    def getvalue(self, name, default=None):
+        return self._values.get(name, default)
+
+    def keys(self):
+        return self._values.keys()
+
+    def values(self):
+        return [self[name] for name in self._values]
+
+    def items(self):
+        return [(name, self[name]) for name in self._values]
+
+    def as_dict(self):
+        '''
+        Returns a plain dictionary mapping cookie names to values.
+        '''
+        return dict(self._values)
+
+
 class HttpService(IHttpService):
     __slots__ = ['host', 'port', 'protocol', ]
 
@@ -502,58 +1083,211 @@ class ScanIssue(IScanIssue):
         return getattr(self, 'protocol', u'http')
 
 
-def _parse_message(message):
-    is_response = False
-    pos = idx = 0
+class HttpRequestResponse(IHttpRequestResponse):
+    '''
+    Python implementation of IHttpRequestResponse, for messages that
+    don't come from Burp, e.g. traffic loaded from an export or a
+    :class:`~gds.burp.store.MessageStore` and replayed through handlers
+    by :mod:`gds.burp.offline`.
+
+    :param request: the raw request, as a string or byte array.
+    :param response: the raw response, if any.
+    :param httpService: an IHttpService, by default
+        :class:`HttpService`'s.
+    '''
+    __slots__ = ['request', 'response', 'httpService', 'comment',
+                 'highlight', ]
+
+    def __init__(self, request=None, response=None, httpService=None,
+                 comment=None, highlight=None):
+        self.request = _bytes(request)
+        self.response = _bytes(response)
+        self.httpService = httpService or HttpService()
+        self.comment = comment
+        self.highlight = highlight
+
+    @classmethod
+    def copy(cls, messageInfo):
+        '''
+        Returns a detached copy of an IHttpRequestResponse (or
+        :class:`~gds.burp.store.StoredMessage`), :class:`HttpRequest` or
+        :class:`HttpRecord`.
+        '''
+        if isinstance(messageInfo, (HttpRequest, HttpRecord)):
+            from .snapshot import _fields
+            request, response, host, port, protocol, comment, highlight = \
+                _fields(messageInfo)
+            return cls(request, response,
+                       HttpService(host=host, port=port, protocol=protocol),
+                       comment, highlight)
+
+        return cls(messageInfo.getRequest(), messageInfo.getResponse(),
+                   HttpService(host=messageInfo.getHost(),
+                               port=messageInfo.getPort(),
+                               protocol=messageInfo.getProtocol()),
+                   messageInfo.getComment(), messageInfo.getHighlight())
 
-    idx = message.find(CRLF, pos)
+    def __repr__(self):
+        return '<HttpRequestResponse %s://%s:%d>' % (
+            self.getProtocol(), self.getHost(), self.getPort(), )
 
-    if idx != -1:
-        start_line = message[pos:idx]
+    def getRequest(self):
+        return self.request
 
-        if start_line.startswith('HTTP/'):
-            is_response = True
+    def setRequest(self, message):
+        self.request = _bytes(message)
 
-        _idx = start_line.find(SP)
+    def getResponse(self):
+        return self.response
 
-        if _idx != -1:
-            if is_response:
-                version = start_line[0:_idx]
-            else:
-                method = start_line[0:_idx]
+    def setResponse(self, message):
+        self.response = _bytes(message)
 
-            _pos = _idx + 1
+    def getComment(self):
+        return self.comment
 
-        if is_response:
-            _idx = start_line.find(SP, _pos)
+    def setComment(self, comment):
+        self.comment = comment
+
+    def getHighlight(self):
+        return self.highlight
+
+    def setHighlight(self, color):
+        self.highlight = color
+
+    def getHttpService(self):
+        return self.httpService
+
+    def setHttpService(self, httpService):
+        self.httpService = httpService
+
+    def getHost(self):
+        return self.httpService.getHost()
+
+    def setHost(self, host):
+        self.httpService = HttpService(self.httpService, host=host)
+
+    def getPort(self):
+        return self.httpService.getPort()
 
-            status = start_line[_pos:_idx]
-            if not status.isdigit():
-                raise ValueError('status code %r is not a number' % (status, ))
+    def setPort(self, port):
+        self.httpService = HttpService(self.httpService, port=port)
 
-            status = int(status)
+    def getProtocol(self):
+        return self.httpService.getProtocol()
+
+    def setProtocol(self, protocol):
+        self.httpService = HttpService(self.httpService, protocol=protocol)
+
+    def getUrl(self):
+        if self.request is None:
+            return None
+
+        uri = _parse_start_line(_read_start_line(self.request))[1]
+        return URL(_build_url(self.getProtocol(), self.getHost(),
+                              self.getPort(), uri))
+
+
+def _bytes(message):
+    # Burp hands messages to extensions as byte arrays
+    if message is None or isinstance(message, array):
+        return message
+
+    if isinstance(message, MappedMessage):
+        message = message.tostring()
+
+    if isinstance(message, basestring):
+        return array('b', message)
+
+    return array('b', message.tostring())
 
-            _pos = _idx + 1
-            reason = start_line[_pos:]
 
+def _read_start_line(message):
+    # reads the start line without converting the whole message
+    end = 0
+    while True:
+        end += 1024
+        head = message[:end].tostring()
+        if CRLF in head or end >= len(message):
+            return head.partition(CRLF)[0]
+
+
+def _invalidate(obj, names):
+    '''
+    Drops reified attributes from obj, so they are computed again from
+    the current raw message on next access.
+    '''
+    for name in names:
+        obj.__dict__.pop(name, None)
+
+
+def _parse_start_line(start_line):
+    is_response = start_line.startswith('HTTP/')
+
+    _idx = start_line.find(SP)
+
+    if _idx != -1:
+        if is_response:
+            version = start_line[0:_idx]
         else:
-            # work out the http version by looking in reverse
-            _ridx = start_line.rfind(SP)
-            version = start_line[_ridx + 1:]
-            if not version.startswith('HTTP/'):
-                raise ValueError('Invalid HTTP version: %r' % (version, ))
-
-            # request-uri will be everything in-between.
-            # some clients might not encode space into a plus or %20
-            uri = start_line[_pos:_ridx]
-            if not uri or uri.isspace():
-                raise ValueError('Invalid URI: %r' % (uri, ))
-
-        pos = idx + 2
-    else:
+            method = start_line[0:_idx]
+
+        _pos = _idx + 1
+
+    if is_response:
+        _idx = start_line.find(SP, _pos)
+
+        status = start_line[_pos:_idx]
+        if not status.isdigit():
+            raise ValueError('status code %r is not a number' % (status, ))
+
+        status = int(status)
+
+        _pos = _idx + 1
+        reason = start_line[_pos:]
+
+        return version, status, reason
+
+    # work out the http version by looking in reverse
+    _ridx = start_line.rfind(SP)
+    version = start_line[_ridx + 1:]
+    if not version.startswith('HTTP/'):
+        raise ValueError('Invalid HTTP version: %r' % (version, ))
+
+    # request-uri will be everything in-between.
+    # some clients might not encode space into a plus or %20
+    uri = start_line[_pos:_ridx]
+    if not uri or uri.isspace():
+        raise ValueError('Invalid URI: %r' % (uri, ))
+
+    return method, uri, version
+
+
+def _parse_message(message):
+    index = _index_message(message)
+
+    headers = CaseInsensitiveDict(index.iterheaders())
+
+    return _parse_start_line(index.start_line) + (headers, index.body)
+
+
+def _index_message(message):
+    '''
+    Scans message once, recording the offsets of the start-line, each
+    header name and value, and the body in a :class:`MessageIndex`.
+    No header or body strings are copied out of the message.
+    '''
+    pos = idx = 0
+
+    idx = message.find(CRLF, pos)
+
+    if idx == -1:
         raise ValueError('Could not parse start-line from message')
 
-    headers = CaseInsensitiveDict()
+    start_line_end = idx
+    pos = idx + 2
+
+    offsets = array('i')
 
     while (idx != -1):
         idx = message.find(CRLF, pos)
@@ -565,76 +1299,150 @@ def _parse_message(message):
             break
 
         if idx != -1:
-            header = message[pos:idx]
-            _idx = header.find(':')
+            _idx = message.find(':', pos, idx)
 
             if _idx != -1:
-                name = header[:_idx].strip()
-                value = header[_idx + 1:].strip()
-
-                has_value = headers.get(name)
-
-                if has_value and has_value != value:
-                    value = ', '.join([has_value, value])
-
-                headers[name] = value
+                # strip whitespace by moving offsets rather than slicing
+                name_start, name_end = pos, _idx
+                while name_start < name_end and message[name_start] in WS:
+                    name_start += 1
+                while name_end > name_start and message[name_end - 1] in WS:
+                    name_end -= 1
+
+                value_start, value_end = _idx + 1, idx
+                while value_start < value_end and message[value_start] in WS:
+                    value_start += 1
+                while value_end > value_start and message[value_end - 1] in WS:
+                    value_end -= 1
+
+                offsets.extend((name_start, name_end, value_start, value_end))
             else:
-                raise ValueError('Error parsing header: %r' % (header, ))
+                raise ValueError('Error parsing header: %r' % (
+                                 message[pos:idx], ))
 
             pos = idx + 2
         else:
             # looks like we reached the end of the message before EOL
             break
 
-    if idx < len(message):
-        body = message[pos:]
-    else:
-        raise ValueError('Parsed past message body??')
+    return MessageIndex(message, start_line_end, pos, offsets)
+
 
-    if not is_response:
-        return method, uri, version, headers, body
+def _analyze_message(helpers, message, is_response=False):
+    '''
+    Indexes a Java byte[] message using Burp's
+    :class:`IExtensionHelpers <IExtensionHelpers>`, without converting
+    the message to a Python string first.
+    '''
+    if is_response:
+        info = helpers.analyzeResponse(message)
     else:
-        return version, status, reason, headers, body
+        info = helpers.analyzeRequest(message)
 
+    return AnalyzedMessage(message, info.getHeaders(), info.getBodyOffset())
 
-def _parse_parameters(request):
-    parameters = {}
 
-    if request.url.query:
-        parameters['query'] = parse_qs(request.url.query,
-                                       keep_blank_values=True)
+def _index_bytes(message, is_response=False, _burp=None):
+    '''
+    Indexes a Java byte[] message, picking the parser backend by
+    message size. Large messages are handed to Burp's helpers, which
+    avoids copying them into a Python string until the body is read.
+    '''
+    if isinstance(message, MappedMessage):
+        return _index_view(message)
 
-    ctype, pdict = parse_header(request.headers.get('content-type', ''))
+    if _burp is not None and len(message) >= HELPERS_MIN_SIZE:
+        try:
+            helpers = _burp.helpers
+        except Exception:
+            helpers = None
 
-    if ctype == 'application/x-www-form-urlencoded':
-        parameters['body'] = parse_qs(request.body, keep_blank_values=True)
+        if helpers is not None:
+            return _analyze_message(helpers, message, is_response)
 
-    elif ctype.startswith('multipart/'):
-        parameters['body'] = FieldStorage(
-            fp=StringIO(request.body),
-            headers=request.headers,
-            environ={
-                'REQUEST_METHOD': request.method,
-                'QUERY_STRING': request.url.query,
-                },
-            keep_blank_values=True)
+    return _index_message(message.tostring())
 
-    elif ctype in ('application/json', ):
-        try:
-            parameters['body'] = json.loads(request.body)
-        except (NameError, TypeError):
-            pass
 
-    elif ctype == 'application/x-amf':
-        pass
+def _index_view(message):
+    '''
+    Indexes a :class:`~gds.burp.structures.MappedMessage`, copying only
+    its head out of the mapping. The index keeps slicing the mapping
+    for header values and the body.
+    '''
+    size = 8 * 1024
+    head = message[:size]
 
-    elif ctype == 'text/x-gwt-rpc':
-        pass
+    while CRLF + CRLF not in head and size < len(message):
+        size *= 4
+        head = message[:size]
 
-    elif ctype == 'application/xml':
-        pass
+    index = _index_message(head)
+    index.message = message
+    return index
 
-    else:
-        pass
 
-    return parameters
+def _iter_pairs(header):
+    '''
+    Yields a ``(name, value)`` pair for each ";"-separated item of header,
+    in a single pass. value is None for items without "=".
+    '''
+    pos = 0
+    end = len(header)
+
+    while pos < end:
+        idx = header.find(';', pos)
+        if idx == -1:
+            idx = end
+
+        eq = header.find('=', pos, idx)
+        if eq == -1:
+            name = header[pos:idx].strip()
+            value = None
+        else:
+            name = header[pos:eq].strip()
+            value = header[eq + 1:idx].strip()
+            if len(value) > 1 and value[0] == value[-1] == '"':
+                value = value[1:-1]
+
+        if name:
+            yield name, value
+
+        pos = idx + 1
+
+
+def _parse_cookies(headers):
+    '''
+    Parses the values of the Cookie request header(s) into a
+    :class:`Cookies <Cookies>` view.
+    '''
+    values = {}
+
+    for header in headers:
+        for name, value in _iter_pairs(header):
+            if value is not None:
+                values[name] = value
+
+    return Cookies(values)
+
+
+def _parse_set_cookies(headers):
+    '''
+    Parses the values of the Set-Cookie response header(s) into a
+    :class:`Cookies <Cookies>` view. Only each cookie's name and value
+    are tokenized here, its attributes are kept as they are.
+    '''
+    values = {}
+    attributes = {}
+
+    for header in headers:
+        idx = header.find(';')
+        if idx == -1:
+            cookie, attrs = header, ''
+        else:
+            cookie, attrs = header[:idx], header[idx + 1:].strip()
+
+        for name, value in _iter_pairs(cookie):
+            values[name] = value if value is not None else ''
+            attributes[name] = attrs
+
+    return Cookies(values, attributes)
@@ -9,6 +9,8 @@ import time
 class PluginMonitorThread(Thread):
     def __init__(self, burp, interval=5):
         Thread.__init__(self, name='plugin-monitor')
+        # don't keep the JVM (or a headless run) alive on exit
+        self.daemon = True
         self.burp = burp
         self.log = self.burp.log
         self.interval = interval
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+'''
+gds.burp.offline
+~~~~~~~~~~~~~~~~
+
+Headless stand-in for Burp's IBurpExtenderCallbacks, so that
+:class:`BurpExtender`, its components and handlers can be run over
+recorded traffic (e.g. in CI) without starting Burp::
+
+    >>> from gds.burp.export import load
+    >>> from gds.burp.offline import headless
+    >>> burp = headless(history=load('/tmp/history.ndjson.gz'),
+    ...                 config='burp.ini')
+    >>> burp.cb.replay()
+    >>> burp.cb.issues
+
+The history and site map may be any iterable of IHttpRequestResponse
+objects, such as a :class:`~gds.burp.store.MessageStore`, which is read
+lazily rather than loaded into memory. Listeners registered by the
+extension are kept, and :meth:`OfflineCallbacks.replay` feeds messages
+through the HTTP listeners as Burp would. Callbacks that need Burp
+itself (making requests, the scanner, UI) are missing, and raise the
+usual "not available in your version of Burp" exception.
+'''
+import json
+import os
+
+from .models import HttpRecord, HttpRequest, HttpRequestResponse, \
+    HttpService, _bytes
+
+import gds.burp.settings as settings
+
+import logging
+
+
+__all__ = ['headless', 'OfflineCallbacks', ]
+
+log = logging.getLogger(__name__)
+
+TOOL_SUITE = 0x00000001
+TOOL_TARGET = 0x00000002
+TOOL_PROXY = 0x00000004
+TOOL_SPIDER = 0x00000008
+TOOL_SCANNER = 0x00000010
+TOOL_INTRUDER = 0x00000020
+TOOL_REPEATER = 0x00000040
+TOOL_SEQUENCER = 0x00000080
+TOOL_DECODER = 0x00000100
+TOOL_COMPARER = 0x00000200
+TOOL_EXTENDER = 0x00000400
+
+_TOOL_NAMES = {
+    TOOL_SUITE: 'Suite',
+    TOOL_TARGET: 'Target',
+    TOOL_PROXY: 'Proxy',
+    TOOL_SPIDER: 'Spider',
+    TOOL_SCANNER: 'Scanner',
+    TOOL_INTRUDER: 'Intruder',
+    TOOL_REPEATER: 'Repeater',
+    TOOL_SEQUENCER: 'Sequencer',
+    TOOL_DECODER: 'Decoder',
+    TOOL_COMPARER: 'Comparer',
+    TOOL_EXTENDER: 'Extender',
+    }
+
+
+def _registrar(kind):
+    def register(self, *args):
+        # the listener is the last argument, e.g. of registerMenuItem
+        self.listeners.setdefault(kind, []).append(args[-1])
+
+    def remove(self, listener):
+        listeners = self.listeners.get(kind, [])
+        if listener in listeners:
+            listeners.remove(listener)
+
+    return register, remove
+
+
+def _message(item):
+    # Burp only hands out IHttpRequestResponse objects
+    if isinstance(item, (HttpRecord, HttpRequest)):
+        return HttpRequestResponse.copy(item)
+    return item
+
+
+def _url(item):
+    url = item.getUrl()
+    if url is not None:
+        return url.toString()
+    return HttpRecord(item).url.geturl()
+
+
+class _TempFile(object):
+    '''
+    ITempFile holding its buffer in memory.
+    '''
+    __slots__ = ('buffer', )
+
+    def __init__(self, buffer):
+        self.buffer = _bytes(buffer)
+
+    def getBuffer(self):
+        return self.buffer
+
+    def delete(self):
+        return
+
+
+class OfflineCallbacks(object):
+    '''
+    Implements the parts of IBurpExtenderCallbacks that don't need
+    Burp, over recorded traffic.
+
+    :param history: the proxy history, an iterable of
+        IHttpRequestResponse, :class:`~gds.burp.models.HttpRequest` or
+        :class:`~gds.burp.models.HttpRecord` objects. A sequence (such as
+        a :class:`~gds.burp.store.MessageStore`) is read each time the
+        history is asked for; an iterator is read into memory once.
+    :param site_map: the site map, by default the proxy history.
+    :param scope: URL prefixes in scope; by default everything is.
+    :param settings: initial extension settings.
+    '''
+    def __init__(self, history=(), site_map=None, scope=None,
+                 settings=None):
+        if iter(history) is history:
+            history = list(history)
+
+        self.history = history
+        self.site_map = list(site_map) if site_map is not None else None
+        self.scope = list(scope) if scope is not None else None
+        self.excluded = []
+        self.settings = dict(settings or {})
+        self.listeners = {}
+        self.issues = []
+        self.alerts = []
+
+    def __repr__(self):
+        return '<OfflineCallbacks at %#x>' % (id(self), )
+
+    (registerContextMenuFactory,
+     removeContextMenuFactory) = _registrar('context_menu')
+    (registerExtensionStateListener,
+     removeExtensionStateListener) = _registrar('extension_state')
+    registerHttpListener, removeHttpListener = _registrar('http')
+    registerMenuItem = _registrar('menu_item')[0]
+    (registerMessageEditorTabFactory,
+     removeMessageEditorTabFactory) = _registrar('message_editor_tab')
+    registerProxyListener, removeProxyListener = _registrar('proxy')
+    registerScannerCheck, removeScannerCheck = _registrar('scanner_check')
+    registerScannerListener, removeScannerListener = _registrar('scanner')
+
+    def replay(self, items=None, toolFlag=TOOL_PROXY):
+        '''
+        Feeds each of items (by default the proxy history) to the
+        registered HTTP listeners, first as a request, then as a response
+        if it has one, as Burp does for the tool in toolFlag. Listeners
+        get a mutable copy of each item.
+
+        The extension indexes replayed proxy responses as new history
+        items, as it would live; call ``burp.history.refresh()``
+        afterwards to bring its index back in line with the history.
+
+        :returns: the number of items replayed.
+        '''
+        count = 0
+
+        for item in self.history if items is None else items:
+            message = HttpRequestResponse.copy(item)
+
+            for listener in list(self.listeners.get('http', ())):
+                listener.processHttpMessage(toolFlag, True, message)
+
+            if message.getResponse() is not None:
+                for listener in list(self.listeners.get('http', ())):
+                    listener.processHttpMessage(toolFlag, False, message)
+
+            count += 1
+
+        return count
+
+    def unloadExtension(self):
+        for listener in list(self.listeners.get('extension_state', ())):
+            listener.extensionUnloaded()
+
+    def getProxyHistory(self):
+        return [_message(item) for item in self.history]
+
+    def getSiteMap(self, urlPrefix):
+        items = self.history if self.site_map is None else self.site_map
+        items = [_message(item) for item in items]
+        return [item for item in items
+                if not urlPrefix or _url(item).startswith(urlPrefix)]
+
+    def addToSiteMap(self, item):
+        if self.site_map is None:
+            self.site_map = list(self.history)
+        self.site_map.append(HttpRequestResponse.copy(item))
+
+    def saveBuffersToTempFiles(self, httpRequestResponse):
+        return HttpRequestResponse.copy(httpRequestResponse)
+
+    def saveToTempFile(self, buffer):
+        return _TempFile(buffer)
+
+    def getScanIssues(self, urlPrefix):
+        return [issue for issue in self.issues
+                if not urlPrefix or
+                issue.getUrl().toString().startswith(urlPrefix)]
+
+    def addScanIssue(self, issue):
+        self.issues.append(issue)
+
+        for listener in list(self.listeners.get('scanner', ())):
+            listener.newScanIssue(issue)
+
+    def isInScope(self, url):
+        url = url.toString()
+
+        if any(url.startswith(prefix) for prefix in self.excluded):
+            return False
+
+        return self.scope is None or \
+            any(url.startswith(prefix) for prefix in self.scope)
+
+    def includeInScope(self, url):
+        if self.scope is None:
+            self.scope = []
+        self.scope.append(url.toString())
+
+    def excludeFromScope(self, url):
+        self.excluded.append(url.toString())
+
+    def issueAlert(self, message):
+        log.info('Alert: %s', message)
+        self.alerts.append(message)
+
+    def getToolName(self, toolFlag):
+        return _TOOL_NAMES.get(toolFlag, '')
+
+    def getBurpVersion(self):
+        return ['Burp Suite', 'offline', '']
+
+    def getHelpers(self):
+        # messages are parsed in Jython
+        return None
+
+    def setExtensionName(self, name):
+        self.settings['extension_name'] = name
+
+    def loadExtensionSetting(self, name):
+        return self.settings.get(name)
+
+    def saveExtensionSetting(self, name, value):
+        if value is None:
+            self.settings.pop(name, None)
+        else:
+            self.settings[name] = value
+
+    def printOutput(self, output):
+        log.info(output)
+
+    def printError(self, error):
+        log.error(error)
+
+    def makeHttpService(self, host, port, protocol):
+        if isinstance(protocol, bool):
+            protocol = 'https' if protocol else 'http'
+        return HttpService(host=host, port=port, protocol=protocol)
+
+
+def headless(history=(), config=None, log_filename=None, **kwargs):
+    '''
+    Returns a :class:`BurpExtender` registered with
+    :class:`OfflineCallbacks` over history, with its listeners, menus and
+    components loaded from config (a burp.ini). The callbacks are
+    available as ``burp.cb``.
+
+    :param log_filename: file the extension logs to, by default none.
+    :param kwargs: passed on to :class:`OfflineCallbacks`.
+    '''
+    from burp_extender import BurpExtender
+
+    callbacks = OfflineCallbacks(history, **kwargs)
+
+    jython = {
+        settings.LOG_FILENAME[0]: log_filename or os.devnull,
+        }
+    if config is not None:
+        jython[settings.CONFIG_FILENAME[0]] = os.path.abspath(config)
+
+    stored = json.loads(callbacks.settings.get('settings') or '{}')
+    jython.update(stored)
+    callbacks.settings['settings'] = json.dumps(jython)
+
+    burp = BurpExtender()
+    burp.registerExtenderCallbacks(callbacks)
+    return burp
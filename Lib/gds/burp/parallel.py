@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+'''
+gds.burp.parallel
+~~~~~~~~~~~~~~~~~
+
+Ordered, parallel map and filter over large sequences (e.g. the proxy
+history) on a bounded :mod:`java.util.concurrent` thread pool. Jython has
+no global interpreter lock, so CPU-bound passes such as regular
+expression extraction scale with the number of cores.
+
+Items are handed to the pool in chunks, with at most a few chunks per
+worker in flight at any time, and results come back in the order of the
+items. Closing the iterator returned by :func:`imap` (e.g. breaking out
+of a loop over it) cancels any outstanding work.
+'''
+from collections import deque
+from itertools import islice, izip
+import sys
+
+from java.lang import Runtime, Thread
+from java.util.concurrent import Callable, Executors, ThreadFactory
+
+import logging
+
+
+__all__ = ['imap', 'pfilter', 'pmap', ]
+
+log = logging.getLogger(__name__)
+
+# number of items handed to a worker at a time
+CHUNK_SIZE = 64
+
+# chunks queued per worker, bounding the results held in memory
+QUEUED_CHUNKS = 4
+
+
+class _Chunk(Callable):
+    def __init__(self, func, items):
+        self.func = func
+        self.items = items
+
+    def call(self):
+        # exceptions are handed back to the consuming thread, rather than
+        # wrapped in an ExecutionException
+        try:
+            return True, [self.func(item) for item in self.items]
+        except Exception:
+            return False, sys.exc_info()
+
+
+class _DaemonThreadFactory(ThreadFactory):
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+
+    def newThread(self, runnable):
+        self.count += 1
+        thread = Thread(runnable, '%s-%d' % (self.name, self.count))
+        thread.setDaemon(True)
+        return thread
+
+
+def cpu_count():
+    return Runtime.getRuntime().availableProcessors()
+
+
+def imap(func, items, workers=None, chunksize=CHUNK_SIZE, progress=None):
+    '''
+    Lazily yields ``func(item)`` for each of items, in order, computing
+    them on a pool of `workers` threads.
+
+    :param func: function to call with each item. It must be safe to
+        call from several threads at once.
+    :param items: an iterable of items; it is only consumed as fast as
+        the pool works through it.
+    :param workers: number of threads, defaulting to the number of
+        available processors.
+    :param chunksize: number of items handed to a thread at a time.
+    :param progress: optional callable, called with the number of items
+        done and the total number of items (or None, if items has no
+        length) after each chunk.
+    '''
+    workers = workers or cpu_count()
+
+    try:
+        total = len(items)
+    except TypeError:
+        total = None
+
+    items = iter(items)
+    pool = Executors.newFixedThreadPool(
+        workers, _DaemonThreadFactory('jython-parallel'))
+    pending = deque()
+    done = 0
+
+    def submit():
+        chunk = list(islice(items, chunksize))
+        if chunk:
+            pending.append((len(chunk), pool.submit(_Chunk(func, chunk))))
+        return bool(chunk)
+
+    try:
+        for _ in xrange(workers * QUEUED_CHUNKS):
+            if not submit():
+                break
+
+        while pending:
+            count, future = pending.popleft()
+            ok, results = future.get()
+
+            if not ok:
+                raise results[0], results[1], results[2]
+
+            # keep the pool busy while the results are consumed
+            submit()
+
+            done += count
+            if progress is not None:
+                progress(done, total)
+
+            for result in results:
+                yield result
+    finally:
+        # also reached when the consumer stops early
+        pool.shutdownNow()
+
+        if pending:
+            log.debug('Cancelled %d pending chunks after %d items',
+                      len(pending), done)
+
+
+def pmap(func, items, workers=None, first=None, chunksize=CHUNK_SIZE,
+         progress=None):
+    '''
+    Returns the list of ``func(item)`` for each of items, in order. See
+    :func:`imap`.
+
+    :param first: if given, stop after this many results.
+    '''
+    results = imap(func, items, workers, chunksize, progress)
+
+    try:
+        return list(islice(results, first))
+    finally:
+        results.close()
+
+
+def pfilter(func, items, workers=None, first=None, chunksize=CHUNK_SIZE,
+            progress=None):
+    '''
+    Returns the list of items for which ``func(item)`` is true, in order.
+    See :func:`imap`.
+
+    :param first: if given, stop after this many matching items.
+    '''
+    if not hasattr(items, '__len__'):
+        items = list(items)
+
+    matches = []
+    results = imap(func, items, workers, chunksize, progress)
+
+    try:
+        for item, result in izip(items, results):
+            if result:
+                matches.append(item)
+                if first is not None and len(matches) >= first:
+                    break
+    finally:
+        results.close()
+
+    return matches
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+'''
+gds.burp.parsers
+~~~~~~~~~~~~~~~~
+
+Body parsers used by :attr:`HttpRequest.parameters
+<gds.burp.models.HttpRequest.parameters>`.
+'''
+from cStringIO import StringIO
+from cgi import parse_header, parse_qs
+from xml.etree.cElementTree import iterparse
+
+from .structures import ByteView, CaseInsensitiveDict
+
+import json
+
+
+__all__ = ['BODY_PARSERS', 'MultipartForm', 'MultipartPart', 'body_parser',
+           'get_body_parser', 'iter_gwt_rpc', 'iter_multipart', ]
+
+CRLF = '\r\n'
+
+# Body parsers, keyed by content type. Besides exact content types, keys
+# may be of the form "major/*" or "major/*+suffix" (e.g. "application/*+xml").
+BODY_PARSERS = {}
+
+# File parts at least this many bytes long are written to a Burp temp
+# file (when a spill function is given) rather than kept in memory.
+MULTIPART_SPILL_SIZE = 1024 * 1024
+
+
+class MultipartPart(object):
+    '''
+    A single part of a multipart/form-data body.
+
+    Small parts are views over the original message: their value is only
+    sliced out when asked for. Large file parts may have been spilled to
+    a Burp temp file, in which case no reference to the message is kept.
+    A spilled part is copied straight from a
+    :class:`~gds.burp.structures.ByteView` message into the temp file,
+    without becoming a Python string first.
+    '''
+    __slots__ = ('headers', 'name', 'filename', 'type', 'size',
+                 '_message', '_start', '_tempfile', )
+
+    def __init__(self, headers, message, start, end):
+        self.headers = headers
+        self.size = end - start
+
+        disposition, params = parse_header(
+            headers.get('content-disposition', ''))
+
+        self.name = params.get('name')
+        self.filename = params.get('filename')
+        self.type = headers.get('content-type', 'text/plain')
+
+        self._message = message
+        self._start = start
+        self._tempfile = None
+
+    def __repr__(self):
+        return '<MultipartPart [%s, %d bytes]>' % (self.name, self.size, )
+
+    def spill(self, saveToTempFile):
+        '''
+        Moves the contents of this part into a temp file created by
+        `saveToTempFile`, i.e. :meth:`BurpExtender.saveToTempFile`.
+        '''
+        if self._tempfile is None:
+            start, end = self._start, self._start + self.size
+
+            if isinstance(self._message, ByteView):
+                data = self._message.tobytes(start, end)
+            else:
+                data = self._message[start:end]
+
+            self._tempfile = saveToTempFile(data)
+            self._message = None
+
+        return self._tempfile
+
+    @property
+    def spilled(self):
+        return self._tempfile is not None
+
+    @property
+    def value(self):
+        if self._tempfile is not None:
+            return self._tempfile.getBuffer().tostring()
+
+        return self._message[self._start:self._start + self.size]
+
+    @property
+    def file(self):
+        return StringIO(self.value)
+
+
+def _parse_part_headers(block):
+    headers = CaseInsensitiveDict()
+
+    for line in block.split(CRLF):
+        name, sep, value = line.partition(':')
+        if sep:
+            headers.add(name.strip(), value.strip())
+
+    return headers
+
+
+def iter_multipart(message, boundary, start=0, end=None, spill=None):
+    '''
+    Lazily yields a :class:`MultipartPart` for each part of the multipart
+    body found in message between start and end. Nothing is copied out of
+    message, except the part headers.
+
+    :param message: the raw message (or body) to scan, a ``str`` or a
+        :class:`~gds.burp.structures.ByteView`.
+    :param boundary: the boundary parameter of the Content-Type header.
+    :param spill: optional callable used to save file parts of at least
+        :data:`MULTIPART_SPILL_SIZE` bytes to a temp file.
+    '''
+    if end is None:
+        end = len(message)
+
+    delimiter = '--' + boundary
+    pos = message.find(delimiter, start, end)
+
+    if pos == -1:
+        return
+
+    pos += len(delimiter)
+
+    # every following delimiter starts on a new line
+    delimiter = CRLF + delimiter
+
+    while pos < end:
+        # the closing delimiter is followed by two dashes
+        if message.startswith('--', pos):
+            return
+
+        hdr_end = message.find(CRLF + CRLF, pos, end)
+        if hdr_end == -1:
+            return
+
+        headers = _parse_part_headers(message[pos:hdr_end].lstrip())
+
+        data_start = hdr_end + 4
+        data_end = message.find(delimiter, data_start, end)
+        if data_end == -1:
+            data_end = end
+
+        part = MultipartPart(headers, message, data_start, data_end)
+
+        if spill is not None and part.filename is not None and \
+            part.size >= MULTIPART_SPILL_SIZE:
+            part.spill(spill)
+
+        yield part
+
+        pos = data_end + len(delimiter)
+
+
+class MultipartForm(object):
+    '''
+    Lazy container of the parts of a multipart/form-data body. Parts are
+    only parsed as far as needed to answer each lookup, e.g. looking up
+    the first field never scans past it.
+
+    Lookups mimic :class:`cgi.FieldStorage`: indexing by name returns a
+    :class:`MultipartPart`, or a list of parts if the name was repeated.
+    '''
+    def __init__(self, message, boundary, start=0, end=None, spill=None):
+        self._parts = []
+        self._iter = iter_multipart(message, boundary, start, end, spill)
+
+    def __repr__(self):
+        return '<MultipartForm %r>' % (self.keys(), )
+
+    def __iter__(self):
+        for part in self._parts:
+            yield part
+
+        for part in self._consume():
+            yield part
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __contains__(self, name):
+        for part in self:
+            if part.name == name:
+                return True
+        return False
+
+    def __getitem__(self, name):
+        parts = self.getlist(name)
+        if not parts:
+            raise KeyError(name)
+        return parts[0] if len(parts) == 1 else parts
+
+    def _consume(self):
+        if self._iter is None:
+            return
+
+        for part in self._iter:
+            self._parts.append(part)
+            yield part
+
+        self._iter = None
+
+    def keys(self):
+        keys = []
+        for part in self:
+            if part.name not in keys:
+                keys.append(part.name)
+        return keys
+
+    def getlist(self, name):
+        return [part for part in self if part.name == name]
+
+    def getfirst(self, name, default=None):
+        for part in self:
+            if part.name == name:
+                return part.value
+        return default
+
+    def getvalue(self, name, default=None):
+        parts = self.getlist(name)
+        if not parts:
+            return default
+        if len(parts) == 1:
+            return parts[0].value
+        return [part.value for part in parts]
+
+
+def body_parser(*content_types):
+    '''
+    Decorator registering a function as the body parser for each of
+    content_types. The function is called with the
+    :class:`HttpRequest <HttpRequest>` and the Content-Type parameters
+    (e.g. boundary, charset) and returns the parsed body. It may raise
+    ValueError or TypeError if the body cannot be parsed, in which case
+    the request has no "body" parameters.
+
+    .. code-block:: python
+        @body_parser('application/x-protobuf')
+        def parse_protobuf(request, params):
+            return MyMessage.FromString(request.body)
+    '''
+    def register(func):
+        for content_type in content_types:
+            BODY_PARSERS[content_type.lower()] = func
+        return func
+    return register
+
+
+def get_body_parser(content_type):
+    '''
+    Returns the body parser registered for content_type (without any
+    parameters), falling back to "major/*+suffix" and "major/*"
+    registrations, or None.
+    '''
+    content_type = content_type.lower()
+    parser = BODY_PARSERS.get(content_type)
+
+    if parser is None:
+        major, _, minor = content_type.partition('/')
+        _, plus, suffix = minor.rpartition('+')
+
+        if plus:
+            parser = BODY_PARSERS.get('%s/*+%s' % (major, suffix))
+
+        if parser is None:
+            parser = BODY_PARSERS.get(major + '/*')
+
+    return parser
+
+
+@body_parser('application/x-www-form-urlencoded')
+def parse_urlencoded(request, params):
+    return parse_qs(request.body or '', keep_blank_values=True)
+
+
+@body_parser('multipart/*')
+def parse_multipart(request, params):
+    index = request._index
+    boundary = params.get('boundary', '')
+    spill = request._burp.saveToTempFile if request._burp else None
+
+    if index is None:
+        return MultipartForm('', boundary, spill=spill)
+
+    # scan the raw request in place rather than copying the body; large
+    # requests are Java byte[] or mapped messages, searched a window at
+    # a time
+    message = index.message
+    if not isinstance(message, str):
+        message = ByteView(message)
+
+    return MultipartForm(message, boundary, start=index.body_offset,
+                         spill=spill)
+
+
+@body_parser('application/json', 'text/json', 'application/*+json')
+def parse_json(request, params):
+    return json.loads(request.body)
+
+
+@body_parser('application/xml', 'text/xml', 'application/*+xml')
+def parse_xml(request, params):
+    '''
+    Parses an XML body into a dictionary mapping each element path (and
+    attribute, as "path/@name") to the list of its text values, similar
+    to :func:`~urlparse.parse_qs`. Elements are dropped from their parent
+    as soon as they have been read, so the document tree is never built
+    in full.
+    '''
+    parameters = {}
+    path = []
+    elements = []
+
+    try:
+        for event, elem in iterparse(StringIO(request.body or ''),
+                                     events=('start', 'end')):
+            if event == 'start':
+                path.append(elem.tag)
+                elements.append(elem)
+                prefix = '/' + '/'.join(path)
+
+                for name, value in elem.attrib.iteritems():
+                    parameters.setdefault('%s/@%s' % (prefix, name),
+                                          []).append(value)
+            else:
+                text = (elem.text or '').strip()
+                if text:
+                    parameters.setdefault('/' + '/'.join(path),
+                                          []).append(text)
+
+                path.pop()
+                elements.pop()
+
+                # every child read so far has ended, this one included
+                if elements:
+                    del elements[-1][:]
+    except SyntaxError:
+        # ParseError subclasses SyntaxError; keep what was parsed so far
+        pass
+
+    return parameters
+
+
+def iter_gwt_rpc(body):
+    '''
+    Lazily yields the "|"-delimited tokens of a GWT-RPC request body.
+    '''
+    pos = 0
+    end = len(body)
+
+    while pos < end:
+        idx = body.find('|', pos)
+        if idx == -1:
+            idx = end
+        yield body[pos:idx]
+        pos = idx + 1
+
+
+@body_parser('text/x-gwt-rpc')
+def parse_gwt_rpc(request, params):
+    '''
+    Parses a GWT-RPC request body (protocol versions 5 to 7) into a
+    dictionary with the protocol version and flags, the string table,
+    the service and method being called, and the remaining payload
+    tokens. String references in the payload are left as they are.
+    '''
+    tokens = iter_gwt_rpc(request.body or '')
+
+    try:
+        version = int(tokens.next())
+        flags = int(tokens.next())
+        strings = [tokens.next() for _ in xrange(int(tokens.next()))]
+        payload = list(tokens)
+    except (StopIteration, ValueError):
+        return
+
+    def lookup(i):
+        try:
+            return strings[int(payload[i]) - 1]
+        except (IndexError, ValueError):
+            return
+
+    return {
+        'version': version,
+        'flags': flags,
+        'strings': strings,
+        'module': lookup(0),
+        'strong_name': lookup(1),
+        'service': lookup(2),
+        'method': lookup(3),
+        'payload': payload,
+        }
@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+'''
+gds.burp.query
+~~~~~~~~~~~~~~
+
+A small query language over request/response pairs::
+
+    >>> Burp.query('host=*.corp status>=500 resp.header:content-type~json '
+    ...            'body~"token"')
+
+A query is a list of whitespace-separated terms, all of which must match.
+Each term is a field, an operator and a value (quoted if it contains
+spaces):
+
+==================  =====================================================
+Field               Value
+==================  =====================================================
+host, port,         the HTTP service
+protocol
+method, path, url   the request line
+size, resp.size     the length of the request or response, in bytes
+body.size,          the length of the request or response body, in
+resp.body.size      bytes
+status              the response status code
+mime                the media type of the response Content-Type
+header:<name>       a request header
+resp.header:<name>  a response header
+body, resp.body     the request or response body
+==================  =====================================================
+
+Operators are ``=`` and ``!=`` (with ``*`` and ``?`` wildcards), ``~`` and
+``!~`` (regular expression search) and, for numeric fields, ``<``, ``<=``,
+``>`` and ``>=``. Host, protocol, method and mime comparisons ignore case.
+
+Terms are evaluated cheapest first: the service, then the start lines,
+then headers, and bodies last, so most items are rejected before any
+message is converted or parsed. When querying the proxy history, exact
+matches on indexed fields are answered by the
+:class:`~gds.burp.index.HistoryIndex` instead.
+'''
+from fnmatch import fnmatchcase
+import operator
+import re
+
+from .index import _head, _matcher
+from .models import CRLF, _build_url, _parse_start_line, _tostring
+
+
+__all__ = ['Query', 'QuerySyntaxError', ]
+
+_TOKEN = re.compile(r'''(?:[^\s"']|"[^"]*"|'[^']*')+''')
+_QUOTED = re.compile(r'"([^"]*)"|\'([^\']*)\'')
+_TERM = re.compile(r'^([a-z.]+(?::[^!<>=~]+)?)(!=|!~|<=|>=|=|~|<|>)(.*)$',
+                   re.DOTALL | re.IGNORECASE)
+
+_COMPARE = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    }
+
+# cost of evaluating a field, cheapest first
+SERVICE, START_LINE, RESPONSE_LINE, HEADERS, BODY, RESPONSE_BODY = range(6)
+
+
+class QuerySyntaxError(ValueError):
+    '''Raised when a query cannot be parsed.'''
+
+
+def _split(query):
+    '''
+    Splits query into terms on whitespace outside of quotes, removing
+    the quotes. Unlike :func:`shlex.split`, backslashes are kept as they
+    are, for regular expressions.
+    '''
+    terms = []
+    pos = 0
+
+    for match in _TOKEN.finditer(query):
+        if query[pos:match.start()].strip():
+            break
+        terms.append(_QUOTED.sub(lambda m: m.group(1) if m.group(1)
+                                 is not None else m.group(2), match.group()))
+        pos = match.end()
+
+    if query[pos:].strip():
+        raise QuerySyntaxError('Unbalanced quotes in %r' % (query, ))
+
+    return terms
+
+
+class _Message(object):
+    '''
+    Lazily read view of a single request or response. The head of the
+    message is only converted when a start line or header is needed, and
+    the whole message only when its body is.
+    '''
+    __slots__ = ('message', '_head', )
+
+    def __init__(self, message):
+        self.message = message
+        self._head = None
+
+    @property
+    def head(self):
+        if self._head is None:
+            self._head = _head(self.message, CRLF + CRLF)
+        return self._head
+
+    @property
+    def start_line(self):
+        return _parse_start_line(self.head.partition(CRLF)[0])
+
+    def header(self, pattern):
+        # headers are searched for in the head of the message rather than
+        # parsed, as a query rarely looks at more than one or two
+        values = pattern.findall(self.head)
+        if values:
+            return ', '.join(value.strip() for value in values)
+
+    @property
+    def body_size(self):
+        # from the length of the head, without converting the body
+        return max(len(self.message) - len(self.head) - 4, 0)
+
+    @property
+    def body(self):
+        message = _tostring(self.message)
+        idx = message.find(CRLF + CRLF)
+        return message[idx + 4:] if idx != -1 else ''
+
+
+class _Context(object):
+    __slots__ = ('item', '_request', '_response', )
+
+    def __init__(self, item):
+        self.item = item
+        self._request = self._response = None
+
+    @property
+    def request(self):
+        if self._request is None:
+            self._request = _Message(self.item.getRequest())
+        return self._request
+
+    @property
+    def response(self):
+        if self._response is None:
+            response = self.item.getResponse()
+            if response is None:
+                return
+            self._response = _Message(response)
+        return self._response
+
+
+def _response_field(func):
+    def get(context):
+        if context.response is not None:
+            return func(context.response)
+    return get
+
+
+def _url(context):
+    item = context.item
+    return _build_url(item.getProtocol(), item.getHost(), item.getPort(),
+                      context.request.start_line[1])
+
+
+def _path(context):
+    uri = context.request.start_line[1]
+    if uri.startswith(('http://', 'https://')):
+        uri = uri.partition('://')[2]
+        uri = uri[uri.find('/'):] if '/' in uri else '/'
+    return uri.partition('?')[0].partition('#')[0]
+
+
+def _header_pattern(name):
+    return re.compile(r'^%s:[ \t]*(.*?)\r?$' % (re.escape(name.strip()), ),
+                      re.IGNORECASE | re.MULTILINE)
+
+
+_CONTENT_TYPE = _header_pattern('content-type')
+
+
+def _mime(context):
+    if context.response is not None:
+        return (context.response.header(_CONTENT_TYPE) or '') \
+            .partition(';')[0].strip() or None
+
+
+# field -> (cost, getter, numeric, ignore case)
+FIELDS = {
+    'host': (SERVICE, lambda c: c.item.getHost(), False, True),
+    'port': (SERVICE, lambda c: c.item.getPort(), True, False),
+    'protocol': (SERVICE, lambda c: c.item.getProtocol(), False, True),
+    'size': (SERVICE, lambda c: len(c.request.message), True, False),
+    'resp.size': (SERVICE, _response_field(lambda m: len(m.message)),
+                  True, False),
+    'method': (START_LINE, lambda c: c.request.start_line[0], False, True),
+    'path': (START_LINE, _path, False, False),
+    'url': (START_LINE, _url, False, False),
+    'status': (RESPONSE_LINE, _response_field(lambda m: m.start_line[1]),
+               True, False),
+    'mime': (HEADERS, _mime, False, True),
+    'body.size': (HEADERS, lambda c: c.request.body_size, True, False),
+    'resp.body.size': (HEADERS, _response_field(lambda m: m.body_size),
+                       True, False),
+    'body': (BODY, lambda c: c.request.body, False, False),
+    'resp.body': (RESPONSE_BODY, _response_field(lambda m: m.body),
+                  False, False),
+    }
+
+# fields answered by the history index, and the index key for each
+INDEXED = {
+    'host': 'host',
+    'method': 'method',
+    'path': 'path',
+    'status': 'status_code',
+    'mime': 'mime_type',
+    }
+
+
+def _header_field(name, response):
+    pattern = _header_pattern(name)
+
+    if response:
+        return (HEADERS, _response_field(lambda m: m.header(pattern)),
+                False, False)
+
+    return HEADERS, lambda c: c.request.header(pattern), False, False
+
+
+class Predicate(object):
+    '''
+    A single compiled query term.
+    '''
+    __slots__ = ('field', 'op', 'value', 'cost', '_get', '_test', )
+
+    def __init__(self, field, op, value):
+        self.field = field
+        self.op = op
+        self.value = value
+
+        name, _, header = field.partition(':')
+
+        if header and name in ('header', 'req.header', 'resp.header'):
+            spec = _header_field(header, name == 'resp.header')
+        elif field in FIELDS:
+            spec = FIELDS[field]
+        else:
+            raise QuerySyntaxError('Unknown field: %r' % (field, ))
+
+        self.cost, self._get, numeric, ignorecase = spec
+        self._test = self._compile(op, value, numeric, ignorecase)
+
+    def __repr__(self):
+        return '<Predicate %s%s%r>' % (self.field, self.op, self.value, )
+
+    def _compile(self, op, value, numeric, ignorecase):
+        negate = op.startswith('!')
+        op = op.lstrip('!')
+
+        if op in _COMPARE or (numeric and op == '='):
+            if not numeric:
+                raise QuerySyntaxError('%s is not numeric' % (self.field, ))
+            try:
+                number = int(value)
+            except ValueError:
+                raise QuerySyntaxError('%s%s%r: expected a number' % (
+                                       self.field, self.op, value, ))
+
+            compare = _COMPARE.get(op, operator.eq)
+            test = lambda actual: compare(actual, number)
+
+        elif op == '=':
+            if ignorecase:
+                value = value.lower()
+
+            if '*' in value or '?' in value:
+                test = lambda actual: fnmatchcase(actual, value)
+            else:
+                test = lambda actual: actual == value
+
+            if ignorecase:
+                test = (lambda test: lambda actual: test(actual.lower()))(test)
+
+        else:
+            try:
+                if ignorecase:
+                    test = re.compile(value, re.IGNORECASE).search
+                else:
+                    test = _matcher(value)
+            except re.error, e:
+                raise QuerySyntaxError('%s%s%r: %s' % (
+                                       self.field, self.op, value, e, ))
+
+        if negate:
+            return lambda actual: actual is None or not test(actual)
+
+        return lambda actual: actual is not None and bool(test(actual))
+
+    def __call__(self, context):
+        try:
+            actual = self._get(context)
+        except ValueError:
+            # malformed start line
+            actual = None
+
+        return self._test(actual)
+
+
+class Query(object):
+    '''
+    A compiled query. Terms are ordered by the cost of evaluating them,
+    so that :meth:`match` stops at the cheapest failing term.
+
+    .. code-block:: python
+        query = Query('method=POST resp.body~"error"')
+        for item in query.filter(Burp._check_and_callback(
+                Burp.getProxyHistory)):
+            ...
+    '''
+    def __init__(self, query):
+        self.query = query
+
+        predicates = []
+        for term in _split(query):
+            match = _TERM.match(term)
+            if match is None:
+                raise QuerySyntaxError('Invalid term: %r' % (term, ))
+
+            field, op, value = match.groups()
+            predicates.append(Predicate(field.lower(), op, value))
+
+        # stable, so terms of the same cost keep their order
+        self.predicates = sorted(predicates, key=lambda p: p.cost)
+
+    def __repr__(self):
+        return '<Query %r>' % (self.query, )
+
+    def match(self, item):
+        '''
+        Returns True if the IHttpRequestResponse item matches every term.
+        '''
+        return _matches(self.predicates, item)
+
+    def filter(self, items):
+        '''
+        Lazily yields the IHttpRequestResponse items matching the query.
+        '''
+        return _filter(self.predicates, items)
+
+    def pushdown(self):
+        '''
+        Splits the query into :meth:`HistoryIndex.search
+        <gds.burp.index.HistoryIndex.search>` arguments and the remaining
+        predicates. ``url`` terms are never pushed down, as the index
+        matches patterns against Burp's URLs, which keep default ports.
+
+        :returns: a ``(criteria, predicates)`` tuple.
+        '''
+        criteria = {}
+        predicates = []
+
+        for predicate in self.predicates:
+            field, op, value = predicate.field, predicate.op, predicate.value
+            key = INDEXED.get(field)
+
+            if key is not None and key not in criteria and op == '=' and \
+                '*' not in value and '?' not in value:
+                if key == 'status_code':
+                    value = int(value)
+                criteria[key] = value
+
+            else:
+                predicates.append(predicate)
+
+        return criteria, predicates
+
+    def search(self, index):
+        '''
+        Lazily yields the items in :class:`~gds.burp.index.HistoryIndex`
+        index matching the query, using the index for whatever it can
+        answer.
+        '''
+        criteria, predicates = self.pushdown()
+        return _filter(predicates, index.search(**criteria))
+
+
+def _matches(predicates, item):
+    context = _Context(item)
+
+    for predicate in predicates:
+        if not predicate(context):
+            return False
+
+    return True
+
+
+def _filter(predicates, items):
+    for item in items:
+        if _matches(predicates, item):
+            yield item
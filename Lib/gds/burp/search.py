@@ -0,0 +1,619 @@
+# -*- coding: utf-8 -*-
+'''
+gds.burp.search
+~~~~~~~~~~~~~~~
+
+Persistent full-text index over request and response bodies.
+
+Messages are stored in a snapshot file (see :mod:`gds.burp.snapshot`),
+and their bodies are tokenized into an inverted index of positional
+postings, kept in immutable segment files on disk. New postings are
+buffered in memory and written out as a new segment every
+`flush_size` messages. Segments are tiered by size, and the most recent
+ones are merged once :data:`MERGE_SEGMENTS` of them are in the same
+tier, so each message is rewritten once per tier rather than on every
+merge.
+
+To index proxy traffic as it comes in, enable the
+:class:`FullTextIndexer` component in burp.ini::
+
+    [handlers]
+    proxy.response = FullTextIndexer
+
+    [search]
+    directory = search
+
+and search it from the console::
+
+    >>> for request in Burp.search('"api_key" token*'):
+    ...     print request.url.geturl()
+
+A query is a list of terms, all of which must be found in a message:
+words, ``"quoted phrases"`` and ``prefix*`` terms. Matching ignores
+case; words are runs of letters, digits and underscores.
+'''
+from array import array
+from bisect import bisect_left
+from Queue import Empty, Queue
+from threading import RLock, Thread
+import cPickle
+import glob
+import os
+import re
+import struct
+
+from .api import IProxyResponseHandler
+from .config import IntOption, PathOption
+from .core import Component, implements
+from .snapshot import _HEADER, _I, _read_header, decode, encode
+
+import logging
+
+
+__all__ = ['FullTextIndex', 'FullTextIndexer', 'tokenize', ]
+
+log = logging.getLogger(__name__)
+
+# buffered messages written out as a new segment at a time
+FLUSH_SIZE = 1000
+
+# segments of the same tier merged into one once there are this many;
+# a merged segment moves up a tier
+MERGE_SEGMENTS = 8
+
+# only the start of larger bodies is indexed
+MAX_TEXT_SIZE = 1024 * 1024
+
+# longer tokens (e.g. base64 blobs) are not indexed
+MAX_TOKEN_LENGTH = 64
+
+# response bodies of these content types are not indexed
+BINARY_TYPES = ('image/', 'audio/', 'video/', 'font/',
+                'application/octet-stream', 'application/pdf',
+                'application/zip', 'application/x-shockwave-flash', )
+
+_TOKEN = re.compile(r'\w+')
+_QUERY = re.compile(r'"([^"]*)"|(\S+)')
+_OFFSET = struct.Struct('>Q')
+
+
+def tokenize(text):
+    '''
+    Yields a ``(position, token)`` tuple for each lower-cased word in
+    text.
+    '''
+    for position, match in enumerate(_TOKEN.finditer(text)):
+        token = match.group()
+        if len(token) <= MAX_TOKEN_LENGTH:
+            yield position, token.lower()
+
+
+def _decode(data):
+    '''
+    Yields a ``(doc, positions)`` tuple for each document in postings
+    encoded as ``doc, count, position...`` integers.
+    '''
+    postings = array('i')
+    postings.fromstring(data)
+
+    i = 0
+    end = len(postings)
+    while i < end:
+        count = postings[i + 1]
+        yield postings[i], postings[i + 2:i + 2 + count]
+        i += 2 + count
+
+
+class _Segment(object):
+    '''
+    An immutable segment of the index, made of a sorted term dictionary
+    (loaded into memory) and a postings file (read on demand).
+    '''
+    def __init__(self, path):
+        self.path = path
+
+        with open(path + '.terms', 'rb') as fp:
+            self.first, self.last, self.terms, self.offsets, \
+                self.lengths = cPickle.load(fp)
+
+        self._fp = open(path + '.post', 'rb')
+        self._lock = RLock()
+
+    def __repr__(self):
+        return '<Segment %s [%d-%d]>' % (os.path.basename(self.path),
+                                         self.first, self.last, )
+
+    @staticmethod
+    def write(path, first, last, postings):
+        '''
+        Writes a segment for docs first to last from postings, an iterable
+        of ``(term, data)`` tuples in term order.
+        '''
+        terms, offsets, lengths = [], [], []
+        offset = 0
+
+        with open(path + '.post.tmp', 'wb') as fp:
+            for term, data in postings:
+                terms.append(term)
+                offsets.append(offset)
+                lengths.append(len(data))
+                fp.write(data)
+                offset += len(data)
+
+        with open(path + '.terms.tmp', 'wb') as fp:
+            cPickle.dump((first, last, terms, offsets, lengths), fp,
+                         cPickle.HIGHEST_PROTOCOL)
+
+        # the term dictionary is renamed last, as it marks the segment
+        # as complete
+        os.rename(path + '.post.tmp', path + '.post')
+        os.rename(path + '.terms.tmp', path + '.terms')
+
+    def postings(self, term):
+        i = bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return self._read(i)
+
+    def prefixed(self, prefix):
+        i = bisect_left(self.terms, prefix)
+        while i < len(self.terms) and self.terms[i].startswith(prefix):
+            yield self.terms[i]
+            i += 1
+
+    def _read(self, i):
+        with self._lock:
+            self._fp.seek(self.offsets[i])
+            return self._fp.read(self.lengths[i])
+
+    def close(self):
+        self._fp.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.path + '.terms')
+        os.remove(self.path + '.post')
+
+
+class FullTextIndex(object):
+    '''
+    On-disk full-text index of the bodies of request/response pairs,
+    which also stores the pairs themselves, so results can be loaded
+    after a restart without Burp's history.
+
+    :param directory: directory holding the index, created if needed.
+    :param flush_size: number of messages buffered in memory before
+        their postings are written out as a new segment.
+    '''
+    def __init__(self, directory, flush_size=FLUSH_SIZE):
+        self.directory = directory
+        self.flush_size = flush_size
+        self._lock = RLock()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._open_docs()
+        self._load_segments()
+
+        self._buffer = {}
+        self._buffered = 0
+
+        # reindex messages that were stored, but whose postings were
+        # never written out
+        indexed = max([segment.last + 1 for segment in self._segments]
+                      or [0])
+
+        for doc in xrange(indexed, len(self._offsets)):
+            self._index(doc, self._record(doc))
+
+        if self._buffered:
+            log.info('Reindexed %d messages in %s', self._buffered,
+                     directory)
+
+    def __repr__(self):
+        return '<FullTextIndex %s [%d messages, %d segments]>' % (
+            self.directory, len(self), len(self._segments), )
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _open_docs(self):
+        docs = self._path('docs.snap')
+        offsets = self._path('docs.off')
+
+        if os.path.exists(docs):
+            with open(docs, 'rb') as fp:
+                _read_header(fp)
+
+            size = os.path.getsize(docs)
+
+            with open(offsets, 'rb') as fp:
+                data = fp.read()
+
+            count = len(data) // _OFFSET.size
+            self._offsets = list(struct.unpack(
+                '>%dQ' % (count, ), data[:count * _OFFSET.size]))
+
+            # drop offsets of records that never made it to disk
+            while self._offsets and self._offsets[-1] >= size:
+                self._offsets.pop()
+
+            if len(data) != len(self._offsets) * _OFFSET.size:
+                with open(offsets, 'r+b') as fp:
+                    fp.truncate(len(self._offsets) * _OFFSET.size)
+        else:
+            with open(docs, 'wb') as fp:
+                fp.write(_HEADER)
+            open(offsets, 'wb').close()
+
+            size = len(_HEADER)
+            self._offsets = []
+
+        self._size = size
+        self._docs = open(docs, 'ab')
+        self._offsets_fp = open(offsets, 'ab')
+        self._reader = open(docs, 'rb')
+
+    def _load_segments(self):
+        segments = [_Segment(path[:-len('.terms')]) for path in
+                    sorted(glob.glob(self._path('seg-*.terms')))]
+
+        # segments left behind by an interrupted merge are covered by
+        # the merged segment
+        self._segments = []
+        for segment in segments:
+            if any(other is not segment and other.first <= segment.first
+                   and segment.last <= other.last for other in segments):
+                segment.remove()
+            else:
+                self._segments.append(segment)
+
+    def _record(self, doc):
+        with self._lock:
+            self._docs.flush()
+            self._reader.seek(self._offsets[doc])
+            length, = _I.unpack(self._reader.read(_I.size))
+            return self._reader.read(length)
+
+    def _texts(self, record):
+        item = decode(record, compact=True)
+
+        body = item.body
+        if body:
+            yield body[:MAX_TEXT_SIZE]
+
+        body = item.response_body
+        if body:
+            content_type = (item.response_headers.get('content-type') or
+                            '').lower()
+            if not content_type.startswith(BINARY_TYPES):
+                yield body[:MAX_TEXT_SIZE]
+
+    def _index(self, doc, record):
+        positions = {}
+        offset = 0
+
+        for text in self._texts(record):
+            position = -1
+            for position, token in tokenize(text):
+                positions.setdefault(token, []).append(offset + position)
+
+            # leave a gap, so phrases don't span the request and response
+            offset += position + 2
+
+        for token, token_positions in positions.iteritems():
+            postings = self._buffer.get(token)
+            if postings is None:
+                postings = self._buffer[token] = array('i')
+
+            postings.append(doc)
+            postings.append(len(token_positions))
+            postings.extend(token_positions)
+
+        self._buffered += 1
+
+    def add(self, item):
+        '''
+        Stores and indexes a request/response pair: an
+        :class:`~gds.burp.models.HttpRequest`,
+        :class:`~gds.burp.models.HttpRecord`, IHttpRequestResponse, or a
+        record already encoded by :func:`gds.burp.snapshot.encode`.
+
+        :returns: the id of the message in the index.
+        '''
+        record = item if isinstance(item, str) else encode(item)
+
+        with self._lock:
+            doc = len(self._offsets)
+
+            self._docs.write(_I.pack(len(record)))
+            self._docs.write(record)
+            self._offsets_fp.write(_OFFSET.pack(self._size))
+            self._offsets.append(self._size)
+            self._size += _I.size + len(record)
+
+            self._index(doc, record)
+
+            if self._buffered >= self.flush_size:
+                self.flush()
+
+        return doc
+
+    def flush(self):
+        '''
+        Writes buffered messages and postings to disk.
+        '''
+        with self._lock:
+            self._docs.flush()
+            self._offsets_fp.flush()
+
+            if not self._buffered:
+                return
+
+            first = len(self._offsets) - self._buffered
+            path = self._path('seg-%08d' % (self._next_segment(), ))
+
+            _Segment.write(path, first, len(self._offsets) - 1,
+                           ((term, self._buffer[term].tostring())
+                            for term in sorted(self._buffer)))
+
+            self._segments.append(_Segment(path))
+            self._buffer = {}
+            self._buffered = 0
+
+            self.merge()
+
+    def _next_segment(self):
+        if not self._segments:
+            return 1
+        return int(os.path.basename(self._segments[-1].path)[4:]) + 1
+
+    def _tier(self, segment):
+        # segments of up to flush_size messages are tier 0, and each
+        # tier above holds MERGE_SEGMENTS times more
+        size = segment.last - segment.first + 1
+        tier = 0
+        while size > self.flush_size:
+            size //= MERGE_SEGMENTS
+            tier += 1
+        return tier
+
+    def merge(self, full=False):
+        '''
+        Merges the most recent segments, once :data:`MERGE_SEGMENTS` of
+        them are in the same tier, repeating as long as the merged
+        segment completes the tier above. Older, larger segments are
+        left as they are.
+
+        :param full: if True, merge all segments into one instead.
+        '''
+        with self._lock:
+            if full:
+                self._merge(self._segments)
+                return
+
+            while len(self._segments) >= MERGE_SEGMENTS:
+                tier = self._tier(self._segments[-1])
+                count = 1
+                for segment in reversed(self._segments[:-1]):
+                    if self._tier(segment) != tier:
+                        break
+                    count += 1
+
+                if count < MERGE_SEGMENTS:
+                    break
+
+                self._merge(self._segments[-count:])
+
+    def _merge(self, segments):
+        '''
+        Merges segments, a run of consecutive segments ending with the
+        most recent one, into one.
+        '''
+        with self._lock:
+            if len(segments) < 2:
+                return
+
+            path = self._path('seg-%08d' % (self._next_segment(), ))
+            terms = sorted(set().union(*[segment.terms
+                                         for segment in segments]))
+
+            def postings():
+                # segments hold increasing doc ids, so postings are merged
+                # by concatenating them in segment order
+                for term in terms:
+                    yield term, ''.join(filter(None, [
+                        segment.postings(term) for segment in segments]))
+
+            _Segment.write(path, segments[0].first, segments[-1].last,
+                           postings())
+
+            self._segments = self._segments[:-len(segments)] + \
+                [_Segment(path)]
+
+            for segment in segments:
+                segment.remove()
+
+            log.debug('Merged %d segments into %s', len(segments), path)
+
+    def _postings(self, term):
+        '''
+        Returns a dictionary mapping each doc containing term to the
+        positions of term in it.
+        '''
+        docs = {}
+
+        for segment in self._segments:
+            data = segment.postings(term)
+            if data:
+                docs.update(_decode(data))
+
+        data = self._buffer.get(term)
+        if data:
+            docs.update(_decode(data.tostring()))
+
+        return docs
+
+    def _prefixed(self, prefix):
+        terms = set(term for term in self._buffer if term.startswith(prefix))
+
+        for segment in self._segments:
+            terms.update(segment.prefixed(prefix))
+
+        docs = set()
+        for term in terms:
+            docs.update(self._postings(term))
+
+        return docs
+
+    def _phrase(self, tokens):
+        postings = [self._postings(token) for token in tokens]
+        docs = set(postings[0])
+
+        for token_postings in postings[1:]:
+            docs.intersection_update(token_postings)
+
+        if len(tokens) == 1:
+            return docs
+
+        matches = set()
+        for doc in docs:
+            following = [set(token_postings[doc])
+                         for token_postings in postings[1:]]
+
+            for position in postings[0][doc]:
+                if all(position + i + 1 in token_positions
+                       for i, token_positions in enumerate(following)):
+                    matches.add(doc)
+                    break
+
+        return matches
+
+    def search(self, query):
+        '''
+        Returns the sorted ids of the messages matching every term of
+        query.
+        '''
+        clauses = []
+
+        for phrase, word in _QUERY.findall(query):
+            prefix = word.endswith('*')
+            tokens = [token for _, token in tokenize(phrase or word)]
+
+            if not tokens:
+                continue
+
+            clauses.append((prefix and len(tokens) == 1, tokens))
+
+        if not clauses:
+            return []
+
+        docs = None
+
+        with self._lock:
+            for prefix, tokens in clauses:
+                if prefix:
+                    matches = self._prefixed(tokens[0])
+                else:
+                    matches = self._phrase(tokens)
+
+                docs = matches if docs is None else docs & matches
+                if not docs:
+                    break
+
+        return sorted(docs)
+
+    def get(self, doc, compact=False, _burp=None):
+        '''
+        Loads the stored message with id doc, as an
+        :class:`~gds.burp.models.HttpRequest` or, if compact is True, an
+        :class:`~gds.burp.models.HttpRecord`.
+        '''
+        return decode(self._record(doc), compact, _burp)
+
+    def find(self, query, compact=False, _burp=None):
+        '''
+        Lazily yields the stored messages matching query, in the order
+        they were added.
+        '''
+        for doc in self.search(query):
+            yield self.get(doc, compact, _burp)
+
+    def close(self):
+        with self._lock:
+            self.flush()
+
+            for segment in self._segments:
+                segment.close()
+
+            self._docs.close()
+            self._offsets_fp.close()
+            self._reader.close()
+
+
+class FullTextIndexer(Component):
+    '''
+    Adds every proxy response (and its request) to a
+    :class:`FullTextIndex`. Messages are copied on the proxy thread and
+    indexed on a background thread, which also writes the index out to
+    disk whenever the proxy has been idle for a few seconds, and when
+    the extension is unloaded.
+    '''
+    implements(IProxyResponseHandler)
+
+    directory = PathOption('search', 'directory', 'search',
+        '''Directory holding the full-text index, relative to the
+        configuration file.''')
+
+    flush_size = IntOption('search', 'flush_size', FLUSH_SIZE,
+        '''Number of messages buffered in memory before they are
+        written to the index on disk.''')
+
+    queue_size = IntOption('search', 'queue_size', 10000,
+        '''Number of messages waiting to be indexed before the proxy
+        blocks until the indexer has caught up.''')
+
+    flush_interval = 5
+
+    def __init__(self):
+        self.index = FullTextIndex(self.directory, self.flush_size)
+        self._queue = Queue(self.queue_size)
+
+        self._thread = Thread(target=self._run, name='jython-search-index')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def processResponse(self, request):
+        # copy the messages now, as Burp reuses them once we return
+        self._queue.put(encode(request))
+
+    def close(self):
+        '''
+        Indexes the messages still queued, stops the background thread
+        and closes the index, writing it out to disk.
+        '''
+        self._queue.put(None)
+        self._thread.join()
+        self.index.close()
+
+    def _run(self):
+        while True:
+            try:
+                record = self._queue.get(timeout=self.flush_interval)
+            except Empty:
+                try:
+                    self.index.flush()
+                except Exception:
+                    self.log.exception('Error flushing full-text index')
+                continue
+
+            if record is None:
+                return
+
+            try:
+                self.index.add(record)
+            except Exception:
+                self.log.exception('Error indexing message')
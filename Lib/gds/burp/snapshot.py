@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+'''
+gds.burp.snapshot
+~~~~~~~~~~~~~~~~~
+
+Compact, versioned binary format for request/response pairs, used to
+checkpoint and reload history, and to pickle
+:class:`~gds.burp.models.HttpRequest` objects.
+
+A snapshot starts with :data:`MAGIC` followed by a version byte, then
+holds any number of records. Each record is prefixed with its length,
+so records can be streamed one at a time::
+
+    >>> from gds.burp.snapshot import dump_many, load_many
+    >>> with open('history.snap', 'wb') as fp:
+    ...     dump_many(Burp.getProxyHistory(), fp)
+    >>> with open('history.snap', 'rb') as fp:
+    ...     for request in load_many(fp):
+    ...         print request.url.geturl()
+'''
+from cStringIO import StringIO
+import struct
+
+from .models import HttpRecord, HttpRequest
+
+
+__all__ = ['dump', 'dump_many', 'dumps', 'load', 'load_many', 'loads',
+           'SnapshotError', ]
+
+MAGIC = 'GDSBURP'
+VERSION = 1
+
+_HEADER = MAGIC + chr(VERSION)
+
+_FLAG_HTTPS = 0x01
+_FLAG_RESPONSE = 0x02
+# the request is None, rather than empty; records without the flag
+# always have a request
+_FLAG_NO_REQUEST = 0x04
+
+_B = struct.Struct('>B')
+_H = struct.Struct('>H')
+_I = struct.Struct('>I')
+# flags, port
+_FIXED = struct.Struct('>BH')
+
+
+class SnapshotError(ValueError):
+    '''Raised when a snapshot is malformed or of an unknown version.'''
+
+
+def _utf8(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def _fields(item):
+    '''
+    Returns the raw request, raw response, host, port, protocol, comment
+    and highlight of an :class:`~gds.burp.models.HttpRequest`,
+    :class:`~gds.burp.models.HttpRecord` or IHttpRequestResponse.
+    '''
+    if isinstance(item, HttpRequest):
+        return (item.raw, item.response.raw, item.host, item.port,
+                item.protocol, item.comment, item.highlight)
+
+    if isinstance(item, HttpRecord):
+        return (item.raw, item.response_raw, item.host, item.port,
+                item.protocol, item.comment, item.highlight)
+
+    request = item.getRequest()
+    response = item.getResponse()
+
+    return (request.tostring() if request is not None else None,
+            response.tostring() if response is not None else None,
+            item.getHost(), item.getPort(), item.getProtocol(),
+            item.getComment(), item.getHighlight())
+
+
+def encode(item):
+    '''
+    Encodes a single request/response pair as a record (without the
+    length prefix).
+    '''
+    request, response, host, port, protocol, comment, highlight = \
+        _fields(item)
+
+    flags = 0
+    if protocol == 'https':
+        flags |= _FLAG_HTTPS
+    if response is not None:
+        flags |= _FLAG_RESPONSE
+    if request is None:
+        flags |= _FLAG_NO_REQUEST
+        request = ''
+
+    host = _utf8(host)
+    comment = _utf8(comment)
+    highlight = _utf8(highlight)
+
+    parts = [_FIXED.pack(flags, port or 0),
+             _H.pack(len(host)), host,
+             _I.pack(len(comment)), comment,
+             _B.pack(len(highlight)), highlight,
+             _I.pack(len(request)), request]
+
+    if response is not None:
+        parts.extend((_I.pack(len(response)), response))
+
+    return ''.join(parts)
+
+
+def decode(record, compact=False, _burp=None):
+    '''
+    Decodes a record (without the length prefix) into an
+    :class:`~gds.burp.models.HttpRequest`, or an
+    :class:`~gds.burp.models.HttpRecord` if `compact` is True. Messages
+    are not parsed until they are accessed.
+    '''
+    try:
+        flags, port = _FIXED.unpack_from(record, 0)
+        pos = _FIXED.size
+
+        values = []
+        for prefix in (_H, _I, _B, _I):
+            length, = prefix.unpack_from(record, pos)
+            pos += prefix.size
+            values.append(record[pos:pos + length])
+            pos += length
+
+        response = None
+        if flags & _FLAG_RESPONSE:
+            length, = _I.unpack_from(record, pos)
+            pos += _I.size
+            response = record[pos:pos + length]
+            pos += length
+    except struct.error, e:
+        raise SnapshotError('Truncated record: %s' % (e, ))
+
+    host, comment, highlight, request = values
+    if flags & _FLAG_NO_REQUEST:
+        request = None
+
+    protocol = 'https' if flags & _FLAG_HTTPS else 'http'
+
+    host = host.decode('utf-8')
+    comment = comment.decode('utf-8') or None
+    highlight = highlight or None
+
+    if compact:
+        item = HttpRecord.from_raw(request, response, host, port, protocol)
+    else:
+        item = HttpRequest.from_raw(request, response, host, port, protocol,
+                                    _burp=_burp)
+
+    item.comment = comment
+    item.highlight = highlight
+    return item
+
+
+def _read_header(fp):
+    header = fp.read(len(_HEADER))
+
+    if not header.startswith(MAGIC) or len(header) != len(_HEADER):
+        raise SnapshotError('Not a snapshot')
+
+    if ord(header[-1]) != VERSION:
+        raise SnapshotError('Unsupported snapshot version %d' % (
+                            ord(header[-1]), ))
+
+
+def dump_many(items, fp):
+    '''
+    Writes a snapshot of items to the file-like object fp, one record at
+    a time. items may be any iterable of
+    :class:`~gds.burp.models.HttpRequest`,
+    :class:`~gds.burp.models.HttpRecord` or IHttpRequestResponse objects,
+    e.g. a generator such as :meth:`BurpExtender.getProxyHistory`.
+
+    :returns: the number of records written.
+    '''
+    fp.write(_HEADER)
+
+    count = 0
+    for item in items:
+        record = encode(item)
+        fp.write(_I.pack(len(record)))
+        fp.write(record)
+        count += 1
+
+    return count
+
+
+def load_many(fp, compact=False, _burp=None):
+    '''
+    Lazily yields the request/response pairs in the snapshot read from
+    the file-like object fp, one record at a time.
+
+    :param compact: if True, yield :class:`~gds.burp.models.HttpRecord`
+        rather than :class:`~gds.burp.models.HttpRequest` objects.
+    '''
+    _read_header(fp)
+
+    while True:
+        prefix = fp.read(_I.size)
+        if not prefix:
+            return
+
+        if len(prefix) != _I.size:
+            raise SnapshotError('Truncated record length')
+
+        length, = _I.unpack(prefix)
+        record = fp.read(length)
+
+        if len(record) != length:
+            raise SnapshotError('Truncated record')
+
+        yield decode(record, compact, _burp)
+
+
+def dump(item, fp):
+    '''Writes a snapshot holding a single item to fp.'''
+    dump_many((item, ), fp)
+
+
+def load(fp, compact=False, _burp=None):
+    '''Reads the first item of the snapshot in fp.'''
+    for item in load_many(fp, compact, _burp):
+        return item
+
+    raise SnapshotError('Empty snapshot')
+
+
+def dumps(item):
+    '''Returns a snapshot holding a single item, as a string.'''
+    fp = StringIO()
+    dump(item, fp)
+    return fp.getvalue()
+
+
+def loads(data, compact=False, _burp=None):
+    '''Reads the first item of the snapshot in the string data.'''
+    return load(StringIO(data), compact, _burp)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+'''
+gds.burp.stats
+~~~~~~~~~~~~~~
+
+Call counts, error counts and latency histograms for each handler, as
+recorded by the dispatchers, to find the handlers slowing the proxy
+down::
+
+    >>> print Burp.handler_stats
+    >>> Burp.stats()['proxy.response']['SlowHandler']['p99_ms']
+    >>> open('/tmp/stats.json', 'w').write(Burp.handler_stats.dumps())
+
+Counters are ``java.util.concurrent.atomic`` values, updated without
+locks by whichever Burp thread calls the handler. Latencies are counted
+in buckets of powers of two microseconds, so percentiles are upper
+bounds accurate to within a factor of two (and no more than the slowest
+call).
+'''
+from java.lang import System
+from java.util.concurrent.atomic import AtomicLong, AtomicLongArray
+
+import json
+
+
+__all__ = ['Counters', 'HandlerStats', 'nanotime', ]
+
+# bucket i counts calls that took less than 2 ** i microseconds (and at
+# least 2 ** (i - 1)); the last bucket counts anything slower
+BUCKETS = 28
+
+PERCENTILES = (50, 90, 99, )
+
+nanotime = System.nanoTime
+
+
+class Counters(object):
+    '''
+    Call, error and latency counters of a single handler, and the
+    number of calls skipped while its circuit breaker was open.
+    '''
+    __slots__ = ('calls', 'errors', 'skipped', 'total', 'slowest',
+                 'buckets', )
+
+    def __init__(self):
+        self.calls = AtomicLong()
+        self.errors = AtomicLong()
+        self.skipped = AtomicLong()
+        self.total = AtomicLong()
+        self.slowest = AtomicLong()
+        self.buckets = AtomicLongArray(BUCKETS)
+
+    def __repr__(self):
+        return '<Counters [%d calls]>' % (self.calls.get(), )
+
+    def record(self, elapsed, error=False):
+        '''
+        Counts a call that took elapsed nanoseconds, and whether it
+        raised.
+        '''
+        self.calls.incrementAndGet()
+        if error:
+            self.errors.incrementAndGet()
+
+        self.total.addAndGet(elapsed)
+
+        slowest = self.slowest.get()
+        while elapsed > slowest and \
+            not self.slowest.compareAndSet(slowest, elapsed):
+            slowest = self.slowest.get()
+
+        bucket = min(int(elapsed // 1000).bit_length(), BUCKETS - 1)
+        self.buckets.incrementAndGet(bucket)
+
+    def skip(self):
+        '''
+        Counts a call that was not made.
+        '''
+        self.skipped.incrementAndGet()
+
+    def snapshot(self):
+        '''
+        Returns the counters as a dictionary of plain values, with times
+        in milliseconds.
+        '''
+        buckets = [self.buckets.get(i) for i in xrange(BUCKETS)]
+        calls = sum(buckets)
+        total = self.total.get()
+
+        stats = {
+            'calls': self.calls.get(),
+            'errors': self.errors.get(),
+            'skipped': self.skipped.get(),
+            'total_ms': total / 1e6,
+            'mean_ms': total / 1e6 / calls if calls else 0.0,
+            'max_ms': self.slowest.get() / 1e6,
+            # upper bound (ms) of each non-empty bucket -> calls
+            'histogram': [[(1 << i) / 1e3, count]
+                          for i, count in enumerate(buckets) if count],
+            }
+
+        # a bucket's upper bound may be above the slowest call in it
+        for percentile in PERCENTILES:
+            stats['p%d_ms' % (percentile, )] = min(_percentile(
+                buckets, calls, percentile), stats['max_ms'])
+
+        return stats
+
+    def reset(self):
+        self.calls.set(0)
+        self.errors.set(0)
+        self.skipped.set(0)
+        self.total.set(0)
+        self.slowest.set(0)
+        for i in xrange(BUCKETS):
+            self.buckets.getAndSet(i, 0)
+
+
+def _percentile(buckets, calls, percentile):
+    if not calls:
+        return 0.0
+
+    rank = calls * percentile / 100.0
+    seen = 0
+
+    for i, count in enumerate(buckets):
+        seen += count
+        if seen >= rank:
+            return (1 << i) / 1e3
+
+    return (1 << (BUCKETS - 1)) / 1e3
+
+
+class HandlerStats(object):
+    '''
+    :class:`Counters` of each handler, by dispatch point (e.g.
+    "proxy.response" or "scanner.issue") and handler class name.
+    '''
+    def __init__(self):
+        self._counters = {}
+
+    def __repr__(self):
+        return '<HandlerStats [%d handlers]>' % (len(self._counters), )
+
+    def __str__(self):
+        rows = [(stats['total_ms'], point, name, stats)
+                for point, handlers in self.snapshot().iteritems()
+                for name, stats in handlers.iteritems()]
+        rows.sort(reverse=True)
+
+        lines = ['%-20s %-30s %9s %7s %8s %10s %9s %9s %9s' % (
+                 'point', 'handler', 'calls', 'errors', 'skipped',
+                 'total ms', 'p50 ms', 'p99 ms', 'max ms', )]
+
+        for _, point, name, stats in rows:
+            lines.append('%-20s %-30s %9d %7d %8d %10.1f %9.3f %9.3f %9.3f'
+                         % (point, name, stats['calls'], stats['errors'],
+                            stats['skipped'], stats['total_ms'],
+                            stats['p50_ms'], stats['p99_ms'],
+                            stats['max_ms'], ))
+
+        return '\n'.join(lines)
+
+    def counters(self, point, name):
+        '''
+        Returns the :class:`Counters` of handler name at point, creating
+        them on first use.
+        '''
+        key = point, name
+        counters = self._counters.get(key)
+
+        if counters is None:
+            counters = self._counters.setdefault(key, Counters())
+
+        return counters
+
+    def snapshot(self):
+        '''
+        Returns ``{point: {handler: stats}}`` for every handler called so
+        far, see :meth:`Counters.snapshot`.
+        '''
+        stats = {}
+        for (point, name), counters in self._counters.items():
+            stats.setdefault(point, {})[name] = counters.snapshot()
+        return stats
+
+    def dumps(self, **kwargs):
+        '''
+        Returns :meth:`snapshot` as JSON.
+        '''
+        return json.dumps(self.snapshot(), sort_keys=True, **kwargs)
+
+    def reset(self):
+        for counters in self._counters.values():
+            counters.reset()
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+'''
+gds.burp.store
+~~~~~~~~~~~~~~
+
+Append-only store of request/response pairs on disk, read back through
+memory-mapped segment files.
+
+Messages are appended to segment files as snapshot records (see
+:mod:`gds.burp.snapshot`), and their positions are kept in a compact
+offset index. Stored messages are returned as views over the mapped
+segments: wrapping them in :class:`~gds.burp.models.HttpRequest` or
+:class:`~gds.burp.models.HttpRecord` only copies the headers and body
+out of the mapping when they are read, so the heap stays flat however
+many messages are held::
+
+    >>> store = MessageStore('/tmp/engagement')
+    >>> store.extend(Burp._check_and_callback(Burp.getProxyHistory))
+    >>> records = [store.get(i, compact=True) for i in xrange(len(store))]
+'''
+from array import array
+from threading import RLock
+import glob
+import os
+import struct
+
+from java.io import RandomAccessFile
+from java.nio.channels import FileChannel
+
+from .models import HttpRecord, HttpRequest
+from .snapshot import _B, _FIXED, _FLAG_HTTPS, _FLAG_NO_REQUEST, \
+    _FLAG_RESPONSE, _H, _HEADER, _I, _read_header, encode
+from .structures import MappedMessage
+
+
+__all__ = ['MessageStore', 'StoredMessage', ]
+
+# segments are started once the current one reaches this size; a single
+# mapping can't be larger than 2GB
+SEGMENT_SIZE = 512 * 1024 * 1024
+
+_OFFSET = struct.Struct('>Q')
+
+
+class StoredMessage(object):
+    '''
+    Read-only IHttpRequestResponse over a message in a
+    :class:`MessageStore`. The request and response are
+    :class:`~gds.burp.structures.MappedMessage` views, not copies.
+    '''
+    __slots__ = ('host', 'port', 'protocol', 'comment', 'highlight',
+                 'request', 'response', )
+
+    def __init__(self, host, port, protocol, comment, highlight, request,
+                 response):
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.comment = comment
+        self.highlight = highlight
+        self.request = request
+        self.response = response
+
+    def __repr__(self):
+        return '<StoredMessage %s://%s:%d>' % (self.protocol, self.host,
+                                              self.port, )
+
+    def getHost(self):
+        return self.host
+
+    def getPort(self):
+        return self.port
+
+    def getProtocol(self):
+        return self.protocol
+
+    def getComment(self):
+        return self.comment
+
+    def getHighlight(self):
+        return self.highlight
+
+    def getRequest(self):
+        return self.request
+
+    def getResponse(self):
+        return self.response
+
+    def getUrl(self):
+        # derived from the request line by HttpRequest
+        return None
+
+
+class _Segment(object):
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self._buffer = None
+        self._mapped = 0
+
+    def buffer(self, end):
+        '''
+        Returns a read-only mapping of the segment covering at least the
+        first end bytes, remapping it if it has grown since.
+        '''
+        if self._buffer is None or end > self._mapped:
+            fp = RandomAccessFile(self.path, 'r')
+            try:
+                size = fp.length()
+                self._buffer = fp.getChannel().map(
+                    FileChannel.MapMode.READ_ONLY, 0, size)
+                self._mapped = size
+            finally:
+                # the mapping stays valid after the file is closed
+                fp.close()
+
+        return self._buffer
+
+
+class MessageStore(object):
+    '''
+    Append-only, memory-mapped store of request/response pairs.
+
+    :param directory: directory holding the store, created if needed.
+    :param segment_size: size at which a new segment file is started.
+    '''
+    def __init__(self, directory, segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self._lock = RLock()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._segments = [_Segment(path) for path in
+                          sorted(glob.glob(self._path('seg-*.snap')))]
+
+        for segment in self._segments:
+            with open(segment.path, 'rb') as fp:
+                _read_header(fp)
+
+        # positions are (segment number << 32) | offset in segment
+        self._positions = array('l')
+
+        index = self._path('store.idx')
+        if os.path.exists(index):
+            with open(index, 'rb') as fp:
+                data = fp.read()
+
+            count = len(data) // _OFFSET.size
+            self._positions.extend(struct.unpack(
+                '>%dQ' % (count, ), data[:count * _OFFSET.size]))
+
+            # drop positions of records that never made it to disk
+            while self._positions and not self._written(
+                    self._positions[-1]):
+                self._positions.pop()
+
+            if len(data) != len(self._positions) * _OFFSET.size:
+                with open(index, 'r+b') as fp:
+                    fp.truncate(len(self._positions) * _OFFSET.size)
+
+        self._index = open(index, 'ab')
+        self._writer = None
+
+    def __repr__(self):
+        return '<MessageStore %s [%d messages, %d segments]>' % (
+            self.directory, len(self), len(self._segments), )
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __getitem__(self, i):
+        '''
+        Returns the :class:`StoredMessage` at position i.
+        '''
+        position = self._positions[i]
+        segment = self._segments[position >> 32]
+        offset = position & 0xffffffff
+
+        with self._lock:
+            if self._writer is not None and \
+                self._writer.name == segment.path:
+                self._writer.flush()
+
+            buffer = segment.buffer(offset + _I.size)
+            length, = _I.unpack(MappedMessage(buffer, offset, _I.size)[:])
+            buffer = segment.buffer(offset + _I.size + length)
+
+        return _read_record(MappedMessage(buffer, offset + _I.size, length))
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _written(self, position):
+        segment = position >> 32
+        return segment < len(self._segments) and \
+            (position & 0xffffffff) < self._segments[segment].size
+
+    def _segment_for(self, size):
+        segment = self._segments[-1] if self._segments else None
+
+        if segment is None or segment.size + size > self.segment_size:
+            if self._writer is not None:
+                self._writer.close()
+
+            path = self._path('seg-%08d.snap' % (len(self._segments), ))
+            with open(path, 'wb') as fp:
+                fp.write(_HEADER)
+
+            segment = _Segment(path)
+            self._segments.append(segment)
+            self._writer = None
+
+        if self._writer is None:
+            self._writer = open(segment.path, 'ab')
+
+        return segment
+
+    def append(self, item):
+        '''
+        Appends a request/response pair: an
+        :class:`~gds.burp.models.HttpRequest`,
+        :class:`~gds.burp.models.HttpRecord`, IHttpRequestResponse, or a
+        record already encoded by :func:`gds.burp.snapshot.encode`.
+
+        :returns: the position of the message in the store.
+        '''
+        record = item if isinstance(item, str) else encode(item)
+
+        with self._lock:
+            segment = self._segment_for(_I.size + len(record))
+            position = ((len(self._segments) - 1) << 32) | segment.size
+
+            self._writer.write(_I.pack(len(record)))
+            self._writer.write(record)
+            segment.size += _I.size + len(record)
+
+            self._index.write(_OFFSET.pack(position))
+            self._positions.append(position)
+
+            return len(self._positions) - 1
+
+    def extend(self, items):
+        '''
+        Appends each of items. See :meth:`append`.
+
+        :returns: the number of messages appended.
+        '''
+        count = 0
+        for item in items:
+            self.append(item)
+            count += 1
+
+        self.flush()
+        return count
+
+    def get(self, i, compact=False, _burp=None):
+        '''
+        Returns the message at position i as an
+        :class:`~gds.burp.models.HttpRequest` or, if compact is True, an
+        :class:`~gds.burp.models.HttpRecord`, over the mapped segment.
+        '''
+        if compact:
+            return HttpRecord(self[i])
+
+        return HttpRequest(self[i], _burp=_burp)
+
+    def flush(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.flush()
+            self._index.flush()
+
+    def close(self):
+        with self._lock:
+            self.flush()
+
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+            self._index.close()
+
+
+def _read_record(record):
+    '''
+    Reads the service metadata of a snapshot record held in a
+    :class:`~gds.burp.structures.MappedMessage`, and returns a
+    :class:`StoredMessage` with views over its request and response.
+    '''
+    flags, port = _FIXED.unpack(record[0:_FIXED.size])
+    pos = _FIXED.size
+
+    values = []
+    for prefix in (_H, _I, _B):
+        length, = prefix.unpack(record[pos:pos + prefix.size])
+        pos += prefix.size
+        values.append(record[pos:pos + length])
+        pos += length
+
+    host, comment, highlight = values
+
+    length, = _I.unpack(record[pos:pos + _I.size])
+    pos += _I.size
+    request = None
+    if not flags & _FLAG_NO_REQUEST:
+        request = MappedMessage(record.buffer, record.offset + pos, length)
+    pos += length
+
+    response = None
+    if flags & _FLAG_RESPONSE:
+        length, = _I.unpack(record[pos:pos + _I.size])
+        pos += _I.size
+        response = MappedMessage(record.buffer, record.offset + pos, length)
+
+    return StoredMessage(host.decode('utf-8'), port,
+                         'https' if flags & _FLAG_HTTPS else 'http',
+                         comment.decode('utf-8') or None, highlight or None,
+                         request, response)
@@ -7,58 +7,142 @@ Data structures used by HttpRequest and HttpResponse.
 
 Based on kennethreitz/requests (used with permission). Thanks Kenneth!
 '''
+from array import array
 from collections import OrderedDict
 
 
+# bytes copied out of a byte[] at a time when searching it
+SCAN_SIZE = 64 * 1024
+
+
 class CaseInsensitiveDict(OrderedDict):
     """Case-insensitive Dictionary
 
     For example, ``headers['content-encoding']`` will return the
-    value of a ``'Content-Encoding'`` response header."""
+    value of a ``'Content-Encoding'`` response header.
+
+    The lower-cased names are kept in a persistent index, so inserts
+    and lookups never have to rebuild it. A name may hold more than one
+    value (see :meth:`add` and :meth:`getlist`): the dictionary holds
+    its values joined with ", ", leaving out repeats of the same value,
+    and each value is kept beside it.
+
+    It is an OrderedDict, so that it still is a dict (e.g. to `json` and
+    isinstance checks) that keeps headers in order. OrderedDict
+    instances have a ``__dict__`` of their own, so it has no
+    ``__slots__``, which would save nothing."""
+
+    def __init__(self, data=None, **kwargs):
+        # lower-cased key -> key as first added
+        self._lower_keys = {}
+        # lower-cased key -> [value, ...]
+        self._values = {}
+
+        OrderedDict.__init__(self)
+
+        if data is not None:
+            self.extend(data)
+
+        if kwargs:
+            self.extend(kwargs)
+
+    def __reduce__(self):
+        return self.__class__, (list(self.iterallitems()), )
 
     def __repr__(self):
         return super(CaseInsensitiveDict, self).__repr__()
 
     def __str__(self):
         return '\r\n'.join(
-            ': '.join((key, value)) for key, value in self.iteritems())
+            ': '.join((key, value)) for key, value in self.iterallitems())
 
     @property
     def lower_keys(self):
-        if not hasattr(self, '_lower_keys') or not self._lower_keys:
-            self._lower_keys = dict((k.lower(), k) for k in self.iterkeys())
         return self._lower_keys
 
-    def _clear_lower_keys(self):
-        if hasattr(self, '_lower_keys'):
-            self._lower_keys.clear()
-
     def __setitem__(self, key, value):
-        if key in self:
-            del self[key]
+        # a key that is already there keeps its position and case
+        lower = key.lower()
+        key = self._lower_keys.get(lower, key)
 
-        super(CaseInsensitiveDict, self).__setitem__(key, value)
-        self._clear_lower_keys()
+        # OrderedDict only links keys that aren't in self yet
+        OrderedDict.__setitem__(self, key, value)
+        self._lower_keys[lower] = key
+        self._values[lower] = [value]
 
     def __delitem__(self, key):
-        super(CaseInsensitiveDict, self).__delitem__(
-            self.lower_keys.get(key.lower(), key))
-        self._lower_keys.clear()
+        lower = key.lower()
+        if lower not in self._lower_keys:
+            raise KeyError(key)
+
+        del self._values[lower]
+        OrderedDict.__delitem__(self, self._lower_keys.pop(lower))
 
     def __contains__(self, key):
-        return key.lower() in self.lower_keys
+        return key.lower() in self._lower_keys
 
     def __getitem__(self, key):
         # We allow fall-through here, so values default to None
-        if key in self:
-            return super(CaseInsensitiveDict, self).__getitem__(
-                self.lower_keys[key.lower()])
+        key = self._lower_keys.get(key.lower())
+        if key is not None:
+            return OrderedDict.__getitem__(self, key)
+
+    def add(self, key, value):
+        """Adds value to key, keeping any values it already has."""
+        key = self._lower_keys.get(key.lower(), key)
+        if key not in self:
+            self[key] = value
+            return
+
+        self._values[key.lower()].append(value)
+
+        joined = OrderedDict.__getitem__(self, key)
+        if joined != value:
+            OrderedDict.__setitem__(self, key, ', '.join((joined, value)))
+
+    def extend(self, data):
+        """Adds every ``(key, value)`` pair from data, which may be a
+        mapping or an iterable of pairs. Repeated keys keep all their
+        values."""
+        if isinstance(data, (CaseInsensitiveDict, HeadersView)):
+            data = data.iterallitems()
+        elif hasattr(data, 'iteritems'):
+            data = data.iteritems()
+
+        for key, value in data:
+            self.add(key, value)
 
     def get(self, key, default=None):
         if key in self:
             return self[key]
         return default
 
+    def getlist(self, key):
+        """Returns every value of key, in the order they were added."""
+        return list(self._values.get(key.lower(), ()))
+
+    def iterallitems(self):
+        """Yields a ``(key, value)`` pair for every value, including
+        each value of a repeated key."""
+        for key in self:
+            for value in self._values[key.lower()]:
+                yield key, value
+
+    def clear(self):
+        OrderedDict.clear(self)
+        self._lower_keys.clear()
+        self._values.clear()
+
+
+def _join(values):
+    # as CaseInsensitiveDict.add joins the values of a repeated header
+    joined = values[0]
+    for value in values[1:]:
+        if value != joined:
+            joined = ', '.join((joined, value))
+    return joined
+
+
 class LookupDict(dict):
     """Dictionary lookup object."""
 
@@ -76,3 +160,380 @@ class LookupDict(dict):
 
     def get(self, key, default=None):
         return self.__dict__.get(key, default)
+
+
+class LRUCache(object):
+    """Dictionary holding at most `size` entries, evicting the least
+    recently used entry first."""
+
+    __slots__ = ('size', '_store', )
+
+    def __init__(self, size=1024):
+        self.size = size
+        self._store = OrderedDict()
+
+    def __repr__(self):
+        return '<LRUCache [%d/%d]>' % (len(self._store), self.size, )
+
+    def __contains__(self, key):
+        return key in self._store
+
+    def __len__(self):
+        return len(self._store)
+
+    def __getitem__(self, key):
+        # move the entry to the end, as the most recently used
+        value = self._store.pop(key)
+        self._store[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._store.pop(key, None)
+        self._store[key] = value
+
+        while len(self._store) > self.size:
+            self._store.popitem(last=False)
+
+    def __delitem__(self, key):
+        del self._store[key]
+
+    def get(self, key, default=None):
+        if key in self._store:
+            return self[key]
+        return default
+
+    def keys(self):
+        return self._store.keys()
+
+    def clear(self):
+        self._store.clear()
+
+
+class MessageIndex(object):
+    """Compact parsed form of a raw HTTP message.
+
+    Rather than copying out the start-line, each header and the body,
+    only integer offsets into the original message are kept. Strings
+    are sliced out of the message when they are asked for.
+
+    Header spans are stored in an ``array`` as consecutive groups of
+    four offsets: name start, name end, value start and value end.
+
+    The message may be a string or a byte array (e.g. a Java byte[]),
+    in which case slices are converted to strings."""
+
+    __slots__ = ('message', 'start_line_end', 'body_offset', 'offsets', )
+
+    def __init__(self, message, start_line_end, body_offset, offsets=None):
+        self.message = message
+        self.start_line_end = start_line_end
+        self.body_offset = body_offset
+        self.offsets = offsets if offsets is not None else array('i')
+
+    def __len__(self):
+        return len(self.offsets) // 4
+
+    def __repr__(self):
+        return '<MessageIndex [%d headers]>' % (len(self), )
+
+    def _slice(self, start, end=None):
+        value = self.message[start:end]
+        if isinstance(value, str):
+            return value
+        return value.tostring()
+
+    @property
+    def start_line(self):
+        return self._slice(0, self.start_line_end)
+
+    @property
+    def body(self):
+        return self._slice(self.body_offset)
+
+    def name(self, i):
+        offsets = self.offsets
+        return self._slice(offsets[4 * i], offsets[4 * i + 1])
+
+    def value(self, i):
+        offsets = self.offsets
+        return self._slice(offsets[4 * i + 2], offsets[4 * i + 3])
+
+    def iterheaders(self):
+        for i in xrange(len(self)):
+            yield self.name(i), self.value(i)
+
+
+class MappedMessage(object):
+    """Read-only view of a message held in a ``java.nio.ByteBuffer``,
+    e.g. a memory-mapped file.
+
+    Slicing copies just the requested bytes out of the buffer, as a
+    string, so a :class:`MessageIndex` over a mapped message keeps
+    nothing but offsets on the heap."""
+
+    __slots__ = ('buffer', 'offset', 'length', )
+
+    def __init__(self, buffer, offset, length):
+        self.buffer = buffer
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return '<MappedMessage [%d bytes at %d]>' % (self.length,
+                                                     self.offset, )
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            if step != 1:
+                raise ValueError('MappedMessage slices must be contiguous')
+        else:
+            start = key + self.length if key < 0 else key
+            if not 0 <= start < self.length:
+                raise IndexError('MappedMessage index out of range')
+            stop = start + 1
+
+        return self.tobytes(start, stop).tostring()
+
+    def tobytes(self, start, stop):
+        """Returns a byte[] copy of the bytes from start to stop."""
+        from jarray import zeros
+
+        data = zeros(max(stop - start, 0), 'b')
+
+        # positions are per buffer, so read through a duplicate to allow
+        # concurrent readers
+        buffer = self.buffer.duplicate()
+        buffer.position(self.offset + start)
+        buffer.get(data)
+
+        return data
+
+    def tostring(self):
+        return self[:]
+
+
+class ByteView(object):
+    """Searchable, read-only view of a Java byte[] or a
+    :class:`MappedMessage`, so that large messages can be scanned in
+    place with the ``str`` methods the parsers use.
+
+    :meth:`find` copies at most :data:`SCAN_SIZE` bytes out of the
+    message at a time, and slicing only the bytes asked for."""
+
+    __slots__ = ('message', )
+
+    def __init__(self, message):
+        self.message = message
+
+    def __len__(self):
+        return len(self.message)
+
+    def __repr__(self):
+        return '<ByteView [%d bytes]>' % (len(self), )
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1]
+
+        start, stop, _ = key.indices(len(self.message))
+        return self.tobytes(start, stop).tostring()
+
+    def tobytes(self, start, stop):
+        """Returns a byte[] copy of the bytes from start to stop."""
+        if isinstance(self.message, MappedMessage):
+            return self.message.tobytes(start, stop)
+        return self.message[start:stop]
+
+    def find(self, sub, start=0, end=None):
+        end = len(self) if end is None else min(end, len(self))
+        overlap = len(sub) - 1
+
+        while start < end:
+            stop = min(start + SCAN_SIZE + overlap, end)
+
+            found = self[start:stop].find(sub)
+            if found != -1:
+                return start + found
+
+            if stop == end:
+                break
+
+            # a match may straddle the two windows
+            start = stop - overlap
+
+        return -1
+
+    def startswith(self, prefix, start=0):
+        return self[start:start + len(prefix)] == prefix
+
+
+class AnalyzedMessage(object):
+    """Parsed form of a Java byte[] message, as analyzed by Burp's
+    ``IExtensionHelpers.analyzeRequest`` or ``analyzeResponse``.
+
+    Provides the same interface as :class:`MessageIndex`. Header lines
+    come from Burp, and the body is only copied out of the native array
+    when it is asked for."""
+
+    __slots__ = ('message', 'body_offset', '_lines', '_headers', )
+
+    def __init__(self, message, lines, body_offset):
+        self.message = message
+        self.body_offset = body_offset
+        self._lines = lines
+        self._headers = None
+
+    def __len__(self):
+        return len(self._lines) - 1
+
+    def __repr__(self):
+        return '<AnalyzedMessage [%d headers]>' % (len(self), )
+
+    @property
+    def start_line(self):
+        return _latin1(self._lines[0])
+
+    @property
+    def body(self):
+        return self.message[self.body_offset:].tostring()
+
+    @property
+    def headers(self):
+        if self._headers is None:
+            headers = []
+            for line in self._lines[1:]:
+                name, _, value = _latin1(line).partition(':')
+                headers.append((name.strip(), value.strip()))
+            self._headers = headers
+        return self._headers
+
+    def name(self, i):
+        return self.headers[i][0]
+
+    def value(self, i):
+        return self.headers[i][1]
+
+    def iterheaders(self):
+        return iter(self.headers)
+
+
+class HeadersView(object):
+    """Read-only, case-insensitive view of the headers in a
+    :class:`MessageIndex`.
+
+    Header names are only sliced out of the message on the first
+    lookup, values only when they are asked for. As with
+    :class:`CaseInsensitiveDict`, repeated headers are joined with ", "
+    when looked up by key, and :meth:`getlist` returns each value.
+
+    Unlike :class:`CaseInsensitiveDict`, this is not a ``dict``; use
+    :meth:`copy` where one is needed, e.g. for ``json.dumps``."""
+
+    __slots__ = ('_index', '_lookup', )
+
+    def __init__(self, index):
+        self._index = index
+        self._lookup = None
+
+    def __reduce__(self):
+        return CaseInsensitiveDict, (list(self.iterallitems()), )
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+    def __str__(self):
+        return '\r\n'.join(
+            ': '.join(header) for header in self._index.iterheaders())
+
+    def __eq__(self, other):
+        if not isinstance(other, (HeadersView, dict)):
+            return NotImplemented
+
+        return dict((k.lower(), v) for k, v in self.iteritems()) == \
+            dict((k.lower(), v) for k, v in other.iteritems())
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    @property
+    def lower_keys(self):
+        if self._lookup is None:
+            lookup = OrderedDict()
+            index = self._index
+            for i in xrange(len(index)):
+                lookup.setdefault(index.name(i).lower(), []).append(i)
+            self._lookup = lookup
+        return self._lookup
+
+    def __contains__(self, key):
+        return key.lower() in self.lower_keys
+
+    def __getitem__(self, key):
+        # We allow fall-through here, so values default to None
+        positions = self.lower_keys.get(key.lower())
+        if positions is not None:
+            return _join([self._index.value(i) for i in positions])
+
+    def __setitem__(self, key, value):
+        raise TypeError('%s is read-only' % (self.__class__.__name__, ))
+
+    def __delitem__(self, key):
+        raise TypeError('%s is read-only' % (self.__class__.__name__, ))
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def __len__(self):
+        return len(self.lower_keys)
+
+    def get(self, key, default=None):
+        value = self[key]
+        if value is None:
+            return default
+        return value
+
+    def getlist(self, key):
+        positions = self.lower_keys.get(key.lower(), ())
+        return [self._index.value(i) for i in positions]
+
+    def iterkeys(self):
+        index = self._index
+        for positions in self.lower_keys.itervalues():
+            yield index.name(positions[0])
+
+    def itervalues(self):
+        for key in self.iterkeys():
+            yield self[key]
+
+    def iteritems(self):
+        for key in self.iterkeys():
+            yield key, self[key]
+
+    def iterallitems(self):
+        return self._index.iterheaders()
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def copy(self):
+        return CaseInsensitiveDict(self)
+
+
+def _latin1(text):
+    # Burp decodes message bytes as ISO-8859-1
+    if isinstance(text, unicode):
+        return text.encode('latin-1')
+    return text
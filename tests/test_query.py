@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+'''
+Run with Jython, from the root of the repository::
+
+    jython -Dpython.path=Lib -m unittest discover tests
+'''
+import unittest
+
+from gds.burp.models import HttpRequestResponse, HttpService
+from gds.burp.offline import headless
+from gds.burp.query import Query
+
+
+REQUEST = 'GET /api/v1?page=2 HTTP/1.1\r\nHost: example.com\r\n\r\n'
+RESPONSE = 'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n{}'
+
+
+class QueryIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        item = HttpRequestResponse(REQUEST, RESPONSE, HttpService(
+            host='example.com', port=443, protocol='https'))
+        self.items = [item]
+        self.burp = headless(history=self.items)
+
+    def assertSameResults(self, query):
+        query = Query(query)
+        filtered = len(list(query.filter(self.items)))
+        searched = len(list(query.search(self.burp.history_index)))
+        self.assertEqual(filtered, searched, query)
+        return filtered
+
+    def test_url_pattern(self):
+        self.assertEqual(self.assertSameResults('url~example.com/api'), 1)
+        self.assertEqual(
+            self.assertSameResults('url~^https://example.com/api'), 1)
+        self.assertEqual(self.assertSameResults('url~:443/'), 0)
+
+    def test_indexed_fields(self):
+        self.assertEqual(self.assertSameResults(
+            'host=EXAMPLE.COM path=/api/v1 method=get status=200 '
+            'mime=application/json'), 1)
+        self.assertEqual(self.assertSameResults('status=404'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()